@@ -1,26 +1,147 @@
 import streamlit as st
-from supabase import create_client, Client
 import json
+import os
 import uuid
-import re
 
 # Módulos personalizados
-from modules.database import search_research_data, search_corpus_exact, get_user_projects, create_new_project, update_project_data
+from modules.database import (
+    search_corpus_exact, get_corpus_texts, get_user_projects, create_new_project, get_project, update_project_data,
+    configurar_conexion, crear_cliente_auth, mensaje_error_db
+)
 from modules.ai_engine import (
-    chat_with_ideas, extraer_ficha_de_idea, refinar_ficha_con_ia, generar_indice_desde_fichas, 
-    evaluar_y_crear_prompt_inteligente, execute_final_writing, generar_bibliografia_global,
-    chat_with_primary_source, convert_glosa_to_ficha
+    chat_with_ideas, extraer_ficha_de_idea, refinar_ficha_con_ia, notas_para_prompt,
+    chat_with_primary_source, convert_glosa_to_ficha,
+    estimar_chat_with_ideas, estimar_chat_with_primary_source, estimar_generar_indice
+)
+from modules.structured_output import ERRORES_IA
+from modules.export_utils import (
+    EXPORTADORES, clave_paquete, empaquetar_exportaciones, exportar, exportar_todos, hash_exportacion, leer_exportacion
 )
-from modules.export_utils import generar_documento_word
+from modules.lenguaje_consulta import ConsultaInvalidaError, compilar_consulta
+from modules.estadisticas import MEDIDAS, MAX_N_GRAMA, cargar_obra, colocaciones_de_obras, frecuencias_de_obras, obra_cacheada
+from modules.redaccion import estimar_redaccion
+from modules.cache_rag import buscar_rag, precargar
+from modules.concordancias import CONTEXTO_POR_DEFECTO, FORMATOS, MAX_CONTEXTO, exportar_concordancias, fichero_exportacion
+from modules.versiones_indice import agregar_version, comparar, listar_versiones, reconstruir, tiene_origen
+from modules import tracing, trabajos
+
+def mostrar_estimacion(estimacion):
+    """Muestra el tamaño estimado del prompt antes de enviarlo."""
+    detalle = ", ".join(f"{k}: ~{v:,}" for k, v in estimacion["secciones"].items() if v)
+    icono = "📏" if estimacion["cabe"] else "✂️"
+    aviso = "" if estimacion["cabe"] else " — se recortará por prioridad o se rechazará"
+    st.caption(f"{icono} Prompt estimado: ~{estimacion['total']:,} / {estimacion['presupuesto']:,} tokens{aviso} ({detalle})")
+
+ICONOS_TRABAJO = {"pendiente": "🕒", "ejecutando": "⚙️", "hecho": "✅", "error": "❌", "cancelado": "🚫"}
+
+def encolar_trabajo(tipo, parametros, etiqueta, meta=None):
+    """Encola una operación larga de la IA; el resultado se aplica al proyecto cuando termine."""
+    trabajos.encolar(tipo, parametros, st.session_state.current_project['id'], etiqueta, meta)
+    st.toast(f"⏳ En cola: {etiqueta}")
+
+def _cambios_de_trabajo(t, fresco):
+    """Cambios que aplica un trabajo, calculados sobre la fila recién leída del proyecto y tocando
+    solo su clave: así no se pisan ediciones hechas desde otras sesiones."""
+    resultado, meta = t['resultado'], t['meta'] or {}
+    if t['tipo'] == "indice":
+        if tiene_origen(fresco.get('repositorio_indices'), t['id']):
+            return {}
+        repositorio, resultado = agregar_version(fresco.get('repositorio_indices'), resultado, fresco['nombre'], origen=t['id'])
+        return {"repositorio_indices": repositorio, "estructura_activa": resultado}
+    if t['tipo'] == "prompt_capitulo":
+        prompts_eval = dict(fresco.get('prompts_inteligentes') or {})
+        prompts_eval[meta['nro']] = resultado
+        return {"prompts_inteligentes": prompts_eval}
+    if t['tipo'] == "redaccion_capitulo":
+        cont_actual = dict(fresco.get('contenido_redactado') or {})
+        if not isinstance(resultado, dict):
+            cont_actual[meta['nro']] = resultado
+            return {"contenido_redactado": cont_actual}
+        cont_actual[meta['nro']] = resultado['texto']
+        if 'secciones_redactadas' not in fresco:
+            # Sin la columna (ver database.MIGRACIONES_PROYECTOS) solo se guarda el texto
+            return {"contenido_redactado": cont_actual}
+        secciones = dict(fresco.get('secciones_redactadas') or {})
+        secciones[meta['nro']] = resultado['estado']
+        return {"contenido_redactado": cont_actual, "secciones_redactadas": secciones}
+    if t['tipo'] == "bibliografia":
+        return {"bibliografia": resultado}
+    if t['tipo'] == "fichas_lote":
+        nuevas = resultado['resultados']
+        return {"fichas": [dict(f, **nuevas[f['id']]) if f['id'] in nuevas else f for f in fresco.get('fichas') or []]}
+    return {}
+
+def aplicar_trabajos_terminados(proyecto):
+    """Incorpora al proyecto los resultados de los trabajos terminados. Primero se guarda y solo
+    después se marca el trabajo como aplicado: si la escritura falla, se reintenta en el siguiente rerun."""
+    for t in trabajos.terminados_sin_aplicar(proyecto['id']):
+        try:
+            fresco = get_project(proyecto['id'])
+            cambios = _cambios_de_trabajo(t, fresco)
+            if cambios:
+                update_project_data(proyecto['id'], cambios)
+        except Exception as e:
+            st.warning(f"⚠️ No se pudo guardar el resultado de '{t['etiqueta']}': {mensaje_error_db(e)}. Se reintentará.")
+            continue
+        proyecto.update(cambios)
+        if not trabajos.marcar_aplicado(t['id']):
+            continue
+        resultado, meta = t['resultado'], t['meta'] or {}
+        if t['tipo'] == "redaccion_capitulo" and isinstance(resultado, dict) and not resultado['resumen']['completa']:
+            resumen = resultado['resumen']
+            st.toast(f"♻️ Cap {meta['nro']}: {resumen['redactadas']} secciones redactadas, {resumen['reutilizadas']} reutilizadas")
+        elif t['tipo'] == "fichas_lote":
+            # Ya están guardadas; se reflejan también en las fichas de la sesión para que
+            # "Guardar Progreso" no las devuelva a su versión anterior
+            for f in st.session_state.fichas:
+                if f['id'] in resultado['resultados']:
+                    f.update(resultado['resultados'][f['id']])
+            st.session_state.errores_lote = resultado['errores']
+            st.session_state.resumen_lote = f"{len(resultado['resultados'])} fichas actualizadas, {len(resultado['errores'])} con errores."
+
+@st.fragment(run_every=3)
+def panel_trabajos(proyecto_id):
+    lista = trabajos.trabajos_de(proyecto_id, limite=15)
+    if not lista:
+        st.caption("No hay trabajos en segundo plano.")
+        return
+    if any(t['estado'] == trabajos.HECHO and not t['aplicado'] for t in lista):
+        # Rerun completo: los resultados se aplican al proyecto al principio del script
+        st.rerun()
+    for t in lista:
+        col_t, col_x = st.columns([4, 1])
+        with col_t:
+            st.caption(f"{ICONOS_TRABAJO.get(t['estado'], '')} {t['etiqueta']} · {t['estado']}")
+            if t['error']:
+                st.caption(f"↳ {t['error'][:200]}")
+        with col_x:
+            if t['estado'] in trabajos.ACTIVOS and st.button("✖", key=f"cancelar_{t['id']}", help="Cancelar"):
+                trabajos.cancelar(t['id'])
+
+def mostrar_errores(errores):
+    """Los módulos no dependen de Streamlit: devuelven los errores no fatales y aquí se muestran."""
+    for mensaje in errores:
+        st.error(mensaje)
 
 st.set_page_config(page_title="Investigador de Sinología AI", layout="wide")
 
+# Trazas de rendimiento: se activan con TRAZAS en el entorno o en los secrets (p. ej. "memoria,log")
+if not tracing.habilitado() and st.secrets.get("TRAZAS"):
+    tracing.configurar_desde_cadena(st.secrets["TRAZAS"])
+tracing.iniciar_ejecucion()
+
 try:
-    supabase: Client = create_client(st.secrets["SUPABASE_URL"], st.secrets["SUPABASE_KEY"])
+    configurar_conexion(st.secrets["SUPABASE_URL"], st.secrets["SUPABASE_KEY"])
+    # Un cliente de autenticación por sesión del navegador, no uno nuevo en cada rerun
+    if "cliente_auth" not in st.session_state:
+        st.session_state.cliente_auth = crear_cliente_auth()
+    supabase = st.session_state.cliente_auth
 except Exception as e:
     st.error(f"Error crítico: No se pudo conectar a Supabase. {e}")
     st.stop()
 
+trabajos.iniciar_trabajadores()
+
 # Estilos CSS
 st.markdown("""
     <style>
@@ -41,6 +162,7 @@ if "active_chat_id" not in st.session_state: st.session_state.active_chat_id = N
 if "active_source_id" not in st.session_state: st.session_state.active_source_id = None
 if "resultados_corpus" not in st.session_state: st.session_state.resultados_corpus = None
 if "termino_corpus" not in st.session_state: st.session_state.termino_corpus = ""
+if "claves_obras" not in st.session_state: st.session_state.claves_obras = {}
 
 # --- BARRA LATERAL ---
 with st.sidebar:
@@ -70,7 +192,11 @@ with st.sidebar:
                     except Exception: st.error("Credenciales incorrectas.")
     else:
         st.write(f"Investigador: **{st.session_state.user['email']}**")
-        proyectos = get_user_projects(st.session_state.user['id'])
+        try:
+            proyectos = get_user_projects(st.session_state.user['id'])
+        except Exception as e:
+            st.error(f"Error al cargar los proyectos: {str(e)}")
+            proyectos = []
         nombres = [p['nombre'] for p in proyectos] if proyectos else []
         sel = st.selectbox("Monografías", ["-- Nuevo --"] + nombres)
         
@@ -78,8 +204,12 @@ with st.sidebar:
             with st.form("new_proj"):
                 nuevo_n = st.text_input("Título")
                 if st.form_submit_button("Crear Proyecto"):
-                    create_new_project(st.session_state.user['id'], nuevo_n)
-                    st.rerun()
+                    try:
+                        create_new_project(st.session_state.user['id'], nuevo_n)
+                    except Exception as e:
+                        st.error(f"Fallo en la base de datos al insertar: {mensaje_error_db(e)}")
+                    else:
+                        st.rerun()
         else:
             p_seleccionado = next(p for p in proyectos if p['nombre'] == sel)
             
@@ -107,16 +237,36 @@ with st.sidebar:
             except Exception as e:
                 st.error(f"⚠️ Error al guardar. Detalles: {e}")
             
+        if st.session_state.current_project:
+            with st.expander("⏳ Trabajos en segundo plano", expanded=True):
+                panel_trabajos(st.session_state.current_project['id'])
+
         if st.button("Cerrar Sesión"):
             supabase.auth.sign_out()
             for key in ["user", "current_project", "fichas", "fuentes", "active_chat_id", "active_source_id", "resultados_corpus"]:
                 st.session_state[key] = None if key not in ["fichas", "fuentes"] else []
             st.rerun()
 
+    sink_trazas = tracing.sink_memoria()
+    if sink_trazas:
+        with st.expander("🐞 Depuración de Rendimiento"):
+            pestanas_trazadas = sink_trazas.pestanas()
+            if not pestanas_trazadas:
+                st.caption("Aún no hay operaciones registradas.")
+            for pestana in pestanas_trazadas:
+                st.markdown(f"**{pestana}**")
+                st.dataframe([
+                    {"operación": r["nombre"], "ms": r["duracion_ms"], "tokens prompt": r.get("tokens_prompt"),
+                     "tokens respuesta": r.get("tokens_respuesta"), "error": r.get("error", "")}
+                    for r in sink_trazas.mas_lentas(pestana, n=5)
+                ], hide_index=True, use_container_width=True)
+
 if not st.session_state.current_project:
     st.info("👈 Selecciona o crea un proyecto en la barra lateral para empezar.")
     st.stop()
 
+aplicar_trabajos_terminados(st.session_state.current_project)
+
 # --- NAVEGACIÓN PRINCIPAL ---
 st.title(f"📖 {st.session_state.current_project['nombre']}")
 
@@ -131,6 +281,7 @@ tab_corpus, tab_fuentes, tab_ideas, tab_indices, tab_prompts, tab_redaccion = st
 
 # --- NUEVO: BUSCADOR DE CORPUS (CONCORDANCIAS) ---
 with tab_corpus:
+    tracing.marcar_pestana("corpus")
     st.subheader("🔍 Herramienta de Concordancias (Corpus Lingüístico)")
     st.markdown("Busca apariciones exactas de un término en toda la base de datos y expórtalas al Laboratorio Filológico.")
     
@@ -138,20 +289,28 @@ with tab_corpus:
     with col_c1:
         tablas_corpus = st.multiselect("Bases de datos a explorar:", ["戰國策", "Xunzi", "Mencio", "Analectas de Confucio", "Glosas de 鬼谷子"], key="tablas_corpus")
     with col_c2:
-        termino_busqueda = st.text_input("Término a rastrear:", placeholder="Ej. 情 o páthos")
+        termino_busqueda = st.text_input("Término a rastrear:", placeholder="Ej. 情 · 仁 NEAR/5 義 · 情 NOT 性 · /仁.{0,3}義/",
+                                         help='Operadores: AND (implícito), OR, NOT, NEAR/n, "frase exacta", /regex/ y paréntesis.')
         
     if st.button("Búsqueda Avanzada", type="primary"):
         if not tablas_corpus or not termino_busqueda:
             st.warning("Selecciona al menos una base de datos y escribe un término.")
         else:
             with st.spinner("Rastreando documentos en milisegundos..."):
-                resultados = search_corpus_exact(tablas_corpus, termino_busqueda)
-                st.session_state.resultados_corpus = resultados
-                st.session_state.termino_corpus = termino_busqueda
+                errores_corpus = []
+                try:
+                    resultados = search_corpus_exact(tablas_corpus, termino_busqueda, errores_corpus)
+                except ConsultaInvalidaError as e:
+                    st.error(f"Consulta no válida: {e}")
+                else:
+                    mostrar_errores(errores_corpus)
+                    st.session_state.resultados_corpus = resultados
+                    st.session_state.termino_corpus = termino_busqueda
 
     if st.session_state.get("resultados_corpus"):
         st.divider()
         st.markdown(f"### 🎯 Resultados encontrados para: **{st.session_state.termino_corpus}**")
+        consulta_corpus = compilar_consulta(st.session_state.termino_corpus)
         
         for res_tabla in st.session_state.resultados_corpus:
             st.markdown(f"#### 📁 Archivo: {res_tabla['tabla']} ({len(res_tabla['resultados'])} coincidencias)")
@@ -164,15 +323,13 @@ with tab_corpus:
                     texto_completo = f"[⚠️ El fragmento extraído de la columna '{col_detectada}' está vacío]"
                 
                 term = st.session_state.termino_corpus
-                idx_find = texto_completo.lower().find(term.lower())
+                idx_find = consulta_corpus.primera_posicion(texto_completo)
                 
                 start = max(0, idx_find - 200) if idx_find != -1 else 0
                 end = min(len(texto_completo), start + len(term) + 400)
-                snippet = texto_completo[start:end]
-                if start > 0: snippet = "[...] " + snippet
-                if end < len(texto_completo): snippet = snippet + " [...]"
-                
-                snippet_html = re.sub(f"({re.escape(term)})", r"<mark style='background-color: #ffeb3b; color: black; font-weight: bold; padding: 0 3px;'>\1</mark>", snippet, flags=re.IGNORECASE)
+                snippet_html = consulta_corpus.resaltar(texto_completo[start:end], "<mark style='background-color: #ffeb3b; color: black; font-weight: bold; padding: 0 3px;'>", "</mark>")
+                if start > 0: snippet_html = "[...] " + snippet_html
+                if end < len(texto_completo): snippet_html = snippet_html + " [...]"
                 
                 with st.container():
                     st.markdown(f"<div class='snippet-box'>{snippet_html}</div>", unsafe_allow_html=True)
@@ -191,8 +348,101 @@ with tab_corpus:
                         st.success("¡Exportado con éxito! Ve a la pestaña 'Fuentes Primarias y Glosas'.")
                     st.markdown("<br>", unsafe_allow_html=True)
 
+    # --- EXPORTACIÓN DE CONCORDANCIAS ---
+    st.divider()
+    with st.expander("📤 Exportar todas las concordancias (KWIC)"):
+        st.caption("Recorre todas las coincidencias de la consulta en las bases elegidas, sin el límite de la vista, "
+                   "y las escribe a disco según llegan.")
+        col_x1, col_x2 = st.columns(2)
+        with col_x1:
+            formato_conc = st.selectbox("Formato:", list(FORMATOS), format_func=lambda f: FORMATOS[f]['etiqueta'])
+        with col_x2:
+            contexto_conc = st.number_input("Contexto (caracteres a cada lado)", min_value=5, max_value=MAX_CONTEXTO, value=CONTEXTO_POR_DEFECTO)
+        if st.button("Generar exportación"):
+            if not tablas_corpus or not termino_busqueda:
+                st.warning("Selecciona al menos una base de datos y escribe un término.")
+            else:
+                previa = st.session_state.pop("exportacion_concordancias", None)
+                if previa and os.path.exists(previa['ruta']):
+                    os.remove(previa['ruta'])
+                errores_conc = []
+                with st.spinner("Exportando concordancias..."):
+                    # Solo la ruta queda en la sesión; las líneas van directas al fichero
+                    with fichero_exportacion(formato_conc) as f:
+                        try:
+                            total_conc = exportar_concordancias(tablas_corpus, termino_busqueda, formato_conc, f, contexto_conc, errores_conc)
+                        except ConsultaInvalidaError as e:
+                            st.error(f"Consulta no válida: {e}")
+                            total_conc = None
+                if total_conc is None:
+                    os.remove(f.name)
+                else:
+                    mostrar_errores(errores_conc)
+                    st.session_state.exportacion_concordancias = {"ruta": f.name, "formato": formato_conc, "total": total_conc}
+        exportacion_conc = st.session_state.get("exportacion_concordancias")
+        if exportacion_conc:
+            info_formato = FORMATOS[exportacion_conc['formato']]
+            try:
+                with open(exportacion_conc['ruta'], "rb") as f:
+                    st.download_button(f"⬇️ Descargar {exportacion_conc['total']:,} concordancias ({info_formato['etiqueta']})", f,
+                                       file_name=f"concordancias.{info_formato['extension']}", mime=info_formato['mime'])
+            except FileNotFoundError:
+                # Borrado por antigüedad (ver concordancias.limpiar_exportaciones): hay que regenerarla
+                st.session_state.pop("exportacion_concordancias")
+
+    # --- ESTADÍSTICAS Y COLOCACIONES ---
+    st.divider()
+    with st.expander("📊 Estadísticas del corpus y colocaciones"):
+        col_e1, col_e2, col_e3, col_e4 = st.columns([2, 1, 1, 1.5])
+        with col_e1:
+            termino_estadisticas = st.text_input("Término (literal):", placeholder="Ej. 仁 o 仁義", key="termino_estadisticas")
+        with col_e2:
+            ventana_coloc = st.number_input("Ventana (±car.)", min_value=1, max_value=20, value=5)
+        with col_e3:
+            n_coloc = st.number_input("n-grama", min_value=1, max_value=MAX_N_GRAMA, value=1)
+        with col_e4:
+            medida_coloc = st.selectbox("Ordenar por", list(MEDIDAS), format_func=MEDIDAS.get)
+        min_freq_coloc = st.slider("Frecuencia conjunta mínima", 1, 20, 3)
+
+        if st.button("Calcular estadísticas"):
+            if not tablas_corpus or not termino_estadisticas.strip():
+                st.warning("Selecciona al menos una base de datos y escribe un término.")
+            else:
+                with st.spinner("Cargando y codificando las obras (solo la primera vez)..."):
+                    # La sesión solo guarda la clave de cada obra: los arrays viven en la caché de
+                    # modules.estadisticas y el texto se vuelve a leer solo si la caché ya la descartó
+                    obras = {}
+                    for tabla in tablas_corpus:
+                        clave = st.session_state.claves_obras.get(tabla)
+                        obra = obra_cacheada(clave) if clave else None
+                        if obra is None:
+                            try:
+                                fragmentos = get_corpus_texts(tabla)
+                            except Exception as e:
+                                st.error(f"Error al leer la obra {tabla}: {str(e)}")
+                                continue
+                            if not fragmentos:
+                                continue
+                            obra = cargar_obra(tabla, fragmentos)
+                            st.session_state.claves_obras[tabla] = obra.clave
+                        obras[tabla] = obra
+                    termino = termino_estadisticas.strip()
+
+                    st.markdown("##### Frecuencia y dispersión por obra")
+                    st.caption("DP de Gries: 0 = repartido por igual entre fragmentos, cerca de 1 = concentrado en pocos.")
+                    st.dataframe(frecuencias_de_obras(obras, termino), use_container_width=True)
+
+                    st.markdown(f"##### Colocados de «{termino}» (±{ventana_coloc} caracteres, {n_coloc}-gramas)")
+                    colocados = colocaciones_de_obras(obras, termino, ventana=int(ventana_coloc), n=int(n_coloc),
+                                                      min_frecuencia=min_freq_coloc, medida=medida_coloc)
+                    if colocados:
+                        st.dataframe(colocados, use_container_width=True)
+                    else:
+                        st.info("Sin colocados con esa frecuencia mínima.")
+
 # --- MÓDULO: FUENTES PRIMARIAS Y GLOSAS ---
 with tab_fuentes:
+    tracing.marcar_pestana("fuentes")
     st.subheader("Laboratorio Filológico: Análisis de Fuentes Primarias")
     col_arch, col_perg, col_lab = st.columns([1, 2, 1.5])
     
@@ -264,36 +514,45 @@ with tab_fuentes:
                     if usar_rag_fuente:
                         tablas_f = st.multiselect("Bases de datos:", ["戰國策", "Xunzi", "Mencio", "JSON de investigación", "Glosas de 鬼谷子", "Fuentes secundarias", "Analectas de Confucio"], key="tablas_f")
                         kws_f = st.text_input("Palabras clave (Opcional):", key="kws_f")
+                        precargar(tablas_f, kws_f)
 
                 if len(historial_glosa) > 0:
                     if st.button("🎯 Convertir Conversación en Ficha", use_container_width=True, type="primary"):
                         with st.spinner("Sintetizando hallazgo y exportando al Puzzle..."):
-                            datos_ficha = convert_glosa_to_ficha(historial_glosa, fuente_activa['titulo'])
-                            st.session_state.fichas.append({
-                                "id": str(uuid.uuid4())[:8], 
-                                "texto": datos_ficha.get("texto", "Análisis extraído"), 
-                                "cita_pie": datos_ficha.get("cita_pie", ""),
-                                "referencia_bib": datos_ficha.get("referencia_bib", ""),
-                                "categoria": "Análisis de Fuentes",
-                                "chat_history": historial_glosa.copy(),
-                                "contexto_fijado": fuente_activa['texto_completo'] 
-                            })
-                            fuente_activa["chat_history"] = []
-                            st.success("¡Hallazgo exportado a 'A. Entorno de Ideas'!")
-                            st.rerun()
+                            try:
+                                datos_ficha = convert_glosa_to_ficha(historial_glosa, fuente_activa['titulo'])
+                            except ERRORES_IA as e:
+                                st.error(f"⚠️ No se pudo obtener una ficha válida de la IA: {e}")
+                            else:
+                                st.session_state.fichas.append({
+                                    "id": str(uuid.uuid4())[:8], 
+                                    "texto": datos_ficha.get("texto", "Análisis extraído"), 
+                                    "cita_pie": datos_ficha.get("cita_pie", ""),
+                                    "referencia_bib": datos_ficha.get("referencia_bib", ""),
+                                    "categoria": "Análisis de Fuentes",
+                                    "chat_history": historial_glosa.copy(),
+                                    "contexto_fijado": fuente_activa['texto_completo'] 
+                                })
+                                fuente_activa["chat_history"] = []
+                                st.success("¡Hallazgo exportado a 'A. Entorno de Ideas'!")
+                                st.rerun()
                 
                 chat_container = st.container(height=350)
                 with chat_container:
                     for msg in historial_glosa:
                         with st.chat_message(msg["role"]): st.write(msg["content"])
+                # El mismo contexto RAG para la estimación y para la consulta (buscar_rag lo sirve de la caché)
+                ctx_rag_f = None
+                if usar_rag_fuente and tablas_f:
+                    errores_rag = []
+                    ctx_rag_f = buscar_rag(tablas_f, kws_f, errores_rag)
+                    mostrar_errores(errores_rag)
+                mostrar_estimacion(estimar_chat_with_primary_source(historial_glosa, "", fuente_activa['texto_completo'],
+                                                                    fuente_activa.get('notas_marginales', []), ctx_rag_f))
                 
                 if prompt := st.chat_input("Consulta a la IA sobre el texto..."):
                     historial_glosa.append({"role": "user", "content": prompt})
                     with st.spinner("Analizando texto primario..."):
-                        ctx_rag_f = None
-                        if usar_rag_fuente and tablas_f:
-                            ctx_rag_f = search_research_data(tablas_f, kws_f)
-
                         res = chat_with_primary_source(historial_glosa[:-1], prompt, fuente_activa['texto_completo'], fuente_activa.get('notas_marginales', []), ctx_rag_f)
                         historial_glosa.append({"role": "assistant", "content": res})
                         fuente_activa['chat_history'] = historial_glosa
@@ -339,6 +598,7 @@ with tab_fuentes:
 
 # --- FASE A: CHAT, REFLEXIONES Y TABLERO KANBAN ---
 with tab_ideas:
+    tracing.marcar_pestana("ideas")
     st.subheader("1. Conversación, Reflexiones y Fichas")
     
     st.markdown("**Configuración del Entorno de Ideas:**")
@@ -349,6 +609,8 @@ with tab_ideas:
         tablas_a = st.multiselect("Bases de datos RAG en la nube:", ["戰國策", "Xunzi", "Mencio", "JSON de investigación", "Glosas de 鬼谷子", "Fuentes secundarias", "Analectas de Confucio"], key="tablas_a")
         # MODIFICACIÓN AÑADIDA: El campo es ahora obligatorio para que el RAG funcione
         kws_a = st.text_input("Palabras clave a buscar (Requerido para activar RAG):", key="kws_a")
+        # El contexto se recupera en segundo plano mientras se escribe el mensaje
+        precargar(tablas_a, kws_a)
 
     st.divider()
     col_inputs, col_tablero = st.columns([1, 1.2])
@@ -386,31 +648,43 @@ with tab_ideas:
                     with st.spinner("Releyendo conversación y actualizando ficha..."):
                         chat_text = "\n".join([f"{m['role']}: {m['content']}" for m in historial_actual_a])
                         ctx_rag = ficha_activa_a.get('contexto_fijado', None)
-                        nuevos_datos = extraer_ficha_de_idea(chat_text, estilo_citacion_a, ctx_rag)
-                        
-                        ficha_activa_a['texto'] = nuevos_datos.get("texto", ficha_activa_a['texto'])
-                        ficha_activa_a['cita_pie'] = nuevos_datos.get("cita_pie", ficha_activa_a.get('cita_pie', ''))
-                        ficha_activa_a['referencia_bib'] = nuevos_datos.get("referencia_bib", ficha_activa_a.get('referencia_bib', ''))
-                        st.success("¡Ficha actualizada!")
-                        st.rerun()
+                        try:
+                            nuevos_datos = extraer_ficha_de_idea(chat_text, estilo_citacion_a, ctx_rag)
+                        except ERRORES_IA as e:
+                            st.error(f"⚠️ No se pudo obtener una ficha válida de la IA: {e}")
+                        else:
+                            ficha_activa_a['texto'] = nuevos_datos.get("texto", ficha_activa_a['texto'])
+                            ficha_activa_a['cita_pie'] = nuevos_datos.get("cita_pie", ficha_activa_a.get('cita_pie', ''))
+                            ficha_activa_a['referencia_bib'] = nuevos_datos.get("referencia_bib", ficha_activa_a.get('referencia_bib', ''))
+                            st.success("¡Ficha actualizada!")
+                            st.rerun()
+
+            # El mismo contexto RAG para la estimación y para la consulta (buscar_rag lo sirve de la caché)
+            if st.session_state.active_chat_id is None:
+                errores_rag = []
+                contexto_rag_a = buscar_rag(tablas_a, kws_a, errores_rag) if tablas_a else None
+                mostrar_errores(errores_rag)
+            else:
+                contexto_rag_a = ficha_activa_a.get('contexto_fijado', None)
+            mostrar_estimacion(estimar_chat_with_ideas(historial_actual_a, "", contexto_rag_a))
 
             if prompt_a := st.chat_input("Discute ideas con la IA (Fase Ideas)..."):
                 historial_actual_a.append({"role": "user", "content": prompt_a})
                 with st.spinner("Procesando consulta y anclando fuentes..."):
-                    if st.session_state.active_chat_id is None:
-                        # MODIFICACIÓN AÑADIDA: Aviso de seguridad UX si intentan usar RAG sin palabras clave
-                        if tablas_a and not kws_a.strip():
-                            st.warning("⚠️ Seleccionaste bases de datos, pero no introdujiste palabras clave. La IA no recibirá contexto externo.")
-                        contexto_rag_a = search_research_data(tablas_a, kws_a) if tablas_a else None
-                    else:
-                        contexto_rag_a = ficha_activa_a.get('contexto_fijado', None)
+                    # MODIFICACIÓN AÑADIDA: Aviso de seguridad UX si intentan usar RAG sin palabras clave
+                    if st.session_state.active_chat_id is None and tablas_a and not kws_a.strip():
+                        st.warning("⚠️ Seleccionaste bases de datos, pero no introdujiste palabras clave. La IA no recibirá contexto externo.")
 
                     res = chat_with_ideas(historial_actual_a[:-1], prompt_a, contexto_rag_a)
                     historial_actual_a.append({"role": "assistant", "content": res})
                     
                     if st.session_state.active_chat_id is None:
                         chat_text = f"user: {prompt_a}\nassistant: {res}"
-                        datos_ficha = extraer_ficha_de_idea(chat_text, estilo_citacion_a, contexto_rag_a)
+                        try:
+                            datos_ficha = extraer_ficha_de_idea(chat_text, estilo_citacion_a, contexto_rag_a)
+                        except ERRORES_IA:
+                            # Conservamos la conversación con la pregunta como texto; se puede sintetizar más tarde
+                            datos_ficha = {"texto": prompt_a, "cita_pie": "", "referencia_bib": ""}
                         nuevo_id = str(uuid.uuid4())[:8]
                         st.session_state.fichas.append({
                             "id": nuevo_id, 
@@ -451,6 +725,32 @@ with tab_ideas:
             if n_cat not in st.session_state.categorias:
                 st.session_state.categorias.append(n_cat)
                 st.rerun()
+
+        with st.expander("🗂️ Operaciones en Lote"):
+            opciones_lote = {f"{f['texto'][:50]} ({f['id']})": f['id'] for f in st.session_state.fichas}
+            sel_lote = st.multiselect("Fichas a procesar:", list(opciones_lote.keys()), key="sel_lote")
+            if st.checkbox("Seleccionar todas", key="lote_todas"):
+                sel_lote = list(opciones_lote.keys())
+            modo_lote = st.radio("Operación:", ["🔄 Re-sintetizar con el estilo de citación actual", "✨ Refinar con una instrucción"], key="modo_lote")
+            instruccion_lote = st.text_area("Instrucción de refinamiento:", key="inst_lote") if modo_lote.startswith("✨") else ""
+
+            if st.button("Ejecutar en Lote", key="btn_lote", type="primary"):
+                ids_lote = {opciones_lote[n] for n in sel_lote}
+                fichas_lote = [f for f in st.session_state.fichas if f['id'] in ids_lote]
+                if not fichas_lote:
+                    st.warning("Selecciona al menos una ficha.")
+                elif modo_lote.startswith("✨") and not instruccion_lote.strip():
+                    st.warning("Escribe la instrucción de refinamiento.")
+                else:
+                    # Los cambios se aplican de una vez, solo cuando el lote completo ha terminado
+                    instruccion = instruccion_lote if modo_lote.startswith("✨") else ""
+                    encolar_trabajo("fichas_lote", {"fichas": fichas_lote, "instruccion": instruccion, "estilo_citacion": estilo_citacion_a},
+                                    f"Lote de {len(fichas_lote)} fichas")
+
+            if st.session_state.get("resumen_lote"):
+                st.success(st.session_state.resumen_lote)
+                for fid, motivo in (st.session_state.get("errores_lote") or {}).items():
+                    st.error(f"Ficha {fid}: {motivo}")
                 
         for cat in st.session_state.categorias:
             fichas_cat = [f for f in st.session_state.fichas if f['categoria'] == cat]
@@ -486,11 +786,15 @@ with tab_ideas:
                                     if instruccion.strip():
                                         with st.spinner("Refinando..."):
                                             ctx_rag = f.get('contexto_fijado', None)
-                                            mejora = refinar_ficha_con_ia(f['texto'], instruccion, estilo_citacion_a, ctx_rag)
-                                            f['texto'] = mejora.get("texto", f['texto'])
-                                            f['cita_pie'] = mejora.get("cita_pie", f.get('cita_pie', ''))
-                                            f['referencia_bib'] = mejora.get("referencia_bib", f.get('referencia_bib', ''))
-                                            st.rerun()
+                                            try:
+                                                mejora = refinar_ficha_con_ia(f['texto'], instruccion, estilo_citacion_a, ctx_rag)
+                                            except ERRORES_IA as e:
+                                                st.error(f"⚠️ No se pudo obtener una ficha válida de la IA: {e}")
+                                            else:
+                                                f['texto'] = mejora.get("texto", f['texto'])
+                                                f['cita_pie'] = mejora.get("cita_pie", f.get('cita_pie', ''))
+                                                f['referencia_bib'] = mejora.get("referencia_bib", f.get('referencia_bib', ''))
+                                                st.rerun()
                                 if st.button("🗑️ Eliminar Ficha", key=f"del_{f['id']}"):
                                     if st.session_state.active_chat_id == f['id']: st.session_state.active_chat_id = None
                                     st.session_state.fichas.remove(f); st.rerun()
@@ -498,67 +802,76 @@ with tab_ideas:
 
 # --- FASE B/C: ORGANIZADOR DE ÍNDICES Y REPOSITORIO ---
 with tab_indices:
+    tracing.marcar_pestana("indices")
     st.subheader("Organización de Ideas mediante IA")
+    mostrar_estimacion(estimar_generar_indice(st.session_state.fichas))
     if st.button("🧠 Generar Nuevo Índice desde Fichas", type="primary"):
-        with st.spinner("Analizando debates profundos e infiriendo estructura..."):
-            nuevo_indice = generar_indice_desde_fichas(st.session_state.fichas)
-            repositorio = st.session_state.current_project.get('repositorio_indices', [])
-            nuevo_indice['version'] = f"V{len(repositorio)+1} - {st.session_state.current_project['nombre']}"
-            repositorio.append(nuevo_indice)
-            
-            update_project_data(st.session_state.current_project['id'], {"repositorio_indices": repositorio, "estructura_activa": nuevo_indice})
-            st.session_state.current_project['repositorio_indices'] = repositorio
-            st.session_state.current_project['estructura_activa'] = nuevo_indice
-            st.rerun()
+        encolar_trabajo("indice", {"fichas": st.session_state.fichas}, "Índice desde fichas")
 
     st.divider()
     st.subheader("📚 Repositorio de Versiones")
     repositorio = st.session_state.current_project.get('repositorio_indices', [])
     
     if repositorio:
-        opciones_v = [r['version'] for r in repositorio]
+        # Solo metadatos para el selector; se reconstruye únicamente la versión elegida
+        versiones = listar_versiones(repositorio)
+        opciones_v = [v['version'] for v in versiones]
         v_sel = st.selectbox("Selecciona la versión de la estructura para trabajar:", opciones_v, index=len(opciones_v)-1)
-        indice_activo = next(r for r in repositorio if r['version'] == v_sel)
-        st.session_state.current_project['estructura_activa'] = indice_activo
+        nro_sel = versiones[opciones_v.index(v_sel)]['nro']
+        indice_activo = st.session_state.current_project.get('estructura_activa')
+        if not indice_activo or indice_activo.get('version') != v_sel:
+            indice_activo = reconstruir(repositorio, nro_sel)
+            st.session_state.current_project['estructura_activa'] = indice_activo
+
+        if len(versiones) > 1:
+            with st.expander("🔀 Comparar con otra versión"):
+                otras = [v for v in versiones if v['nro'] != nro_sel]
+                v_cmp = st.selectbox("Versión de referencia:", [v['version'] for v in otras], index=len(otras)-1)
+                cambios_v = comparar(repositorio, next(v['nro'] for v in otras if v['version'] == v_cmp), nro_sel)
+                if cambios_v['titulo']:
+                    st.write(f"**Título:** {cambios_v['titulo'][0]} → {cambios_v['titulo'][1]}")
+                for cap in cambios_v['añadidos']:
+                    st.write(f"➕ Capítulo {cap.get('nro')}: {cap.get('titulo')}")
+                for cap in cambios_v['eliminados']:
+                    st.write(f"➖ Capítulo {cap.get('nro')}: {cap.get('titulo')}")
+                for m in cambios_v['modificados']:
+                    st.write(f"✏️ Capítulo {m['nro']}: {m['titulo']} ({', '.join(m['campos'])})")
+                if not any(cambios_v.values()):
+                    st.caption("Sin diferencias.")
         
         st.markdown(f"### Índice Activo: {indice_activo.get('titulo_tesis', '')}")
+        fichas_por_id = {f['id']: f for f in st.session_state.fichas}
         for cap in indice_activo.get('capitulos', []):
             with st.expander(f"Capítulo {cap.get('nro')}: {cap.get('titulo')}"):
                 st.write(f"**Objetivo:** {cap.get('objetivo')}")
                 st.write("**Fichas vinculadas por la IA:**")
                 for fid in cap.get('fichas_asociadas', []):
-                    ficha_real = next((f for f in st.session_state.fichas if f['id'] == fid), None)
+                    ficha_real = fichas_por_id.get(fid)
                     if ficha_real: st.info(ficha_real['texto'])
     else:
         st.info("No hay índices guardados.")
 
 # --- FASE D: MOTOR DE PROMPTS INTELIGENTE ---
 with tab_prompts:
+    tracing.marcar_pestana("prompts")
     st.subheader("Evaluación de Coherencia y Prompts")
     indice = st.session_state.current_project.get('estructura_activa')
     
     if not indice:
         st.warning("⚠️ Selecciona o genera una estructura en la Fase B/C.")
     else:
+        if st.button("🔍 Evaluar todos los capítulos en segundo plano"):
+            for cap in indice.get('capitulos', []):
+                encolar_trabajo("prompt_capitulo", {"capitulo": cap, "notas": notas_para_prompt(cap, st.session_state.fichas)},
+                                f"Prompt Cap {cap['nro']}", {"nro": str(cap['nro'])})
+
         for cap in indice.get('capitulos', []):
             cap_id = str(cap['nro'])
             with st.expander(f"⚙️ Configurar Prompt: Cap {cap_id} - {cap['titulo']}"):
-                textos_notas = []
-                for fid in cap.get('fichas_asociadas', []):
-                    f_real = next((f for f in st.session_state.fichas if f['id'] == fid), None)
-                    if f_real:
-                        hist = "\n".join([f"{m['role']}: {m['content']}" for m in f_real.get('chat_history', [])])
-                        textos_notas.append(f"--- FICHA ---\nResumen: {f_real['texto']}\nDebate original:\n{hist}\n")
-                notas_str = "\n".join(textos_notas)
+                notas_str = notas_para_prompt(cap, st.session_state.fichas)
                 
                 if st.button(f"🔍 Evaluar Material y Generar Prompt (Cap {cap_id})"):
-                    with st.spinner("Evaluando completitud del debate..."):
-                        prompt_generado = evaluar_y_crear_prompt_inteligente(cap, notas_str)
-                        prompts_eval = st.session_state.current_project.get('prompts_inteligentes', {})
-                        prompts_eval[cap_id] = prompt_generado
-                        update_project_data(st.session_state.current_project['id'], {"prompts_inteligentes": prompts_eval})
-                        st.session_state.current_project['prompts_inteligentes'] = prompts_eval
-                        st.rerun()
+                    encolar_trabajo("prompt_capitulo", {"capitulo": cap, "notas": notas_str}, f"Prompt Cap {cap_id}", {"nro": cap_id})
                 
                 p_actual = st.session_state.current_project.get('prompts_inteligentes', {}).get(cap_id, "")
                 if p_actual:
@@ -572,6 +885,7 @@ with tab_prompts:
 
 # --- FASE E: REDACCIÓN FINAL Y EXPORTACIÓN ---
 with tab_redaccion:
+    tracing.marcar_pestana("redaccion")
     st.subheader("Redacción y Ensamblaje Final")
     prompts_eval = st.session_state.current_project.get('prompts_inteligentes', {})
     indice = st.session_state.current_project.get('estructura_activa')
@@ -588,37 +902,46 @@ with tab_redaccion:
         cap_sel = st.selectbox("Selecciona capítulo a redactar:", [f"Capítulo {c['nro']}" for c in indice['capitulos']])
         nro_cap_sel = cap_sel.split(" ")[1]
         
-        if st.button(f"🚀 Ejecutar Redacción ({cap_sel})", type="primary"):
-            with st.spinner("Escribiendo documento..."):
-                prompt_cap = prompts_eval.get(nro_cap_sel, "")
-                cap_data = next((c for c in indice['capitulos'] if str(c['nro']) == nro_cap_sel), {})
-                
-                textos_notas = []
-                for f in st.session_state.fichas:
-                    if f['id'] in cap_data.get('fichas_asociadas', []):
-                        hist = "\n".join([f"{m['role']}: {m['content']}" for m in f.get('chat_history', [])])
-                        textos_notas.append(f"--- FICHA ---\nResumen principal: {f['texto']}\nCita: {f.get('cita_pie','')}\nDesarrollo profundo:\n{hist}\n")
-                notas_str = "\n".join(textos_notas)
-                
-                texto_redactado = execute_final_writing(prompt_cap, notas_str, idioma_sel, estilo_libre, estilo_citacion_e)
-                
-                cont_actual = st.session_state.current_project.get('contenido_redactado') or {}
-                cont_actual[nro_cap_sel] = texto_redactado
-                update_project_data(st.session_state.current_project['id'], {"contenido_redactado": cont_actual})
-                st.session_state.current_project['contenido_redactado'] = cont_actual
-                st.rerun()
+        prompt_cap = prompts_eval.get(nro_cap_sel, "")
+        cap_data = next((c for c in indice['capitulos'] if str(c['nro']) == nro_cap_sel), {})
+        
+        secciones_previas = st.session_state.current_project.get('secciones_redactadas') or {}
+        plan, estimaciones = estimar_redaccion(cap_data, st.session_state.fichas, prompt_cap, idioma_sel, estilo_libre,
+                                               estilo_citacion_e, secciones_previas.get(nro_cap_sel))
+        if not plan['completa']:
+            if estimaciones:
+                st.caption(f"♻️ Se reutilizan {len(plan['reutilizar'])} secciones; se redactan {len(estimaciones)} "
+                           f"(~{sum(e['total'] for e in estimaciones):,} tokens).")
+            else:
+                st.caption("✅ Ninguna ficha del capítulo ha cambiado: no hay secciones que redactar.")
+        if estimaciones:
+            mostrar_estimacion(max(estimaciones, key=lambda e: e['total']))
+        
+        def encolar_redaccion(cap, prompt_maestro):
+            asociadas = set(cap.get('fichas_asociadas', []))
+            encolar_trabajo("redaccion_capitulo", {
+                "capitulo": cap, "fichas": [f for f in st.session_state.fichas if f['id'] in asociadas],
+                "prompt": prompt_maestro, "idioma": idioma_sel, "estilo": estilo_libre, "estilo_citacion": estilo_citacion_e,
+                "estado": secciones_previas.get(str(cap['nro'])),
+            }, f"Redacción Cap {cap['nro']}", {"nro": str(cap['nro'])})
+
+        col_r1, col_r2 = st.columns(2)
+        with col_r1:
+            if st.button(f"🚀 Ejecutar Redacción ({cap_sel})", type="primary"):
+                encolar_redaccion(cap_data, prompt_cap)
+        with col_r2:
+            if st.button("🚀 Redactar todos los capítulos con prompt"):
+                for cap in indice['capitulos']:
+                    if prompts_eval.get(str(cap['nro'])):
+                        encolar_redaccion(cap, prompts_eval[str(cap['nro'])])
 
         documento = st.session_state.current_project.get('contenido_redactado', {})
         if documento:
             st.markdown("### 📑 Vista de Lectura")
             
             if st.button("📚 Generar/Actualizar Bibliografía Final"):
-                with st.spinner("Formateando bibliografía..."):
-                    texto_total = "\n\n".join(documento.values())
-                    biblio = generar_bibliografia_global(texto_total, estilo_citacion_e)
-                    update_project_data(st.session_state.current_project['id'], {"bibliografia": biblio})
-                    st.session_state.current_project['bibliografia'] = biblio
-                    st.rerun()
+                encolar_trabajo("bibliografia", {"indice": indice, "contenido": documento, "fichas": st.session_state.fichas,
+                                                 "estilo_citacion": estilo_citacion_e}, "Bibliografía")
 
             bibliografia_actual = st.session_state.current_project.get('bibliografia', "")
 
@@ -633,10 +956,68 @@ with tab_redaccion:
             st.markdown("</div>", unsafe_allow_html=True)
             
             st.divider()
-            archivo_word = generar_documento_word(indice.get('titulo_tesis', 'Monografía'), documento, bibliografia_actual)
-            st.download_button(
-                label="📥 Descargar Documento en Word (.docx)",
-                data=archivo_word,
-                file_name=f"{st.session_state.current_project['nombre']}.docx",
-                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-            )
+            # La exportación solo se genera a petición y sus bytes se quedan en la caché del proceso
+            # (ficheros temporales con límite, ver export_utils): la sesión guarda solo el hash y qué
+            # se preparó. En los reruns solo se comprueba que el contenido sigue siendo el mismo objeto
+            # (contenido_redactado se sustituye, nunca se modifica en el sitio), sin volver a hashear la tesis.
+            titulo_export = indice.get('titulo_tesis', 'Monografía')
+            nombre_export = st.session_state.current_project['nombre']
+            exportados = st.session_state.get("exportaciones_listas", {})
+            if (exportados.get("documento") is not documento or exportados.get("bibliografia") != bibliografia_actual
+                    or exportados.get("titulo") != titulo_export):
+                exportados = {"documento": documento, "bibliografia": bibliografia_actual, "titulo": titulo_export,
+                              "hash": None, "formatos": set(), "paquete": False}
+
+            def con_hash_vigente(exportados):
+                # Se hashea solo al preparar: si el contenido cambió, lo preparado antes se descarta
+                hash_actual = hash_exportacion(titulo_export, documento, bibliografia_actual)
+                if exportados["hash"] != hash_actual:
+                    exportados.update(hash=hash_actual, formatos=set(), paquete=False)
+                return exportados
+
+            col_fmt, col_prep, col_todo = st.columns([2, 1, 1])
+            with col_fmt:
+                formato_sel = st.selectbox("Formato de exportación:", list(EXPORTADORES.keys()), format_func=lambda f: EXPORTADORES[f]["etiqueta"])
+            with col_prep:
+                if st.button("⚙️ Preparar Exportación"):
+                    with st.spinner("Generando documento..."):
+                        exportados = con_hash_vigente(exportados)
+                        exportar(formato_sel, titulo_export, documento, bibliografia_actual)
+                        exportados["formatos"].add(formato_sel)
+                        st.session_state.exportaciones_listas = exportados
+                        st.rerun()
+            with col_todo:
+                if st.button("📦 Exportar Todo"):
+                    with st.spinner("Generando todos los formatos en paralelo..."):
+                        exportados = con_hash_vigente(exportados)
+                        archivos = exportar_todos(titulo_export, documento, bibliografia_actual)
+                        empaquetar_exportaciones(nombre_export, exportados["hash"], archivos)
+                        exportados.update(formatos=set(archivos), paquete=True)
+                        st.session_state.exportaciones_listas = exportados
+                        st.rerun()
+
+            def datos_preparados(clave_cache):
+                datos = leer_exportacion(clave_cache)
+                if datos is None:
+                    st.caption("La exportación preparada ya no está en la caché; vuelve a prepararla.")
+                return datos
+
+            datos_sel = datos_preparados((formato_sel, exportados["hash"])) if formato_sel in exportados["formatos"] else None
+            if datos_sel is not None:
+                info = EXPORTADORES[formato_sel]
+                st.download_button(
+                    label=f"📥 Descargar {info['etiqueta']}",
+                    data=datos_sel,
+                    file_name=f"{nombre_export}.{info['extension']}",
+                    mime=info["mime"]
+                )
+            datos_paquete = datos_preparados(clave_paquete(nombre_export, exportados["hash"])) if exportados["paquete"] else None
+            if datos_paquete is not None:
+                st.download_button(
+                    label="📥 Descargar Todos los Formatos (.zip)",
+                    data=datos_paquete,
+                    file_name=f"{nombre_export}.zip",
+                    mime="application/zip"
+                )
+
+tracing.marcar_pestana(None)
@@ -0,0 +1,66 @@
+import random
+
+# --- GENERADORES DE DATOS SINTÉTICOS ESCALABLES ---
+
+CARACTERES_CLASICOS = "子曰學而時習之不亦說乎有朋自遠方來樂人知慍君仁義禮智信道德天下國家民王者心性情命之也矣焉哉其所以為於是故"
+TERMINOS_LATINOS = ["páthos", "ethos", "logos", "ren", "yi", "li", "zhi", "xin", "dao", "de"]
+TABLAS_CORPUS = ["戰國策", "Xunzi", "Mencio", "Analectas de Confucio", "Glosas de 鬼谷子"]
+
+def _frase(rng, longitud):
+    return "".join(rng.choice(CARACTERES_CLASICOS) for _ in range(longitud))
+
+def generar_corpus(megabytes, tablas=TABLAS_CORPUS, semilla=42, caracteres_por_fila=600):
+    """Devuelve {tabla: [filas]} con ~`megabytes` MB (UTF-8) de texto repartidos entre las tablas."""
+    rng = random.Random(semilla)
+    # Cada carácter CJK ocupa 3 bytes en UTF-8
+    filas_totales = max(1, int(megabytes * 1024 * 1024 / (caracteres_por_fila * 3)))
+    corpus = {t: [] for t in tablas}
+    for i in range(filas_totales):
+        tabla = tablas[i % len(tablas)]
+        corpus[tabla].append({
+            "id": i + 1,
+            "Obra": tabla,
+            "Capitulo": f"{i % 40 + 1}",
+            "Texto": _frase(rng, caracteres_por_fila),
+            "Palabras Clave": ", ".join(rng.sample(TERMINOS_LATINOS, 3)),
+            "created_at": "2024-01-01T00:00:00",
+        })
+    return corpus
+
+def generar_fichas(n, semilla=7, turnos_chat=4):
+    rng = random.Random(semilla)
+    fichas = []
+    for i in range(n):
+        fichas.append({
+            "id": f"f{i:05d}",
+            "texto": _frase(rng, 120),
+            "cita_pie": f"Autor {i % 50}, Obra {i % 30}, p. {i % 300}.",
+            "referencia_bib": f"Autor {i % 50}. Obra {i % 30}. Pekín: Editorial {i % 7}, {1950 + i % 70}.",
+            "categoria": "Ideas Generales",
+            "chat_history": [{"role": "user" if t % 2 == 0 else "assistant", "content": _frase(rng, 200)} for t in range(turnos_chat)],
+            "contexto_fijado": None,
+        })
+    return fichas
+
+def generar_proyecto(n_fichas, capitulos=8, caracteres_por_capitulo=20000, semilla=11):
+    """Proyecto completo: fichas, índice activo con fichas asociadas y capítulos redactados en Markdown."""
+    rng = random.Random(semilla)
+    fichas = generar_fichas(n_fichas, semilla=semilla)
+    ids = [f["id"] for f in fichas]
+    capitulos_indice, contenido = [], {}
+    for c in range(1, capitulos + 1):
+        asociadas = ids[(c - 1)::capitulos]
+        capitulos_indice.append({"nro": c, "titulo": f"Capítulo sintético {c}", "objetivo": _frase(rng, 60), "fichas_asociadas": asociadas})
+        parrafos = []
+        restantes = caracteres_por_capitulo
+        while restantes > 0:
+            parrafos.append(f"{_frase(rng, 300)} **{_frase(rng, 4)}**[^{len(parrafos) + 1}]")
+            restantes -= 310
+        notas = [f"[^{i + 1}]: Nota sintética {i + 1}." for i in range(len(parrafos))]
+        contenido[str(c)] = f"## Sección {c}.1\n\n" + "\n\n".join(parrafos) + "\n\n" + "\n".join(notas)
+    return {
+        "id": 1, "user_id": "usuario-bench", "nombre": f"Proyecto {n_fichas} fichas",
+        "fichas": fichas, "fuentes_primarias": [], "repositorio_indices": [],
+        "estructura_activa": {"titulo_tesis": "Tesis sintética", "capitulos": capitulos_indice},
+        "prompts_inteligentes": {}, "contenido_redactado": contenido, "bibliografia": "",
+    }
@@ -0,0 +1,168 @@
+import copy
+import json
+import re
+import threading
+import time
+import zlib
+
+# --- DOBLES LOCALES DE SUPABASE Y GEMINI PARA LOS BENCHMARKS ---
+# Imitan solo la parte de la API que usan modules/database.py y modules/ai_engine.py.
+
+class RespuestaFalsa:
+    def __init__(self, data):
+        self.data = data
+        self.error = None
+
+
+class ConsultaFalsa:
+    """Constructor de consultas al estilo PostgREST: select/ilike/eq/order/limit/range/single/update/insert."""
+
+    def __init__(self, almacen, tabla):
+        self._almacen = almacen
+        self._tabla = tabla
+        self._filtros = []
+        self._limite = None
+        self._desde = 0
+        self._orden = None
+        self._unica = False
+        self._cambios = None
+        self._insercion = None
+
+    def select(self, columnas="*"):
+        return self
+
+    def ilike(self, columna, patron):
+        regex = re.compile("^" + ".*".join(re.escape(p) for p in patron.split("%")) + "$", re.IGNORECASE | re.DOTALL)
+        self._filtros.append(lambda fila: isinstance(fila.get(columna), str) and regex.match(fila[columna]) is not None)
+        return self
+
+    def eq(self, columna, valor):
+        self._filtros.append(lambda fila: fila.get(columna) == valor)
+        return self
+
+    def order(self, columna, desc=False):
+        self._orden = (columna, desc)
+        return self
+
+    def limit(self, n):
+        self._limite = n
+        return self
+
+    def range(self, desde, hasta):
+        self._desde = desde
+        self._limite = hasta - desde + 1
+        return self
+
+    def single(self):
+        self._unica = True
+        return self
+
+    def update(self, cambios):
+        self._cambios = cambios
+        return self
+
+    def insert(self, fila):
+        self._insercion = fila
+        return self
+
+    def execute(self):
+        self._almacen.esperar()
+        filas = self._almacen.tablas.setdefault(self._tabla, [])
+
+        if self._insercion is not None:
+            # Serializamos como haría la red para que el coste del payload cuente
+            nueva = json.loads(json.dumps(self._insercion))
+            nueva.setdefault("id", len(filas) + 1)
+            filas.append(nueva)
+            return RespuestaFalsa([nueva])
+
+        coincidencias = [f for f in filas if all(filtro(f) for filtro in self._filtros)]
+        if self._cambios is not None:
+            cambios = json.loads(json.dumps(self._cambios))
+            for f in coincidencias:
+                f.update(cambios)
+            return RespuestaFalsa(coincidencias)
+
+        if self._orden is not None:
+            columna, desc = self._orden
+            coincidencias = sorted(coincidencias, key=lambda f: f.get(columna), reverse=desc)
+        coincidencias = coincidencias[self._desde:]
+        if self._limite is not None:
+            coincidencias = coincidencias[:self._limite]
+        datos = copy.deepcopy(coincidencias)
+        if self._unica:
+            return RespuestaFalsa(datos[0] if datos else None)
+        return RespuestaFalsa(datos)
+
+
+class SupabaseFalso:
+    """Almacén de tablas en memoria con latencia de ida y vuelta configurable."""
+
+    def __init__(self, tablas=None, latencia_s=0.0):
+        self.tablas = tablas if tablas is not None else {}
+        self.latencia_s = latencia_s
+        self.consultas = 0
+        self._lock = threading.Lock()
+
+    def esperar(self):
+        with self._lock:
+            self.consultas += 1
+        if self.latencia_s:
+            time.sleep(self.latencia_s)
+
+    def table(self, nombre):
+        return ConsultaFalsa(self, nombre)
+
+
+# --- GEMINI ---
+
+class RespuestaModeloFalsa:
+    def __init__(self, text):
+        self.text = text
+
+
+PATRON_IDS = re.compile(r'"(id|clave)"\s*:\s*"([^"]+)"')
+
+def _instanciar_esquema(esquema, prompt, semilla):
+    """Genera un JSON determinista que cumple el esquema; en listas de objetos con 'id'/'clave' reutiliza los del prompt."""
+    tipo = esquema["type"]
+    if tipo == "OBJECT":
+        return {k: _instanciar_esquema(sub, prompt, f"{semilla}.{k}") for k, sub in esquema.get("properties", {}).items()}
+    if tipo == "ARRAY":
+        items = esquema["items"]
+        claves = [c for c in ("id", "clave") if c in items.get("properties", {})]
+        if claves:
+            ids = [valor for campo, valor in PATRON_IDS.findall(prompt) if campo == claves[0]]
+            salida = []
+            for i in dict.fromkeys(ids):
+                obj = _instanciar_esquema(items, prompt, f"{semilla}[{i}]")
+                obj[claves[0]] = i
+                salida.append(obj)
+            return salida
+        return [_instanciar_esquema(items, prompt, f"{semilla}[{i}]") for i in range(3)]
+    if tipo == "INTEGER":
+        return zlib.crc32(semilla.encode("utf-8")) % 10 + 1
+    return f"Texto sintético ({semilla})"
+
+
+class ModeloFalso:
+    """Sustituto determinista de genai.GenerativeModel con latencia fija + latencia por token de salida."""
+
+    def __init__(self, latencia_s=0.0, latencia_por_token_s=0.0, tokens_respuesta=400):
+        self.latencia_s = latencia_s
+        self.latencia_por_token_s = latencia_por_token_s
+        self.tokens_respuesta = tokens_respuesta
+        self.llamadas = 0
+        self.caracteres_prompt = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, generation_config=None):
+        with self._lock:
+            self.llamadas += 1
+            self.caracteres_prompt += len(prompt)
+        time.sleep(self.latencia_s + self.latencia_por_token_s * self.tokens_respuesta)
+
+        esquema = (generation_config or {}).get("response_schema")
+        if esquema:
+            return RespuestaModeloFalsa(json.dumps(_instanciar_esquema(esquema, prompt, "r"), ensure_ascii=False))
+        return RespuestaModeloFalsa(("Texto generado de prueba. " * (self.tokens_respuesta // 5 + 1)).strip())
@@ -0,0 +1,161 @@
+"""Benchmarks offline de los caminos críticos de la app (búsqueda, RAG, índice, guardado, exportación).
+
+Uso:
+    python -m benchmarks.run --fichas 10 100 1000 --mb 1 10 --json bench.json
+    python -m benchmarks.run --comparar bench_base.json --tolerancia 0.25   # sale con código 1 si hay regresión
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from benchmarks.corpus import TABLAS_CORPUS, generar_corpus, generar_fichas, generar_proyecto
+from benchmarks.fakes import ModeloFalso, SupabaseFalso
+
+# --- MEDICIÓN ---
+
+def medir(funcion, repeticiones):
+    tiempos, picos = [], []
+    for _ in range(repeticiones):
+        tracemalloc.start()
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+        picos.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    tiempos.sort()
+    return {
+        "mediana_ms": statistics.median(tiempos) * 1000,
+        "p95_ms": tiempos[min(len(tiempos) - 1, int(len(tiempos) * 0.95))] * 1000,
+        "pico_mb": max(picos) / (1024 * 1024),
+    }
+
+def _instalar_dobles(supabase_falso, modelo_falso):
+    """Sustituye los clientes reales por los dobles locales. Devuelve los módulos importables."""
+    modulos = {}
+    try:
+        from modules import database
+        database.get_supabase_client = lambda: supabase_falso
+        modulos["database"] = database
+    except ImportError as e:
+        print(f"[aviso] modules.database no disponible: {e}", file=sys.stderr)
+    try:
+        from modules import ai_engine
+        ai_engine.get_model = lambda operacion=None: modelo_falso
+        modulos["ai_engine"] = ai_engine
+        from modules import bibliografia
+        modulos["bibliografia"] = bibliografia
+    except ImportError as e:
+        print(f"[aviso] modules.ai_engine no disponible: {e}", file=sys.stderr)
+    try:
+        from modules import export_utils
+        modulos["export_utils"] = export_utils
+    except ImportError as e:
+        print(f"[aviso] modules.export_utils no disponible: {e}", file=sys.stderr)
+    return modulos
+
+# --- ESCENARIOS ---
+
+def ejecutar(args):
+    resultados = []
+
+    def registrar(escenario, parametros, funcion):
+        metricas = medir(funcion, args.repeticiones)
+        fila = {"escenario": escenario, "parametros": parametros, **metricas}
+        resultados.append(fila)
+        print(f"{escenario:<14} {parametros:<22} mediana {metricas['mediana_ms']:>10.1f} ms   p95 {metricas['p95_ms']:>10.1f} ms   pico {metricas['pico_mb']:>8.1f} MB")
+
+    # Arranque en frío de un proceso worker: importar los módulos sin cargar ningún SDK pesado
+    registrar("arranque", "import modules", lambda: subprocess.run(
+        [sys.executable, "-c", "import modules.ai_engine, modules.database, modules.export_utils, modules.pipeline"], check=True))
+
+    modelo = ModeloFalso(latencia_s=args.latencia_llm, latencia_por_token_s=args.latencia_token)
+
+    for mb in args.mb:
+        supabase = SupabaseFalso(generar_corpus(mb), latencia_s=args.latencia_db)
+        modulos = _instalar_dobles(supabase, modelo)
+        if "database" in modulos:
+            db = modulos["database"]
+            registrar("busqueda", f"{mb} MB", lambda: db.search_corpus_exact(TABLAS_CORPUS, "仁義"))
+            registrar("busqueda_near", f"{mb} MB", lambda: db.search_corpus_exact(TABLAS_CORPUS, "仁 NEAR/5 義 NOT 利"))
+            try:
+                from modules import estadisticas
+                # Mismo camino que la app: las obras se codifican una vez y se recuperan por su clave
+                claves = {t: estadisticas.cargar_obra(t, db.get_corpus_texts(t)).clave for t in TABLAS_CORPUS}
+                def colocaciones_desde_disco():
+                    estadisticas._obras.clear()
+                    obras = {t: estadisticas.obra_cacheada(c) for t, c in claves.items()}
+                    estadisticas.colocaciones_de_obras(obras, "仁")
+                registrar("colocaciones", f"{mb} MB", colocaciones_desde_disco)
+            except ImportError as e:
+                print(f"[aviso] modules.estadisticas no disponible: {e}", file=sys.stderr)
+            registrar("rag_busqueda", f"{mb} MB", lambda: db.search_research_data(TABLAS_CORPUS[:3], "ren, dao"))
+            if "ai_engine" in modulos:
+                ia = modulos["ai_engine"]
+                registrar("rag_completo", f"{mb} MB", lambda: ia.chat_with_ideas([], "¿Qué es ren?", db.search_research_data(TABLAS_CORPUS[:3], "ren, dao")))
+
+    for n in args.fichas:
+        proyecto = generar_proyecto(n)
+        supabase = SupabaseFalso({"proyectos_a": [proyecto]}, latencia_s=args.latencia_db)
+        modulos = _instalar_dobles(supabase, modelo)
+        if "ai_engine" in modulos:
+            ia = modulos["ai_engine"]
+            registrar("indice", f"{n} fichas", lambda: ia.generar_indice_desde_fichas(proyecto["fichas"]))
+            registrar("lote_fichas", f"{n} fichas", lambda: ia.extraer_fichas_en_lote(proyecto["fichas"], "APA 7"))
+            bib = modulos["bibliografia"]
+            registrar("bibliografia", f"{n} fichas", lambda: bib.generar_bibliografia_incremental(
+                proyecto["estructura_activa"], proyecto["contenido_redactado"], proyecto["fichas"], "APA 7"))
+        if "database" in modulos:
+            db = modulos["database"]
+            fichas = generar_fichas(n)
+            registrar("guardado", f"{n} fichas", lambda: db.update_project_data(1, {"fichas": fichas}))
+        if "export_utils" in modulos:
+            ex = modulos["export_utils"]
+            def exportar_sin_cache():
+                ex._cache_exportaciones.clear()
+                ex.exportar_todos(proyecto["estructura_activa"]["titulo_tesis"], proyecto["contenido_redactado"], proyecto["bibliografia"])
+            registrar("exportacion", f"{n} fichas", exportar_sin_cache)
+
+    return resultados
+
+def comparar(actuales, base, tolerancia):
+    """Devuelve las filas cuya mediana empeora más de `tolerancia` (fracción) respecto a la base."""
+    indice_base = {(r["escenario"], r["parametros"]): r for r in base}
+    regresiones = []
+    for r in actuales:
+        previa = indice_base.get((r["escenario"], r["parametros"]))
+        if previa and r["mediana_ms"] > previa["mediana_ms"] * (1 + tolerancia):
+            regresiones.append((r, previa))
+    return regresiones
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fichas", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--mb", type=float, nargs="+", default=[1, 10])
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--latencia-db", type=float, default=0.02, help="segundos por ida y vuelta a Supabase")
+    parser.add_argument("--latencia-llm", type=float, default=0.5, help="segundos fijos por llamada a Gemini")
+    parser.add_argument("--latencia-token", type=float, default=0.0, help="segundos por token de salida")
+    parser.add_argument("--json", help="guarda los resultados en este fichero")
+    parser.add_argument("--comparar", help="fichero JSON de referencia contra el que detectar regresiones")
+    parser.add_argument("--tolerancia", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    resultados = ejecutar(args)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2, ensure_ascii=False)
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            regresiones = comparar(resultados, json.load(f), args.tolerancia)
+        for actual, previa in regresiones:
+            print(f"REGRESIÓN {actual['escenario']} ({actual['parametros']}): {previa['mediana_ms']:.1f} -> {actual['mediana_ms']:.1f} ms")
+        return 1 if regresiones else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,24 @@
-import google.generativeai as genai
 import json
 import re
+from concurrent.futures import ThreadPoolExecutor
+
+from modules.structured_output import (
+    ESQUEMA_FICHA, ESQUEMA_FICHA_LOTE, ESQUEMA_INDICE, ESQUEMA_REFERENCIAS, ESQUEMA_SECCION, ESQUEMA_SECCIONES,
+    SalidaEstructuradaError, generar_estructurado
+)
+from modules.prompt_builder import (
+    PRIORIDAD_FUENTE, PRIORIDAD_HISTORIAL, PRIORIDAD_NOTAS, PRIORIDAD_RAG, ConstructorPrompt, PresupuestoExcedidoError
+)
+from modules.tracing import envolver_modelo
 
 # --- CONFIGURACIÓN ---
-def get_model():
-    return genai.GenerativeModel('gemini-2.0-flash')
+def get_model(operacion=None):
+    # El SDK de Gemini tarda en importarse: se carga en la primera llamada, no al arrancar
+    import google.generativeai as genai
+    return envolver_modelo(genai.GenerativeModel('gemini-2.0-flash'), operacion)
 
 # --- MÓDULO NUEVO: FUENTES PRIMARIAS Y GLOSAS ---
-def chat_with_primary_source(messages, user_input, source_text, notas_marginales=None, contexto_rag=None):
-    model = get_model()
-    
+def _prompt_chat_fuente(messages, user_input, source_text, notas_marginales=None, contexto_rag=None):
     # Preparamos las notas marginales
     notas_str = ""
     if notas_marginales and len(notas_marginales) > 0:
@@ -24,7 +33,8 @@ def chat_with_primary_source(messages, user_input, source_text, notas_marginales
     else:
         instruccion_rag = "No tienes acceso a bases de datos externas en esta consulta. Responde basándote únicamente en el texto primario y tus conocimientos generales de filología."
 
-    system_instruction = f"""Eres un experto filólogo y comentarista de textos clásicos (glosador).
+    instrucciones = f"""INSTRUCCIONES DEL SISTEMA:
+Eres un experto filólogo y comentarista de textos clásicos (glosador).
     REGLAS DE HIERRO:
     1. Tienes un documento primario de referencia principal. Debes centrar tu análisis en este texto.
     2. El investigador ha tomado 'Notas Marginales' sobre este texto. Úsalas como contexto vital para entender su enfoque.
@@ -34,35 +44,43 @@ def chat_with_primary_source(messages, user_input, source_text, notas_marginales
     6. Usa siempre 'Pekín' con acento.
     
     --- TEXTO PRIMARIO DE REFERENCIA ---
-    {source_text}
-    ------------------------------------
-    {notas_str}
-    {rag_str}
     """
-    
-    prompt_completo = f"INSTRUCCIONES DEL SISTEMA:\n{system_instruction}\n\n--- HISTORIAL DE LA CONVERSACIÓN ---\n"
+
+    historial = ""
     for msg in messages:
         rol = "Investigador" if msg["role"] == "user" else "Glosa IA"
-        prompt_completo += f"**{rol}**: {msg['content']}\n\n"
-        
-    prompt_completo += f"**Investigador**: {user_input}\n**Glosa IA**: "
-    
+        historial += f"**{rol}**: {msg['content']}\n\n"
+
+    return (ConstructorPrompt("chat_with_primary_source")
+            .seccion("instrucciones", instrucciones)
+            .seccion("fuente", source_text, PRIORIDAD_FUENTE, minimo_tokens=2000)
+            .seccion("instrucciones", "\n    ------------------------------------\n")
+            .seccion("notas", notas_str, PRIORIDAD_NOTAS)
+            .seccion("rag", rag_str, PRIORIDAD_RAG)
+            .seccion("instrucciones", "\n\n--- HISTORIAL DE LA CONVERSACIÓN ---\n")
+            # Del historial se descartan primero los turnos más antiguos
+            .seccion("historial", historial, PRIORIDAD_HISTORIAL, recortar_desde="inicio")
+            .seccion("pregunta", f"**Investigador**: {user_input}\n**Glosa IA**: "))
+
+def estimar_chat_with_primary_source(messages, user_input, source_text, notas_marginales=None, contexto_rag=None):
+    return _prompt_chat_fuente(messages, user_input, source_text, notas_marginales, contexto_rag).estimacion()
+
+def chat_with_primary_source(messages, user_input, source_text, notas_marginales=None, contexto_rag=None):
+    try:
+        prompt_completo = _prompt_chat_fuente(messages, user_input, source_text, notas_marginales, contexto_rag).construir()
+    except PresupuestoExcedidoError as e:
+        return f"⚠️ Consulta demasiado grande, no se ha enviado: {e}"
+
+    model = get_model("chat_with_primary_source")
     try:
         return model.generate_content(prompt_completo).text
     except Exception as e:
         return f"⚠️ Error en la conexión con la API de Gemini: {str(e)}"
 
 def convert_glosa_to_ficha(chat_history, titulo_fuente):
-    model = get_model()
-    
     historial_str = "\n".join([f"{m['role']}: {m['content']}" for m in chat_history])
     
-    prompt = f"""
-    Eres un asistente de investigación académica. 
-    Analiza este debate filológico sobre la fuente primaria "{titulo_fuente}":
-    
-    DEBATE:
-    {historial_str}
+    formato = f"""
     
     TAREA:
     Extrae la conclusión principal o el hallazgo filológico más importante y devuélvelo EXACTAMENTE con esta estructura JSON:
@@ -72,64 +90,69 @@ def convert_glosa_to_ficha(chat_history, titulo_fuente):
         "referencia_bib": "Referencia bibliográfica provisional de la obra: {titulo_fuente}"
     }}
     """
-    try:
-        response = model.generate_content(prompt, generation_config={"response_mime_type": "application/json"})
-        datos = json.loads(response.text)
-        
-        # --- FILTROS DE SEGURIDAD AÑADIDOS ---
-        if isinstance(datos, list): 
-            datos = datos[0]
-        if "ficha" in datos: 
-            datos = datos["ficha"]
-            
-        datos_seguros = {k.lower(): v for k, v in datos.items()}
-        
-        return {
-            "texto": datos_seguros.get("texto", "No se pudo extraer el texto"), 
-            "cita_pie": datos_seguros.get("cita_pie", f"Fuente: {titulo_fuente}"),
-            "referencia_bib": datos_seguros.get("referencia_bib", f"{titulo_fuente}")
-        }
-    except Exception as e:
-        return {"texto": f"Error de extracción de la IA: {str(e)}", "cita_pie": "Error", "referencia_bib": "Error"}
+    prompt = (ConstructorPrompt("convert_glosa_to_ficha")
+              .seccion("instrucciones", f"""
+    Eres un asistente de investigación académica. 
+    Analiza este debate filológico sobre la fuente primaria "{titulo_fuente}":
+    
+    DEBATE:
+    """)
+              # Del debate se descartan primero los turnos más antiguos
+              .seccion("historial", historial_str, PRIORIDAD_HISTORIAL, recortar_desde="inicio")
+              .seccion("instrucciones", formato)
+              .construir())
+    model = get_model("convert_glosa_to_ficha")
+    # Si la salida no valida tras la reparación se lanza SalidaEstructuradaError: nunca guardamos fichas "Error"
+    return generar_estructurado(model, prompt, ESQUEMA_FICHA)
 
 # --- FASE A: IDEAS Y EXTRACCIÓN DE FICHAS ESTRUCTURADAS ---
-def chat_with_ideas(messages, user_input, contexto_rag=None):
-    model = get_model()
+def _prompt_chat_ideas(messages, user_input, contexto_rag=None):
     if contexto_rag:
         ctx_str = f"\n\n--- INICIO DEL CONTEXTO DE BASES DE DATOS (RAG) ---\n{json.dumps(contexto_rag, ensure_ascii=False)}\n--- FIN DEL CONTEXTO RAG ---\n"
     else:
         ctx_str = "\n\n[AVISO CRÍTICO: No se ha proporcionado contexto RAG para esta consulta.]"
 
-    system_instruction = f"""Eres un investigador y tutor de tesis experto en Sinología.
+    system_instruction = """Eres un investigador y tutor de tesis experto en Sinología.
     REGLAS DE HIERRO PARA ESTA CONVERSACIÓN:
     1. CERO ALUCINACIONES: Tienes ESTRICTAMENTE PROHIBIDO usar tu conocimiento general o inventar información. 
     2. DEPENDENCIA TOTAL: Debes responder ÚNICA y EXCLUSIVAMENTE basándote en el "CONTEXTO DE BASES DE DATOS" proporcionado abajo.
     3. CITAS OBLIGATORIAS: Cada afirmación, idea o traducción que des DEBE estar justificada. En el JSON del contexto, la información de la obra, autor o enlace suele estar al final de cada bloque. Debes incluir esa cita exacta en tu respuesta (ej. [Mencio, 2A:1]).
     4. RESPUESTA VACÍA: Si el usuario pregunta algo que no se encuentra en el CONTEXTO RAG proporcionado, no intentes deducirlo. Responde explícitamente: "No hay información en las fuentes consultadas para justificar esta respuesta."
     5. Usa siempre 'Pekín' con acento.
-    {ctx_str}"""
-    
-    prompt_completo = f"INSTRUCCIONES DEL SISTEMA:\n{system_instruction}\n\n--- HISTORIAL DE LA CONVERSACIÓN ---\n"
+    """
+
+    historial = ""
     for msg in messages:
         rol = "Investigador" if msg["role"] == "user" else "Tutor IA"
-        prompt_completo += f"**{rol}**: {msg['content']}\n\n"
-        
-    prompt_completo += f"**Investigador**: {user_input}\n**Tutor IA**: "
-    
+        historial += f"**{rol}**: {msg['content']}\n\n"
+
+    # Sin RAG el aviso es fijo; el contexto RAG sí se puede recortar
+    return (ConstructorPrompt("chat_with_ideas")
+            .seccion("instrucciones", f"INSTRUCCIONES DEL SISTEMA:\n{system_instruction}")
+            .seccion("rag", ctx_str, PRIORIDAD_RAG if contexto_rag else None)
+            .seccion("instrucciones", "\n\n--- HISTORIAL DE LA CONVERSACIÓN ---\n")
+            .seccion("historial", historial, PRIORIDAD_HISTORIAL, recortar_desde="inicio")
+            .seccion("pregunta", f"**Investigador**: {user_input}\n**Tutor IA**: "))
+
+def estimar_chat_with_ideas(messages, user_input, contexto_rag=None):
+    return _prompt_chat_ideas(messages, user_input, contexto_rag).estimacion()
+
+def chat_with_ideas(messages, user_input, contexto_rag=None):
+    try:
+        prompt_completo = _prompt_chat_ideas(messages, user_input, contexto_rag).construir()
+    except PresupuestoExcedidoError as e:
+        return f"⚠️ Consulta demasiado grande, no se ha enviado: {e}"
+
+    model = get_model("chat_with_ideas")
     try:
         return model.generate_content(prompt_completo).text
     except Exception as e:
         return f"⚠️ Error: {str(e)}"
 
 def extraer_ficha_de_idea(texto_interaccion, estilo_citacion, contexto_rag=None):
-    model = get_model()
     ctx_str = f"\n\nCONTEXTO DE FUENTES:\n{json.dumps(contexto_rag, ensure_ascii=False)}" if contexto_rag else "No hay contexto aportado."
     
-    prompt = f"""
-    Analiza la siguiente conversación/interacción y extrae o actualiza una ficha de trabajo formal.
-    INTERACCIÓN A SINTETIZAR:
-    {texto_interaccion}
-    {ctx_str}
+    formato = f"""
     
     Devuelve EXACTAMENTE con esta estructura JSON:
     {{
@@ -138,103 +161,296 @@ def extraer_ficha_de_idea(texto_interaccion, estilo_citacion, contexto_rag=None)
         "referencia_bib": "La referencia bibliográfica completa en estilo {estilo_citacion}."
     }}
     """
-    try:
-        response = model.generate_content(prompt, generation_config={"response_mime_type": "application/json"})
-        datos = json.loads(response.text)
-        
-        # --- FILTROS DE SEGURIDAD ---
-        if isinstance(datos, list): datos = datos[0]
-        if "ficha" in datos: datos = datos["ficha"]
-        
-        datos_seguros = {k.lower(): v for k, v in datos.items()}
-        return {
-            "texto": datos_seguros.get("texto", response.text), 
-            "cita_pie": datos_seguros.get("cita_pie", "Sin cita"),
-            "referencia_bib": datos_seguros.get("referencia_bib", "Referencia pendiente")
-        }
-    except Exception as e:
-        return {"texto": "Error de extracción.", "cita_pie": "Error", "referencia_bib": "Error"}
+    prompt = (ConstructorPrompt("extraer_ficha_de_idea")
+              .seccion("instrucciones", """
+    Analiza la siguiente conversación/interacción y extrae o actualiza una ficha de trabajo formal.
+    INTERACCIÓN A SINTETIZAR:
+    """)
+              .seccion("historial", texto_interaccion, PRIORIDAD_HISTORIAL, recortar_desde="inicio")
+              .seccion("rag", "\n    " + ctx_str, PRIORIDAD_RAG if contexto_rag else None)
+              .seccion("instrucciones", formato)
+              .construir())
+    model = get_model("extraer_ficha_de_idea")
+    return generar_estructurado(model, prompt, ESQUEMA_FICHA)
 
 def refinar_ficha_con_ia(texto_original, instruccion_usuario, estilo_citacion, contexto_rag=None):
-    model = get_model()
     ctx_str = f"\n\nCONTEXTO DE FUENTES:\n{json.dumps(contexto_rag, ensure_ascii=False)}" if contexto_rag else ""
-    prompt = f"""
+    prompt = (ConstructorPrompt("refinar_ficha_con_ia")
+              .seccion("instrucciones", f"""
     Refina esta ficha de trabajo siguiendo las instrucciones del investigador.
     FICHA ORIGINAL: {texto_original}
     INSTRUCCIÓN: "{instruccion_usuario}"
-    {ctx_str}
+    """)
+              .seccion("rag", ctx_str, PRIORIDAD_RAG)
+              .seccion("instrucciones", """
     Devuelve EXACTAMENTE JSON con 'texto', 'cita_pie', 'referencia_bib'.
+    """)
+              .construir())
+    model = get_model("refinar_ficha_con_ia")
+    return generar_estructurado(model, prompt, ESQUEMA_FICHA)
+
+# --- OPERACIONES EN LOTE SOBRE FICHAS ---
+# Empaquetamos varias fichas por petición (hasta llenar el presupuesto de caracteres) y
+# lanzamos los lotes en paralelo. El llamante recibe resultados y errores por ficha y
+# decide cuándo aplicarlos, de modo que la actualización es atómica.
+MAX_CARACTERES_LOTE = 24000
+MAX_FICHAS_LOTE = 10
+MAX_LOTES_PARALELOS = 4
+
+def _material_ficha(f, incluir_debate):
+    material = {"id": f["id"], "texto": f.get("texto", ""), "cita_pie": f.get("cita_pie", ""), "referencia_bib": f.get("referencia_bib", "")}
+    if incluir_debate:
+        material["debate"] = "\n".join([f"{m['role']}: {m['content']}" for m in f.get("chat_history", [])])
+    if f.get("contexto_fijado"):
+        material["contexto"] = f["contexto_fijado"]
+    return material
+
+def _empaquetar_lotes(materiales):
+    """Agrupa las fichas en lotes que respetan MAX_FICHAS_LOTE y MAX_CARACTERES_LOTE."""
+    lotes, actual, tam_actual = [], [], 0
+    for m in materiales:
+        tam = len(json.dumps(m, ensure_ascii=False))
+        if actual and (len(actual) >= MAX_FICHAS_LOTE or tam_actual + tam > MAX_CARACTERES_LOTE):
+            lotes.append(actual)
+            actual, tam_actual = [], 0
+        actual.append(m)
+        tam_actual += tam
+    if actual:
+        lotes.append(actual)
+    return lotes
+
+def _ejecutar_lote(tarea, lote):
+    model = get_model("fichas_en_lote")
+    prompt = f"""
+    {tarea}
+    FICHAS (JSON):
+    {json.dumps(lote, indent=2, ensure_ascii=False)}
+
+    Devuelve EXACTAMENTE una lista JSON con un objeto por ficha, conservando su 'id':
+    [{{ "id": "ID", "texto": "...", "cita_pie": "...", "referencia_bib": "..." }}]
     """
-    try:
-        response = model.generate_content(prompt, generation_config={"response_mime_type": "application/json"})
-        datos = json.loads(response.text)
-        
-        # --- FILTROS DE SEGURIDAD ---
-        if isinstance(datos, list): datos = datos[0]
-        if "ficha" in datos: datos = datos["ficha"]
-            
-        return {k.lower(): v for k, v in datos.items()}
-    except Exception:
-        return {"texto": texto_original, "cita_pie": "Error", "referencia_bib": "Error"}
+    return generar_estructurado(model, prompt, ESQUEMA_FICHA_LOTE)
+
+def _procesar_fichas_en_lote(fichas, tarea, incluir_debate=False):
+    """Devuelve (resultados, errores): dicts por id de ficha con los nuevos datos o el motivo del fallo."""
+    lotes = _empaquetar_lotes([_material_ficha(f, incluir_debate) for f in fichas])
+    resultados, errores = {}, {}
+
+    with ThreadPoolExecutor(max_workers=MAX_LOTES_PARALELOS) as pool:
+        futuros = [(lote, pool.submit(_ejecutar_lote, tarea, lote)) for lote in lotes]
+        for lote, futuro in futuros:
+            ids_lote = [m["id"] for m in lote]
+            try:
+                salida = futuro.result()
+            except SalidaEstructuradaError as e:
+                errores.update({fid: f"Respuesta inválida: {e}" for fid in ids_lote})
+                continue
+            except Exception as e:
+                errores.update({fid: f"Error en la API de Gemini: {e}" for fid in ids_lote})
+                continue
+            por_id = {item["id"]: item for item in salida}
+            for fid in ids_lote:
+                if fid in por_id:
+                    item = por_id[fid]
+                    resultados[fid] = {"texto": item["texto"], "cita_pie": item["cita_pie"], "referencia_bib": item["referencia_bib"]}
+                else:
+                    errores[fid] = "La IA no devolvió esta ficha en la respuesta del lote."
+    return resultados, errores
+
+def extraer_fichas_en_lote(fichas, estilo_citacion):
+    """Re-sintetiza varias fichas a partir de su debate y contexto, en el estilo de citación indicado."""
+    tarea = f"""Re-sintetiza cada una de estas fichas de trabajo a partir de su texto, su 'debate' y su 'contexto' (si existe).
+    'texto': desarrollo académico de la idea (máx 5 líneas). 'cita_pie' y 'referencia_bib': formateadas en estilo {estilo_citacion}.
+    Trata cada ficha de forma independiente y no mezcles fuentes entre fichas."""
+    return _procesar_fichas_en_lote(fichas, tarea, incluir_debate=True)
+
+def refinar_fichas_en_lote(fichas, instruccion_usuario, estilo_citacion):
+    """Aplica la misma instrucción de refinamiento a varias fichas a la vez."""
+    tarea = f"""Refina cada una de estas fichas de trabajo siguiendo las instrucciones del investigador.
+    INSTRUCCIÓN: "{instruccion_usuario}"
+    Estilo de citación para 'cita_pie' y 'referencia_bib': {estilo_citacion}.
+    Trata cada ficha de forma independiente y no mezcles fuentes entre fichas."""
+    return _procesar_fichas_en_lote(fichas, tarea)
 
 # --- FASE B/C: SÍNTESIS DE ÍNDICE DESDE FICHAS CON DEBATE PROFUNDO ---
-def generar_indice_desde_fichas(fichas_brutas):
-    model = get_model()
-    fichas_procesadas = []
+def _prompt_indice(fichas_brutas):
+    fichas_procesadas, debates = [], []
     for f in fichas_brutas:
         historial = "\n".join([f"{'Investigador' if m['role']=='user' else 'IA'}: {m['content']}" for m in f.get("chat_history", [])])
-        fichas_procesadas.append({
-            "id_ficha": f["id"], "categoria": f.get("categoria", ""),
-            "idea_resumen": f.get("texto", ""), "debate_profundo": historial if historial else "Nota directa."
-        })
+        fichas_procesadas.append({"id_ficha": f["id"], "categoria": f.get("categoria", ""), "idea_resumen": f.get("texto", "")})
+        debates.append(f"### Ficha {f['id']}\n{historial if historial else 'Nota directa.'}\n")
         
     fichas_str = json.dumps(fichas_procesadas, indent=2, ensure_ascii=False)
     
-    prompt = f"""
+    instrucciones = f"""
     Eres un Decano estructurando una tesis doctoral. 
     DEBES leer el debate profundo de cada ficha para entender los matices antes de proponer el índice.
     MATERIAL DE TRABAJO:
     {fichas_str}
-    
+
+    DEBATE PROFUNDO POR FICHA:
+    """
+    formato = """
     Devuelve EXACTAMENTE JSON:
-    {{
+    {
       "titulo_tesis": "Título sugerido",
       "capitulos": [
-        {{ "nro": 1, "titulo": "Título", "objetivo": "Objetivo detallado basado en el debate profundo", "fichas_asociadas": ["ID"] }}
+        { "nro": 1, "titulo": "Título", "objetivo": "Objetivo detallado basado en el debate profundo", "fichas_asociadas": ["ID"] }
       ]
-    }}
+    }
     """
-    try:
-        response = model.generate_content(prompt, generation_config={"response_mime_type": "application/json"})
-        return json.loads(response.text)
-    except Exception:
-        return {"titulo_tesis": "Error al generar índice", "capitulos": []}
+    # Los resúmenes e IDs son imprescindibles para el índice; los debates se recortan si no caben
+    return (ConstructorPrompt("generar_indice_desde_fichas")
+            .seccion("instrucciones", instrucciones)
+            .seccion("debates", "\n".join(debates), PRIORIDAD_HISTORIAL)
+            .seccion("instrucciones", formato))
+
+def estimar_generar_indice(fichas_brutas):
+    return _prompt_indice(fichas_brutas).estimacion()
+
+def generar_indice_desde_fichas(fichas_brutas):
+    prompt = _prompt_indice(fichas_brutas).construir()
+    model = get_model("generar_indice_desde_fichas")
+    return generar_estructurado(model, prompt, ESQUEMA_INDICE)
 
 # --- FASE D: EVALUADOR Y REFINADOR DE PROMPTS ---
+def notas_para_prompt(capitulo, fichas):
+    """Material del capítulo para la evaluación de prompts, en el orden de fichas_asociadas."""
+    por_id = {f['id']: f for f in fichas}
+    textos_notas = []
+    for fid in capitulo.get('fichas_asociadas', []):
+        f_real = por_id.get(fid)
+        if f_real:
+            hist = "\n".join([f"{m['role']}: {m['content']}" for m in f_real.get('chat_history', [])])
+            textos_notas.append(f"--- FICHA ---\nResumen: {f_real['texto']}\nDebate original:\n{hist}\n")
+    return "\n".join(textos_notas)
+
 def evaluar_y_crear_prompt_inteligente(capitulo, notas_texto):
-    model = get_model()
-    prompt = f"""
+    prompt = (ConstructorPrompt("evaluar_y_crear_prompt_inteligente")
+              .seccion("instrucciones", f"""
     Eres un Director de Tesis evaluando el material para el Capítulo: "{capitulo['titulo']}". Objetivo: {capitulo['objetivo']}
-    NOTAS RECOPILADAS (INCLUYEN DEBATE PROFUNDO): {notas_texto if notas_texto else "Ninguna nota."}
+    NOTAS RECOPILADAS (INCLUYEN DEBATE PROFUNDO): """)
+              .seccion("notas", notas_texto if notas_texto else "Ninguna nota.", PRIORIDAD_NOTAS if notas_texto else None)
+              .seccion("instrucciones", """
     
     TAREA: Evalúa si el material es suficiente y genera un Prompt Maestro.
     Devuelve EXCLUSIVAMENTE el texto del prompt generado.
-    """
+    """)
+              .construir())
+    model = get_model("evaluar_y_crear_prompt_inteligente")
     return model.generate_content(prompt).text
 
 # --- FASE E: REDACCIÓN FINAL Y BIBLIOGRAFÍA ---
-def execute_final_writing(prompt_maestro, notas_texto, idioma, estilo, estilo_citacion):
-    model = get_model()
-    prompt_final = f"""
+def _nota_redaccion(f, etiqueta="FICHA"):
+    hist = "\n".join([f"{m['role']}: {m['content']}" for m in f.get('chat_history', [])])
+    return f"--- {etiqueta} ---\nResumen principal: {f['texto']}\nCita: {f.get('cita_pie','')}\nDesarrollo profundo:\n{hist}\n"
+
+def notas_para_redaccion(capitulo, fichas):
+    """Material del capítulo para la redacción (resumen, cita y debate de cada ficha asociada)."""
+    asociadas = set(capitulo.get('fichas_asociadas', []))
+    return "\n".join(_nota_redaccion(f) for f in fichas if f['id'] in asociadas)
+
+def notas_por_ficha(capitulo, fichas):
+    """{id_ficha: nota} del capítulo, con el ID en la cabecera para que la IA pueda citarlo."""
+    asociadas = set(capitulo.get('fichas_asociadas', []))
+    return {f['id']: _nota_redaccion(f, f"FICHA {f['id']}") for f in fichas if f['id'] in asociadas}
+
+def _prompt_redaccion(prompt_maestro, notas_texto, idioma, estilo, estilo_citacion):
+    return (ConstructorPrompt("execute_final_writing")
+            .seccion("instrucciones", f"""
     INSTRUCCIÓN MAESTRA: {prompt_maestro}
-    MATERIAL BASE (NOTAS, CITAS Y DEBATE PROFUNDO): {notas_texto}
+    MATERIAL BASE (NOTAS, CITAS Y DEBATE PROFUNDO): """)
+            .seccion("notas", notas_texto, PRIORIDAD_NOTAS)
+            .seccion("instrucciones", f"""
     
     REQUISITOS: Idioma: {idioma}. Estilo: {estilo}. Citación: {estilo_citacion}. Asegúrate de insertar notas al pie.
     TAREA: Redacta el contenido del capítulo. NO saludes. Usa 'Pekín' con acento.
-    """
+    """))
+
+def estimar_execute_final_writing(prompt_maestro, notas_texto, idioma, estilo, estilo_citacion):
+    return _prompt_redaccion(prompt_maestro, notas_texto, idioma, estilo, estilo_citacion).estimacion()
+
+def execute_final_writing(prompt_maestro, notas_texto, idioma, estilo, estilo_citacion):
+    prompt_final = _prompt_redaccion(prompt_maestro, notas_texto, idioma, estilo, estilo_citacion).construir()
+    model = get_model("execute_final_writing")
     return model.generate_content(prompt_final).text
 
+# Redacción por secciones (ver modules/redaccion.py): cada sección declara las fichas que usa
+_REQUISITOS_SECCIONES = """
+    REQUISITOS: Idioma: {idioma}. Estilo: {estilo}. Citación: {estilo_citacion}. Asegúrate de insertar notas al pie.
+    No escribas el título dentro de 'texto'. NO saludes. Usa 'Pekín' con acento.
+    """
+
+def _prompt_redaccion_secciones(prompt_maestro, notas_por_id, idioma, estilo, estilo_citacion):
+    return (ConstructorPrompt("execute_final_writing")
+            .seccion("instrucciones", f"""
+    INSTRUCCIÓN MAESTRA: {prompt_maestro}
+    MATERIAL BASE (NOTAS, CITAS Y DEBATE PROFUNDO, CADA FICHA CON SU ID): """)
+            .seccion("notas", "\n".join(notas_por_id.values()), PRIORIDAD_NOTAS)
+            .seccion("instrucciones", _REQUISITOS_SECCIONES.format(idioma=idioma, estilo=estilo, estilo_citacion=estilo_citacion) + """
+    TAREA: Redacta el capítulo dividido en secciones. Para cada sección indica en 'fichas' los IDs de TODAS
+    las fichas en las que se apoya. Cada ficha debe aparecer al menos en una sección.
+    Devuelve EXACTAMENTE una lista JSON: [{ "titulo": "Título de la sección", "fichas": ["ID"], "texto": "Markdown" }]
+    """))
+
+def estimar_redactar_capitulo_por_secciones(prompt_maestro, notas_por_id, idioma, estilo, estilo_citacion):
+    return _prompt_redaccion_secciones(prompt_maestro, notas_por_id, idioma, estilo, estilo_citacion).estimacion()
+
+def redactar_capitulo_por_secciones(prompt_maestro, notas_por_id, idioma, estilo, estilo_citacion):
+    prompt = _prompt_redaccion_secciones(prompt_maestro, notas_por_id, idioma, estilo, estilo_citacion).construir()
+    model = get_model("redactar_capitulo_por_secciones")
+    return generar_estructurado(model, prompt, ESQUEMA_SECCIONES)
+
+def _prompt_redaccion_seccion(prompt_maestro, titulo, notas_texto, contexto, idioma, estilo, estilo_citacion):
+    encargo = f'Reescribe la sección "{titulo}"' if titulo else "Redacta una sección nueva"
+    return (ConstructorPrompt("execute_final_writing")
+            .seccion("instrucciones", f"""
+    INSTRUCCIÓN MAESTRA DEL CAPÍTULO: {prompt_maestro}
+    CONTEXTO DEL CAPÍTULO (las demás secciones no se modifican):
+    {contexto}
+    MATERIAL BASE DE ESTA SECCIÓN (NOTAS, CITAS Y DEBATE PROFUNDO): """)
+            .seccion("notas", notas_texto, PRIORIDAD_NOTAS)
+            .seccion("instrucciones", _REQUISITOS_SECCIONES.format(idioma=idioma, estilo=estilo, estilo_citacion=estilo_citacion) + f"""
+    TAREA: {encargo} usando solo este material, de modo que encaje en el lugar indicado del capítulo.
+    Indica en 'fichas' los IDs de las fichas en las que se apoya.
+    Devuelve EXACTAMENTE JSON: {{ "titulo": "Título de la sección", "fichas": ["ID"], "texto": "Markdown" }}
+    """))
+
+def estimar_redactar_seccion(prompt_maestro, titulo, notas_texto, contexto, idioma, estilo, estilo_citacion):
+    return _prompt_redaccion_seccion(prompt_maestro, titulo, notas_texto, contexto, idioma, estilo, estilo_citacion).estimacion()
+
+def redactar_seccion(prompt_maestro, titulo, notas_texto, contexto, idioma, estilo, estilo_citacion):
+    prompt = _prompt_redaccion_seccion(prompt_maestro, titulo, notas_texto, contexto, idioma, estilo, estilo_citacion).construir()
+    model = get_model("redactar_seccion")
+    return generar_estructurado(model, prompt, ESQUEMA_SECCION)
+
 def generar_bibliografia_global(contenido_completo, estilo_citacion):
-    model = get_model()
-    prompt = f"Lee la tesis y extrae/genera una lista bibliográfica en formato {estilo_citacion}.\nTESIS: {contenido_completo}\nDevuelve SOLO la bibliografía formateada."
+    prompt = (ConstructorPrompt("generar_bibliografia_global")
+              .seccion("instrucciones", f"Lee la tesis y extrae/genera una lista bibliográfica en formato {estilo_citacion}.\nTESIS: ")
+              .seccion("fuente", contenido_completo, PRIORIDAD_FUENTE)
+              .seccion("instrucciones", "\nDevuelve SOLO la bibliografía formateada.")
+              .construir())
+    model = get_model("generar_bibliografia_global")
     return model.generate_content(prompt).text
+
+def formatear_referencias(referencias, estilo_citacion):
+    """Formatea solo las referencias recibidas ({clave: referencia_bib}) y devuelve {clave: entrada}."""
+    if not referencias:
+        return {}
+    material = [{"clave": k, "referencia": v} for k, v in referencias.items()]
+    # Un JSON recortado no serviría: las referencias son fijas y, si no caben, se falla sin llamar a la API
+    prompt = (ConstructorPrompt("formatear_referencias")
+              .seccion("instrucciones", f"""
+    Formatea cada referencia bibliográfica en estilo {estilo_citacion}. No inventes datos que no aparezcan.
+    REFERENCIAS (JSON):
+    """)
+              .seccion("referencias", json.dumps(material, indent=2, ensure_ascii=False))
+              .seccion("instrucciones", """
+
+    Devuelve EXACTAMENTE una lista JSON con un objeto por referencia, conservando su 'clave':
+    [{ "clave": "CLAVE", "entrada": "Referencia formateada" }]
+    """)
+              .construir())
+    model = get_model("formatear_referencias")
+    salida = generar_estructurado(model, prompt, ESQUEMA_REFERENCIAS)
+    return {item["clave"]: item["entrada"] for item in salida if item["clave"] in referencias}
@@ -0,0 +1,71 @@
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from modules.ai_engine import formatear_referencias
+
+# --- MOTOR INCREMENTAL DE BIBLIOGRAFÍA ---
+# Las referencias ya existen como `referencia_bib` en cada ficha: las recogemos de los
+# capítulos redactados, las deduplicamos con una clave normalizada y solo enviamos al
+# modelo las que aún no tienen entrada formateada en la caché del estilo pedido. La caché es del
+# proceso (la comparten todas las sesiones) y se limita a MAX_ENTRADAS_BIBLIOGRAFIA con LRU.
+
+MAX_ENTRADAS_BIBLIOGRAFIA = 5000
+
+_cache_entradas = OrderedDict()  # {(estilo_citacion, clave): entrada_formateada}
+_cache_lock = threading.Lock()
+
+REFERENCIAS_INVALIDAS = {"", "error", "referencia pendiente", "sin bibliografia"}
+
+def clave_referencia(referencia):
+    """Clave de deduplicación: sin acentos, minúsculas, sin puntuación y con espacios colapsados."""
+    texto = unicodedata.normalize("NFKD", referencia)
+    texto = "".join(c for c in texto if not unicodedata.combining(c)).lower()
+    texto = re.sub(r"[^\w\s]", " ", texto)
+    return re.sub(r"\s+", " ", texto).strip()
+
+def recopilar_referencias(indice, contenido_redactado, fichas):
+    """Devuelve {clave: referencia_bib} de las fichas vinculadas a los capítulos ya redactados."""
+    capitulos_redactados = {str(n) for n in (contenido_redactado or {}).keys()}
+    ids_vinculados = set()
+    for cap in (indice or {}).get("capitulos", []):
+        if str(cap.get("nro")) in capitulos_redactados:
+            ids_vinculados.update(cap.get("fichas_asociadas", []))
+
+    referencias = {}
+    for f in fichas:
+        if f.get("id") not in ids_vinculados:
+            continue
+        ref = (f.get("referencia_bib") or "").strip()
+        clave = clave_referencia(ref)
+        if clave in REFERENCIAS_INVALIDAS or clave in referencias:
+            continue
+        referencias[clave] = ref
+    return referencias
+
+def generar_bibliografia_incremental(indice, contenido_redactado, fichas, estilo_citacion):
+    """Compone la bibliografía formateando con la IA únicamente las referencias nuevas."""
+    referencias = recopilar_referencias(indice, contenido_redactado, fichas)
+
+    entradas_por_clave = {}
+    with _cache_lock:
+        for k in referencias:
+            if (estilo_citacion, k) in _cache_entradas:
+                _cache_entradas.move_to_end((estilo_citacion, k))
+                entradas_por_clave[k] = _cache_entradas[(estilo_citacion, k)]
+    pendientes = {k: v for k, v in referencias.items() if k not in entradas_por_clave}
+
+    if pendientes:
+        nuevas = formatear_referencias(pendientes, estilo_citacion)
+        entradas_por_clave.update(nuevas)
+        with _cache_lock:
+            for k, entrada in nuevas.items():
+                _cache_entradas[(estilo_citacion, k)] = entrada
+                _cache_entradas.move_to_end((estilo_citacion, k))
+            while len(_cache_entradas) > MAX_ENTRADAS_BIBLIOGRAFIA:
+                _cache_entradas.popitem(last=False)
+
+    # Si el modelo omitió alguna, usamos la referencia original (sin cachearla) en lugar de perderla
+    entradas = [entradas_por_clave.get(k, ref) for k, ref in referencias.items()]
+    return "\n\n".join(sorted(entradas, key=clave_referencia))
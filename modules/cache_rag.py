@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from modules.database import search_research_data
+from modules.normalizacion import normalizar
+from modules.tracing import span
+
+# --- CACHÉ Y PRECARGA DE LA RECUPERACIÓN RAG ---
+# Los resultados de `search_research_data` se guardan por (tabla, palabras clave normalizadas)
+# durante TTL_RAG_S: añadir una tabla a la selección solo consulta esa tabla, y el mismo contexto
+# se reutiliza entre conversaciones. `precargar()` lanza la búsqueda en segundo plano en cuanto
+# cambian los controles, de modo que al enviar el mensaje el contexto ya suele estar listo.
+# Las tablas que fallan no se cachean: el siguiente envío vuelve a intentarlo.
+
+TTL_RAG_S = 600
+MAX_ENTRADAS_RAG = 128
+MAX_BUSQUEDAS_PARALELAS = 4
+
+_cache = OrderedDict()  # {(tabla, keywords): (instante, resultado)}
+_en_curso = {}          # {(tabla, keywords): Future}
+_lock = threading.RLock()  # reentrante: add_done_callback corre en el acto si el futuro ya terminó
+_pool = ThreadPoolExecutor(max_workers=MAX_BUSQUEDAS_PARALELAS, thread_name_prefix="rag")
+
+def keywords_canonicas(keywords_raw):
+    """Palabras clave sin duplicados ni orden: "仁, 義" y "义,仁 " dan la misma clave."""
+    unicas = {}
+    for k in (keywords_raw or "").split(","):
+        k = k.strip()
+        if k:
+            unicas.setdefault(normalizar(k.lower()), k)
+    return ", ".join(unicas[n] for n in sorted(unicas))
+
+def _clave(tabla, keywords):
+    return tabla, normalizar(keywords.lower())
+
+def _buscar_tabla(tabla, keywords):
+    errores = []
+    with span("rag.tabla", "rag", tabla=tabla):
+        resultado = search_research_data([tabla], keywords, errores)
+    return resultado, errores
+
+def _al_terminar(clave, futuro):
+    with _lock:
+        _en_curso.pop(clave, None)
+        if futuro.cancelled() or futuro.exception() is not None:
+            return
+        resultado, errores = futuro.result()
+        if not errores:
+            _cache[clave] = (time.monotonic(), resultado)
+            _cache.move_to_end(clave)
+            while len(_cache) > MAX_ENTRADAS_RAG:
+                _cache.popitem(last=False)
+
+def _vigente(clave):
+    """Resultado cacheado si no ha caducado (llamar con el lock tomado)."""
+    entrada = _cache.get(clave)
+    if entrada is None:
+        return None
+    instante, resultado = entrada
+    if time.monotonic() - instante > TTL_RAG_S:
+        del _cache[clave]
+        return None
+    _cache.move_to_end(clave)
+    return resultado
+
+def _lanzar(tablas, keywords):
+    """{tabla: resultado | Future}; lanza las búsquedas que no están cacheadas ni en curso."""
+    pendientes = {}
+    with _lock:
+        for tabla in dict.fromkeys(tablas):
+            clave = _clave(tabla, keywords)
+            resultado = _vigente(clave)
+            if resultado is not None:
+                pendientes[tabla] = resultado
+                continue
+            futuro = _en_curso.get(clave)
+            if futuro is None:
+                futuro = _pool.submit(_buscar_tabla, tabla, keywords)
+                _en_curso[clave] = futuro
+                futuro.add_done_callback(lambda f, clave=clave: _al_terminar(clave, f))
+            pendientes[tabla] = futuro
+    return pendientes
+
+def precargar(tablas, keywords_raw):
+    """Empieza a recuperar el contexto en segundo plano; no bloquea."""
+    keywords = keywords_canonicas(keywords_raw)
+    if tablas and keywords:
+        _lanzar(tablas, keywords)
+
+def buscar_rag(tablas, keywords_raw, errores=None):
+    """Como `search_research_data`, pero sirviendo desde la caché o esperando a la precarga en curso."""
+    keywords = keywords_canonicas(keywords_raw)
+    if not tablas or not keywords:
+        return []
+    contexto = []
+    for tabla, pendiente in _lanzar(tablas, keywords).items():
+        if hasattr(pendiente, "result"):
+            resultado, errores_tabla = pendiente.result()
+            if errores is not None:
+                errores.extend(errores_tabla)
+        else:
+            resultado = pendiente
+        contexto.extend(resultado)
+    return contexto
@@ -0,0 +1,190 @@
+"""Exportación de concordancias (KWIC) a CSV, XLSX o JSONL.
+
+Recorre todas las coincidencias de una consulta (ver modules/lenguaje_consulta.py) en las tablas
+elegidas y las escribe según llegan de la base de datos, página a página: la memoria no crece con
+el número de resultados. Cada aparición de un término de la consulta dentro de una fila es una línea.
+
+Uso:
+    python -m modules.concordancias salida.csv "仁 NEAR/5 義" Mencio Xunzi --contexto 30
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+import zipfile
+from xml.sax.saxutils import escape
+
+from modules.database import iterar_concordancias
+from modules.lenguaje_consulta import ConsultaInvalidaError, compilar_consulta
+from modules.tracing import span
+
+COLUMNAS = ("tabla", "id", "desplazamiento", "izquierda", "nodo", "derecha")
+CONTEXTO_POR_DEFECTO = 40
+MAX_CONTEXTO = 500
+# Límite de filas de una hoja de Excel (sin contar la cabecera)
+MAX_FILAS_XLSX = 1_048_575
+# Ficheros generados por la app; los que superan MAX_EDAD_EXPORTACION segundos se borran al crear otro
+DIRECTORIO_EXPORTACIONES = os.path.join(tempfile.gettempdir(), "probatio_concordancias")
+MAX_EDAD_EXPORTACION = 6 * 3600
+
+_PATRON_ESPACIOS = re.compile(r"\s+")
+_PATRON_XML_INVALIDO = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def lineas_kwic(tablas, consulta, contexto=CONTEXTO_POR_DEFECTO, errores=None):
+    """Genera un dict por coincidencia con las COLUMNAS (contexto izquierdo/derecho en caracteres)."""
+    contexto = max(0, min(int(contexto), MAX_CONTEXTO))
+    for tabla, columna, fila in iterar_concordancias(tablas, consulta, errores):
+        texto = str(fila.get(columna) or "")
+        for ini, fin in consulta.coincidencias(texto):
+            yield {
+                "tabla": tabla,
+                "id": fila.get("id", ""),
+                "desplazamiento": ini,
+                "izquierda": _PATRON_ESPACIOS.sub(" ", texto[max(0, ini - contexto):ini]),
+                "nodo": texto[ini:fin],
+                "derecha": _PATRON_ESPACIOS.sub(" ", texto[fin:fin + contexto]),
+            }
+
+
+# --- REGISTRO DE FORMATOS ---
+# Cada escritor recibe un fichero binario de salida y un iterable de líneas; devuelve cuántas escribió.
+FORMATOS = {}
+
+def registrar_formato(formato, etiqueta, extension, mime):
+    def decorador(funcion):
+        FORMATOS[formato] = {"etiqueta": etiqueta, "extension": extension, "mime": mime, "escribir": funcion}
+        return funcion
+    return decorador
+
+@registrar_formato("csv", "CSV (.csv)", "csv", "text/csv")
+def escribir_csv(salida, lineas):
+    # utf-8-sig: Excel abre bien el CJK si el fichero lleva BOM
+    texto = io.TextIOWrapper(salida, encoding="utf-8-sig", newline="")
+    escritor = csv.DictWriter(texto, fieldnames=COLUMNAS)
+    escritor.writeheader()
+    n = 0
+    for linea in lineas:
+        escritor.writerow(linea)
+        n += 1
+    texto.flush()
+    texto.detach()
+    return n
+
+@registrar_formato("jsonl", "JSON Lines (.jsonl)", "jsonl", "application/x-ndjson")
+def escribir_jsonl(salida, lineas):
+    n = 0
+    for linea in lineas:
+        salida.write(json.dumps(linea, ensure_ascii=False, default=str).encode("utf-8") + b"\n")
+        n += 1
+    return n
+
+def _celda_xlsx(valor):
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        return f"<c><v>{valor}</v></c>"
+    texto = _PATRON_XML_INVALIDO.sub("", str(valor))[:32767]
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{escape(texto)}</t></is></c>'
+
+def _fila_xlsx(valores):
+    return ("<row>" + "".join(_celda_xlsx(v) for v in valores) + "</row>").encode("utf-8")
+
+@registrar_formato("xlsx", "Excel (.xlsx)", "xlsx",
+                   "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+def escribir_xlsx(salida, lineas):
+    """SpreadsheetML mínimo escrito a mano: cadenas en línea (sin tabla de cadenas compartidas que
+    habría que tener entera en memoria) y la hoja volcada en streaming dentro del zip."""
+    n = 0
+    with zipfile.ZipFile(salida, "w", zipfile.ZIP_DEFLATED) as libro:
+        libro.writestr("[Content_Types].xml",
+                       '<?xml version="1.0" encoding="UTF-8"?>\n'
+                       '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                       '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                       '<Default Extension="xml" ContentType="application/xml"/>'
+                       '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+                       '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+                       '</Types>')
+        libro.writestr("_rels/.rels",
+                       '<?xml version="1.0" encoding="UTF-8"?>\n'
+                       '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                       '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+                       '</Relationships>')
+        libro.writestr("xl/workbook.xml",
+                       '<?xml version="1.0" encoding="UTF-8"?>\n'
+                       '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+                       'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+                       '<sheets><sheet name="Concordancias" sheetId="1" r:id="rId1"/></sheets></workbook>')
+        libro.writestr("xl/_rels/workbook.xml.rels",
+                       '<?xml version="1.0" encoding="UTF-8"?>\n'
+                       '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                       '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+                       '</Relationships>')
+        with libro.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as hoja:
+            hoja.write(b'<?xml version="1.0" encoding="UTF-8"?>\n'
+                       b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+            hoja.write(_fila_xlsx(COLUMNAS))
+            for linea in lineas:
+                if n >= MAX_FILAS_XLSX:
+                    break
+                hoja.write(_fila_xlsx(linea[c] for c in COLUMNAS))
+                n += 1
+            hoja.write(b"</sheetData></worksheet>")
+    return n
+
+
+def limpiar_exportaciones(max_edad=MAX_EDAD_EXPORTACION):
+    """Borra los ficheros de DIRECTORIO_EXPORTACIONES más antiguos que `max_edad` segundos (las
+    sesiones que se cierran sin regenerar su exportación dejan el suyo atrás)."""
+    limite = time.time() - max_edad
+    try:
+        entradas = list(os.scandir(DIRECTORIO_EXPORTACIONES))
+    except OSError:
+        return
+    for entrada in entradas:
+        try:
+            if entrada.is_file() and entrada.stat().st_mtime < limite:
+                os.remove(entrada.path)
+        except OSError:
+            # Otro proceso lo borró antes
+            pass
+
+def fichero_exportacion(formato):
+    """Fichero temporal persistente para una exportación de la app (el llamador lo borra)."""
+    limpiar_exportaciones()
+    os.makedirs(DIRECTORIO_EXPORTACIONES, exist_ok=True)
+    return tempfile.NamedTemporaryFile(suffix=f".{FORMATOS[formato]['extension']}",
+                                       dir=DIRECTORIO_EXPORTACIONES, delete=False)
+
+
+def exportar_concordancias(tablas, termino, formato, salida, contexto=CONTEXTO_POR_DEFECTO, errores=None):
+    """Escribe en `salida` (fichero binario) todas las concordancias de `termino`. Devuelve el número
+    de líneas. Lanza ConsultaInvalidaError si la consulta no es válida o no tiene ningún término
+    positivo (solo NOT recorrería las tablas enteras sin producir ninguna línea)."""
+    consulta = compilar_consulta(termino)
+    if not consulta.tiene_terminos_positivos:
+        raise ConsultaInvalidaError("La consulta necesita al menos un término que no esté negado.")
+    with span(f"concordancias.{formato}", "export", tablas=len(tablas)):
+        return FORMATOS[formato]["escribir"](salida, lineas_kwic(tablas, consulta, contexto, errores))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exporta concordancias KWIC del corpus.")
+    parser.add_argument("salida", help="Fichero de salida; el formato se deduce de la extensión")
+    parser.add_argument("consulta")
+    parser.add_argument("tablas", nargs="+")
+    parser.add_argument("--contexto", type=int, default=CONTEXTO_POR_DEFECTO)
+    args = parser.parse_args()
+
+    formato = args.salida.rsplit(".", 1)[-1].lower()
+    if formato not in FORMATOS:
+        parser.error(f"Extensión no soportada; usa una de: {', '.join(FORMATOS)}")
+    errores = []
+    with open(args.salida, "wb") as f:
+        total = exportar_concordancias(args.tablas, args.consulta, formato, f, args.contexto, errores)
+    for mensaje in errores:
+        print(mensaje, file=sys.stderr)
+    print(f"{total} concordancias en {args.salida}")
@@ -1,18 +1,134 @@
-import streamlit as st
-from supabase import create_client, Client
+import functools
+import logging
+import os
 import re
+from typing import TYPE_CHECKING
+
+from modules.lenguaje_consulta import compilar_consulta
+from modules.normalizacion import SUFIJO_COLUMNA_NORMALIZADA, columna_normalizada, normalizar, variantes_de
+from modules.tracing import envolver_cliente
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+logger = logging.getLogger("probatio.database")
 
 # --- CONFIGURACIÓN DE CONEXIÓN ---
+# El módulo no depende de Streamlit: la app pasa sus secrets con configurar_conexion() y los
+# procesos sin interfaz (pipeline, workers) usan SUPABASE_URL / SUPABASE_KEY del entorno.
+# Los errores no fatales se registran en el log y se devuelven al llamador, que decide cómo
+# mostrarlos. El SDK de supabase se importa al crear el primer cliente, no al importar el módulo.
+
+_credenciales = {}
+
+def configurar_conexion(url, key):
+    if _credenciales.get("url") != url or _credenciales.get("key") != key:
+        _credenciales.update(url=url, key=key)
+        _crear_cliente.cache_clear()
+
+def _leer_credenciales():
+    url = _credenciales.get("url") or os.environ.get("SUPABASE_URL")
+    key = _credenciales.get("key") or os.environ.get("SUPABASE_KEY")
+    if not url or not key:
+        raise RuntimeError("Faltan las credenciales de Supabase (SUPABASE_URL / SUPABASE_KEY).")
+    return url, key
+
+def crear_cliente_auth() -> "Client":
+    """Cliente propio para iniciar sesión: la sesión de un usuario no debe quedar en el cliente compartido."""
+    from supabase import create_client
+    return create_client(*_leer_credenciales())
+
+@functools.lru_cache(maxsize=1)
+def _crear_cliente() -> "Client":
+    from supabase import create_client
+    return create_client(*_leer_credenciales())
 
-@st.cache_resource
-def get_supabase_client() -> Client:
+def mensaje_error_db(e):
+    """Texto legible de una excepción de PostgREST (details/message si existen)."""
+    if getattr(e, 'details', None): return f"{e.details}"
+    if getattr(e, 'message', None): return f"{e.message}"
+    return str(e)
+
+def _registrar_error(errores, mensaje):
+    logger.error(mensaje)
+    if errores is not None:
+        errores.append(mensaje)
+
+def get_supabase_client() -> "Client":
     """Retorna el cliente de Supabase configurado. Usamos cache para optimizar conexiones."""
-    return create_client(st.secrets["SUPABASE_URL"], st.secrets["SUPABASE_KEY"])
+    return envolver_cliente(_crear_cliente())
+
+# --- BÚSQUEDA INSENSIBLE A VARIANTES CJK ---
+
+def _ilike_variantes(supabase, tabla, columna, fila_prueba, termino, limite):
+    """Busca `termino` en todas sus grafías. Con columna sombra `<col>_norm` basta una consulta;
+    sin ella, una micro-consulta por variante (como máximo MAX_VARIANTES_CONSULTA)."""
+    col_norm = columna_normalizada(columna)
+    if col_norm in fila_prueba:
+        return supabase.table(tabla).select("*").ilike(col_norm, f"%{normalizar(termino)}%").limit(limite).execute().data
+
+    filas, ids_vistos = [], set()
+    for variante in variantes_de(termino):
+        res = supabase.table(tabla).select("*").ilike(columna, f"%{variante}%").limit(limite - len(filas)).execute()
+        for fila in res.data:
+            fid = fila.get("id", str(fila))
+            if fid not in ids_vistos:
+                ids_vistos.add(fid)
+                filas.append(fila)
+        if len(filas) >= limite:
+            break
+    return filas
+
+# --- PLAN DE CONSULTA DEL BUSCADOR DE CORPUS ---
+
+MAX_RESULTADOS_CORPUS = 50
+TAMANO_PAGINA_CORPUS = 100
+MAX_FILAS_EXPLORADAS = 5000
+MAX_LITERALES_EMPUJADOS = 3
+TAMANO_PAGINA_OBRA = 1000
+
+def _filas_candidatas(supabase, tabla, columna, fila_prueba, literales,
+                      max_filas=MAX_FILAS_EXPLORADAS, tamano_pagina=TAMANO_PAGINA_CORPUS):
+    """Recorre por páginas las filas que contienen los literales obligatorios de la consulta.
+
+    Con columna sombra se empujan hasta MAX_LITERALES_EMPUJADOS literales en una sola consulta
+    (la base de datos los resuelve con el índice trigram). Sin ella se empuja solo el más
+    selectivo, en cada una de sus grafías. Sin literales (solo regex o NOT) se recorre la tabla
+    (hasta `max_filas`; None la recorre entera).
+    """
+    col_norm = columna_normalizada(columna)
+    if col_norm in fila_prueba:
+        filtros = [[(col_norm, literal) for literal in literales[:MAX_LITERALES_EMPUJADOS]]]
+    elif literales:
+        filtros = [[(columna, variante)] for variante in variantes_de(literales[0])]
+    else:
+        filtros = [[]]
+
+    ids_vistos, exploradas = set(), 0
+    for filtro in filtros:
+        inicio = 0
+        while max_filas is None or exploradas < max_filas:
+            consulta = supabase.table(tabla).select("*")
+            for col, literal in filtro:
+                consulta = consulta.ilike(col, f"%{literal}%")
+            if "id" in fila_prueba:
+                consulta = consulta.order("id")
+            pagina = consulta.range(inicio, inicio + tamano_pagina - 1).execute().data
+            exploradas += len(pagina)
+            for fila in pagina:
+                fid = fila.get("id", str(fila))
+                if fid not in ids_vistos:
+                    ids_vistos.add(fid)
+                    yield fila
+            if len(pagina) < tamano_pagina:
+                break
+            inicio += tamano_pagina
 
 # --- 1. MÓDULO DE BÚSQUEDA DE INVESTIGACIÓN (RAG ROBUSTO Y PARALELO) ---
 
-def search_research_data(tablas_seleccionadas, keywords_raw):
-    """Búsqueda RAG omnidireccional segura. Evita errores de sintaxis OR realizando micro-consultas."""
+def search_research_data(tablas_seleccionadas, keywords_raw, errores=None):
+    """Búsqueda RAG omnidireccional segura. Evita errores de sintaxis OR realizando micro-consultas.
+    Las tablas que fallan se saltan; su error se añade a `errores` si se pasa una lista."""
     supabase = get_supabase_client()
     contexto_encontrado = []
     
@@ -36,6 +152,7 @@ def search_research_data(tablas_seleccionadas, keywords_raw):
             # Identificamos columnas seguras de texto (ej. "Palabras Clave", "Nombre artículo")
             for col_name, col_value in fila_prueba.items():
                 if col_name.lower() in columnas_ignoradas: continue
+                if col_name.endswith(SUFIJO_COLUMNA_NORMALIZADA): continue
                 if not isinstance(col_value, str): continue
                 if patron_fecha.match(col_value) or patron_uuid.match(col_value): continue
                 columnas_busqueda.append(col_name)
@@ -50,8 +167,7 @@ def search_research_data(tablas_seleccionadas, keywords_raw):
                 for col in columnas_busqueda:
                     try:
                         # Usamos el ilike nativo de Python que maneja espacios perfectamente
-                        res = supabase.table(tabla).select("*").ilike(col, f"%{kw}%").limit(5).execute()
-                        for fila in res.data:
+                        for fila in _ilike_variantes(supabase, tabla, col, fila_prueba, kw, 5):
                             # Evitamos meter la misma fila dos veces si coincide en varias columnas
                             fid = fila.get("id", str(fila)) 
                             if fid not in ids_encontrados:
@@ -68,68 +184,118 @@ def search_research_data(tablas_seleccionadas, keywords_raw):
                 })
                 
         except Exception as e:
-            # Ahora mostramos el error en pantalla en lugar de ocultarlo, por si hay fallos de red
-            st.error(f"⚠️ Error al acceder a la tabla '{tabla}': {str(e)}")
+            # No lo ocultamos: el llamador lo muestra, por si hay fallos de red
+            _registrar_error(errores, f"⚠️ Error al acceder a la tabla '{tabla}': {str(e)}")
             
     return contexto_encontrado
 
 # --- NUEVO: BUSCADOR EXACTO DE CORPUS CON ESCUDO ANTIMETADATOS ---
-def search_corpus_exact(tablas_seleccionadas, termino_busqueda):
-    """Busca un término detectando automáticamente la columna de texto y bloqueando fechas/IDs."""
-    supabase = get_supabase_client()
-    resultados_totales = []
-    
-    if not termino_busqueda: return []
 
+def _columna_texto(fila_prueba):
+    """Detecta la columna con el texto del corpus en una fila de muestra, ignorando fechas/IDs."""
     columnas_ignoradas = ["id", "uuid", "user_id", "created_at", "updated_at", "fecha_creacion", "fecha", "time"]
     patron_fecha = re.compile(r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}')
     patron_uuid = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$', re.IGNORECASE)
 
+    columnas_validas = []
+    for col_name, col_value in fila_prueba.items():
+        if col_name.lower() in columnas_ignoradas: continue
+        if col_name.endswith(SUFIJO_COLUMNA_NORMALIZADA): continue
+        if not isinstance(col_value, str): continue
+        if patron_fecha.match(col_value) or patron_uuid.match(col_value): continue
+        columnas_validas.append(col_name)
+
+    if not columnas_validas: return None
+
+    posibles_nombres = ["Texto", "texto", "Contenido", "contenido", "text", "Traduccion", "traduccion", "Original", "original"]
+    columna_objetivo = next((k for k in columnas_validas if k in posibles_nombres), None)
+    if not columna_objetivo:
+        columna_objetivo = max(columnas_validas, key=lambda k: len(fila_prueba.get(k, "")))
+    return columna_objetivo
+
+def search_corpus_exact(tablas_seleccionadas, termino_busqueda, errores=None):
+    """Busca una consulta (ver modules/lenguaje_consulta.py) detectando automáticamente la columna
+    de texto y bloqueando fechas/IDs. Lanza ConsultaInvalidaError si la sintaxis no es válida;
+    los fallos de una tabla concreta se añaden a `errores`."""
+    supabase = get_supabase_client()
+    resultados_totales = []
+    
+    if not termino_busqueda: return []
+    consulta = compilar_consulta(termino_busqueda)
+
     for tabla in tablas_seleccionadas:
         try:
             sample = supabase.table(tabla).select("*").limit(1).execute()
             if not sample.data: continue 
                 
             fila_prueba = sample.data[0]
-            columnas_validas = []
-            
-            for col_name, col_value in fila_prueba.items():
-                if col_name.lower() in columnas_ignoradas: continue
-                if not isinstance(col_value, str): continue
-                if patron_fecha.match(col_value) or patron_uuid.match(col_value): continue
-                columnas_validas.append(col_name)
-            
-            if not columnas_validas: continue 
+            columna_objetivo = _columna_texto(fila_prueba)
+            if not columna_objetivo: continue
             
-            posibles_nombres = ["Texto", "texto", "Contenido", "contenido", "text", "Traduccion", "traduccion", "Original", "original"]
-            columna_objetivo = next((k for k in columnas_validas if k in posibles_nombres), None)
+            # Los literales obligatorios filtran en la base de datos; el resto de la consulta
+            # se evalúa en una sola pasada sobre las filas candidatas según van llegando
+            filas = []
+            for fila in _filas_candidatas(supabase, tabla, columna_objetivo, fila_prueba, consulta.literales):
+                if consulta.coincide(str(fila.get(columna_objetivo, ""))):
+                    filas.append(fila)
+                    if len(filas) >= MAX_RESULTADOS_CORPUS:
+                        break
             
-            if not columna_objetivo:
-                columna_objetivo = max(columnas_validas, key=lambda k: len(fila_prueba.get(k, "")))
-            
-            response = supabase.table(tabla).select("*").ilike(columna_objetivo, f"%{termino_busqueda}%").limit(50).execute()
-            
-            if response.data:
+            if filas:
                 resultados_totales.append({
                     "tabla": tabla,
                     "columna_usada": columna_objetivo, 
-                    "resultados": response.data
+                    "resultados": filas
                 })
         except Exception as e:
-            st.error(f"Error interno en tabla {tabla}: {str(e)}")
+            _registrar_error(errores, f"Error interno en tabla {tabla}: {str(e)}")
             
     return resultados_totales
 
+def iterar_concordancias(tablas_seleccionadas, consulta, errores=None):
+    """Recorre TODAS las filas que cumplen una consulta ya compilada, tabla a tabla y página a
+    página, sin límite de resultados. Produce (tabla, columna, fila) según llegan."""
+    supabase = get_supabase_client()
+    for tabla in tablas_seleccionadas:
+        try:
+            sample = supabase.table(tabla).select("*").limit(1).execute()
+            if not sample.data: continue
+            fila_prueba = sample.data[0]
+            columna_objetivo = _columna_texto(fila_prueba)
+            if not columna_objetivo: continue
+            for fila in _filas_candidatas(supabase, tabla, columna_objetivo, fila_prueba, consulta.literales,
+                                          max_filas=None, tamano_pagina=TAMANO_PAGINA_OBRA):
+                if consulta.coincide(str(fila.get(columna_objetivo, ""))):
+                    yield tabla, columna_objetivo, fila
+        except Exception as e:
+            _registrar_error(errores, f"Error interno en tabla {tabla}: {str(e)}")
+
+def get_corpus_texts(tabla):
+    """Todos los fragmentos de texto de una obra del corpus, en orden, para las estadísticas."""
+    supabase = get_supabase_client()
+    sample = supabase.table(tabla).select("*").limit(1).execute()
+    if not sample.data: return []
+    columna = _columna_texto(sample.data[0])
+    if not columna: return []
+    return [str(fila.get(columna) or "") for fila in _filas_candidatas(supabase, tabla, columna, sample.data[0], [],
+                                                                     max_filas=None, tamano_pagina=TAMANO_PAGINA_OBRA)]
+
 # --- 2. GESTIÓN DE PROYECTOS (TESIS / MONOGRAFÍAS) ---
 
 def get_user_projects(user_id):
     supabase = get_supabase_client()
-    try:
-        res = supabase.table("proyectos_a").select("*").eq("user_id", user_id).execute()
-        return res.data
-    except Exception as e:
-        st.error(f"Error al cargar los proyectos: {str(e)}")
-        return []
+    res = supabase.table("proyectos_a").select("*").eq("user_id", user_id).execute()
+    return res.data
+
+# Columnas añadidas a `proyectos_a` después del esquema original (idempotente). Mientras no se
+# apliquen, la app sigue funcionando: las secciones de la redacción incremental no se guardan y
+# cada capítulo se redacta entero. `python -m modules.database` imprime el DDL.
+MIGRACIONES_PROYECTOS = (
+    "ALTER TABLE proyectos_a ADD COLUMN IF NOT EXISTS secciones_redactadas jsonb DEFAULT '{}'::jsonb;",
+)
+
+def sql_migraciones():
+    return "\n".join(MIGRACIONES_PROYECTOS)
 
 def create_new_project(user_id, nombre_tesis):
     supabase = get_supabase_client()
@@ -141,11 +307,12 @@ def create_new_project(user_id, nombre_tesis):
     try:
         return supabase.table("proyectos_a").insert(nuevo_proy).execute()
     except Exception as e:
-        error_msg = str(e)
-        if hasattr(e, 'details') and e.details: error_msg = f"{e.details}"
-        elif hasattr(e, 'message') and e.message: error_msg = f"{e.message}"
-        st.error(f"Fallo en la base de datos al insertar: {error_msg}")
-        raise e 
+        logger.error(f"Fallo en la base de datos al insertar: {mensaje_error_db(e)}")
+        raise
+
+def get_project(project_id):
+    supabase = get_supabase_client()
+    return supabase.table("proyectos_a").select("*").eq("id", project_id).single().execute().data
 
 def update_project_data(project_id, data_dict):
     supabase = get_supabase_client()
@@ -159,5 +326,9 @@ def get_user_profile(user_id):
         res = supabase.table("perfiles").select("*").eq("id", user_id).single().execute()
         return res.data
     except Exception as e:
-        st.error(f"Error al obtener el perfil: {str(e)}")
+        logger.error(f"Error al obtener el perfil: {str(e)}")
         return None
+
+
+if __name__ == "__main__":
+    print(sql_migraciones())
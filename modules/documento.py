@@ -0,0 +1,86 @@
+import re
+
+# --- ÁRBOL INTERMEDIO DEL DOCUMENTO ---
+# Los borradores se parsean UNA vez desde Markdown a este árbol y todos los exportadores
+# (Word, Markdown, LaTeX, EPUB, HTML) renderizan a partir de él.
+#
+# documento = {"titulo": str, "capitulos": [capitulo], "bibliografia": [bloque]}
+# capitulo  = {"nro": str, "titulo": str, "bloques": [bloque], "notas": [(numero, inlines)]}
+# bloque    = {"tipo": "titulo" | "parrafo" | "vineta" | "numerada" | "cita", "nivel": int, "inlines": inlines}
+# inlines   = [(estilo, texto)] con estilo en "texto" | "negrita" | "cursiva" | "nota"
+
+PATRON_TITULO = re.compile(r'^(#{1,6})\s+(.*)$')
+PATRON_VINETA = re.compile(r'^\s*[-*+]\s+(.*)$')
+PATRON_NUMERADA = re.compile(r'^\s*\d+[.)]\s+(.*)$')
+PATRON_CITA = re.compile(r'^>\s?(.*)$')
+PATRON_DEF_NOTA = re.compile(r'^\[\^([^\]]+)\]:\s*(.*)$')
+PATRON_SEPARADOR = re.compile(r'^\s*([-*_])(\s*\1){2,}\s*$')
+PATRON_INLINE = re.compile(r'(\*\*.+?\*\*|__.+?__|\*[^*\s][^*]*?\*|_[^_\s][^_]*?_|\[\^[^\]]+\])')
+
+def parsear_inlines(texto, notas_orden):
+    """Trocea el texto en runs con estilo; las llamadas [^x] se numeran por orden de aparición."""
+    inlines = []
+    for trozo in PATRON_INLINE.split(texto):
+        if not trozo:
+            continue
+        if trozo.startswith("[^"):
+            etiqueta = trozo[2:-1]
+            if etiqueta not in notas_orden:
+                notas_orden[etiqueta] = len(notas_orden) + 1
+            inlines.append(("nota", str(notas_orden[etiqueta])))
+        elif (trozo.startswith("**") or trozo.startswith("__")) and len(trozo) > 4:
+            inlines.append(("negrita", trozo[2:-2]))
+        elif (trozo.startswith("*") or trozo.startswith("_")) and len(trozo) > 2:
+            inlines.append(("cursiva", trozo[1:-1]))
+        else:
+            inlines.append(("texto", trozo))
+    return inlines
+
+def parsear_markdown(texto):
+    """Convierte Markdown en (bloques, notas) en una sola pasada por líneas."""
+    bloques, notas_orden, notas_def = [], {}, {}
+    parrafo = []
+
+    def volcar():
+        if parrafo:
+            bloques.append({"tipo": "parrafo", "nivel": 0, "inlines": parsear_inlines(" ".join(parrafo), notas_orden)})
+            parrafo.clear()
+
+    for linea in (texto or "").splitlines():
+        linea = linea.rstrip()
+        if not linea.strip() or PATRON_SEPARADOR.match(linea):
+            volcar()
+            continue
+        if m := PATRON_DEF_NOTA.match(linea):
+            volcar()
+            notas_def[m.group(1)] = m.group(2)
+            continue
+        if m := PATRON_TITULO.match(linea):
+            volcar()
+            bloques.append({"tipo": "titulo", "nivel": len(m.group(1)), "inlines": parsear_inlines(m.group(2).strip("# "), notas_orden)})
+            continue
+        tipo, contenido = None, None
+        if m := PATRON_VINETA.match(linea):
+            tipo, contenido = "vineta", m.group(1)
+        elif m := PATRON_NUMERADA.match(linea):
+            tipo, contenido = "numerada", m.group(1)
+        elif m := PATRON_CITA.match(linea):
+            tipo, contenido = "cita", m.group(1)
+        if tipo:
+            volcar()
+            bloques.append({"tipo": tipo, "nivel": 0, "inlines": parsear_inlines(contenido, notas_orden)})
+            continue
+        parrafo.append(linea.strip())
+    volcar()
+
+    notas = [(numero, parsear_inlines(notas_def.get(etiqueta, ""), {}))
+             for etiqueta, numero in sorted(notas_orden.items(), key=lambda x: x[1])]
+    return bloques, notas
+
+def construir_documento(titulo_tesis, contenido_redactado, bibliografia=""):
+    capitulos = []
+    for n in sorted(contenido_redactado.keys(), key=lambda x: int(x)):
+        bloques, notas = parsear_markdown(contenido_redactado[n])
+        capitulos.append({"nro": str(n), "titulo": f"Capítulo {n}", "bloques": bloques, "notas": notas})
+    bloques_bib, _ = parsear_markdown(bibliografia) if bibliografia else ([], [])
+    return {"titulo": titulo_tesis, "capitulos": capitulos, "bibliografia": bloques_bib}
@@ -0,0 +1,339 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from modules.normalizacion import normalizar
+from modules.tracing import span
+
+# --- ESTADÍSTICAS DE CORPUS Y COLOCACIONES ---
+# Cada obra se codifica una vez como un array de enteros (índices de vocabulario de caracteres
+# normalizados) y todo el conteo se hace con operaciones vectorizadas de NumPy sobre ese array.
+# Los arrays y las tablas de frecuencia de n-gramas se guardan en disco por hash del contenido,
+# así que una obra ya vista no se vuelve a codificar aunque se reinicie la app.
+
+DIRECTORIO_CACHE = os.environ.get("ESTADISTICAS_CACHE",
+                                  os.path.join(os.path.expanduser("~"), ".cache", "probatio", "estadisticas"))
+# Tamaño máximo de la caché en disco: al escribir se borran los .npz usados hace más tiempo
+MAX_MB_CACHE = int(os.environ.get("ESTADISTICAS_CACHE_MAX_MB", "1024"))
+VERSION_CACHE = 1
+MAX_OBRAS_EN_MEMORIA = 8
+MAX_N_GRAMA = 3
+
+MEDIDAS = {"ll": "Log-likelihood (G²)", "mi": "Información mutua (MI)", "frecuencia": "Frecuencia conjunta"}
+
+_obras = OrderedDict()
+_lock = threading.Lock()
+
+
+def hash_obra(fragmentos):
+    h = hashlib.sha256(f"v{VERSION_CACHE}".encode("utf-8"))
+    for f in fragmentos:
+        h.update(f.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()[:32]
+
+def _ruta(clave, sufijo=""):
+    return os.path.join(DIRECTORIO_CACHE, f"{clave}{sufijo}.npz")
+
+def _guardar(ruta, **arrays):
+    """Escritura atómica: un proceso concurrente nunca lee un .npz a medias. Sin comprimir a propósito:
+    zlib sobre millones de enteros cuesta más que volver a codificar la obra."""
+    try:
+        os.makedirs(DIRECTORIO_CACHE, exist_ok=True)
+        temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporal, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(temporal, ruta)
+    except OSError:
+        # Sin disco escribible la caché solo vive en memoria
+        return
+    _podar_disco()
+
+def _leer(ruta):
+    try:
+        with np.load(ruta) as datos:
+            arrays = {k: datos[k] for k in datos.files}
+    except (OSError, ValueError):
+        return None
+    try:
+        # La fecha de modificación hace de "último uso" para _podar_disco
+        os.utime(ruta)
+    except OSError:
+        pass
+    return arrays
+
+def _podar_disco():
+    """Borra los .npz menos usados hasta que el directorio cabe en MAX_MB_CACHE."""
+    try:
+        ficheros = []
+        for entrada in os.scandir(DIRECTORIO_CACHE):
+            if entrada.name.endswith(".npz") and entrada.is_file():
+                info = entrada.stat()
+                ficheros.append((info.st_mtime, info.st_size, entrada.path))
+    except OSError:
+        return
+    sobrante = sum(tam for _, tam, _ in ficheros) - MAX_MB_CACHE * 1024 * 1024
+    for _, tam, ruta in sorted(ficheros):
+        if sobrante <= 0:
+            break
+        try:
+            os.remove(ruta)
+        except OSError:
+            # Otro proceso lo borró antes
+            pass
+        sobrante -= tam
+
+
+class TablaObra:
+    """Texto de una obra como array de enteros más sus tablas de frecuencia precalculadas.
+
+    `ids` recorre todos los fragmentos concatenados con un separador (índice de vocabulario del
+    carácter \\x00), así que ningún n-grama ni ventana de colocación cruza de un fragmento a otro.
+    """
+
+    def __init__(self, clave, ids, vocab, frecuencias, inicios, longitudes):
+        self.clave = clave
+        self.ids = ids
+        self.vocab = vocab
+        self.frecuencias = frecuencias
+        self.inicios = inicios
+        self.longitudes = longitudes
+        # Solo letras/ideogramas cuentan como tokens: fuera puntuación, espacios y el separador
+        self.valido = np.array([chr(c).isalnum() for c in vocab.tolist()], dtype=bool)
+        self.total = int(frecuencias[self.valido].sum())
+        self._ngramas = {}
+
+    @classmethod
+    def codificar(cls, clave, fragmentos):
+        texto = "\x00".join(normalizar(f.lower()) for f in fragmentos)
+        codigos = np.frombuffer(texto.encode("utf-32-le"), dtype=np.uint32)
+        vocab, ids = np.unique(codigos, return_inverse=True)
+        longitudes = np.array([len(normalizar(f.lower())) for f in fragmentos], dtype=np.int64)
+        inicios = np.concatenate(([0], np.cumsum(longitudes + 1)[:-1])).astype(np.int64)
+        frecuencias = np.bincount(ids, minlength=len(vocab)).astype(np.int64)
+        # uint16 basta para el vocabulario de cualquier obra real y reduce a la mitad memoria y disco
+        tipo = np.uint16 if len(vocab) <= np.iinfo(np.uint16).max else np.int32
+        return cls(clave, ids.astype(tipo), vocab, frecuencias, inicios, longitudes)
+
+    @classmethod
+    def unir(cls, clave, obras):
+        """Una obra con los fragmentos de `obras` seguidos, sin volver a codificar ningún texto:
+        se fusionan los vocabularios y se reasignan los índices."""
+        separador = np.array([0], dtype=np.uint32)
+        vocab = np.unique(np.concatenate([separador] + [o.vocab for o in obras]))
+        id_separador = np.searchsorted(vocab, separador)
+        trozos, inicios, desplazamiento = [], [], 0
+        for i, obra in enumerate(obras):
+            if i:
+                trozos.append(id_separador)
+            trozos.append(np.searchsorted(vocab, obra.vocab)[obra.ids])
+            inicios.append(obra.inicios + desplazamiento)
+            desplazamiento += len(obra.ids) + 1
+        ids = np.concatenate(trozos)
+        frecuencias = np.bincount(ids, minlength=len(vocab)).astype(np.int64)
+        tipo = np.uint16 if len(vocab) <= np.iinfo(np.uint16).max else np.int32
+        return cls(clave, ids.astype(tipo), vocab, frecuencias, np.concatenate(inicios),
+                   np.concatenate([o.longitudes for o in obras]))
+
+    def _guardar(self):
+        _guardar(_ruta(self.clave), ids=self.ids, vocab=self.vocab, frecuencias=self.frecuencias,
+                 inicios=self.inicios, longitudes=self.longitudes)
+
+    # --- CODIFICACIÓN DE TÉRMINOS Y N-GRAMAS ---
+
+    def codificar_termino(self, termino):
+        """Índices de vocabulario del término, o None si contiene caracteres que la obra no usa."""
+        codigos = np.frombuffer(normalizar(termino.lower()).encode("utf-32-le"), dtype=np.uint32)
+        if not len(codigos):
+            return None
+        posiciones = np.searchsorted(self.vocab, codigos)
+        posiciones = np.minimum(posiciones, len(self.vocab) - 1)
+        if not np.array_equal(self.vocab[posiciones], codigos):
+            return None
+        return posiciones.astype(np.int32)
+
+    def ngramas(self, n):
+        """(ids de n-grama por posición, máscara de n-gramas válidos, claves únicas, frecuencias).
+
+        El id de un n-grama es su secuencia de índices en base len(vocab). Las claves y
+        frecuencias se cachean en disco; el array por posición se recalcula (es una pasada O(N)).
+        """
+        if n in self._ngramas:
+            return self._ngramas[n]
+        if not 1 <= n <= MAX_N_GRAMA:
+            raise ValueError(f"n debe estar entre 1 y {MAX_N_GRAMA}")
+        v = len(self.vocab)
+        largo = max(0, len(self.ids) - n + 1)
+        ids = self.ids.astype(np.int64)
+        gramas = ids[:largo].copy()
+        validos = self.valido[self.ids[:largo]]
+        for j in range(1, n):
+            gramas = gramas * v + ids[j:largo + j]
+            validos &= self.valido[self.ids[j:largo + j]]
+
+        ruta = _ruta(self.clave, f"_n{n}")
+        cache = _leer(ruta)
+        if cache is not None:
+            claves, cuentas = cache["claves"], cache["cuentas"]
+        else:
+            claves, cuentas = np.unique(gramas[validos], return_counts=True)
+            _guardar(ruta, claves=claves, cuentas=cuentas)
+        self._ngramas[n] = (gramas, validos, claves, cuentas)
+        return self._ngramas[n]
+
+    def decodificar(self, claves, n):
+        v = len(self.vocab)
+        claves = np.asarray(claves, dtype=np.int64).copy()
+        columnas = []
+        for _ in range(n):
+            columnas.append(self.vocab[claves % v])
+            claves //= v
+        return ["".join(chr(c) for c in fila) for fila in np.stack(columnas[::-1], axis=1).tolist()]
+
+    # --- FRECUENCIA Y DISPERSIÓN ---
+
+    def posiciones(self, termino):
+        codigo = self.codificar_termino(termino)
+        if codigo is None:
+            return np.empty(0, dtype=np.int64)
+        k = len(codigo)
+        largo = len(self.ids) - k + 1
+        if largo <= 0:
+            return np.empty(0, dtype=np.int64)
+        mascara = self.ids[:largo] == codigo[0]
+        for j in range(1, k):
+            mascara &= self.ids[j:largo + j] == codigo[j]
+        return np.flatnonzero(mascara)
+
+    def fragmento_de(self, posiciones):
+        return np.searchsorted(self.inicios, posiciones, side="right") - 1
+
+    def frecuencia(self, termino):
+        """Frecuencia absoluta, relativa (por 10.000 caracteres), rango y dispersión DP de Gries.
+
+        DP = 0,5 · Σ |v_i − s_i|, con v_i la fracción de apariciones en el fragmento i y s_i
+        la fracción del corpus que ocupa ese fragmento: 0 = repartido uniformemente, ~1 = concentrado.
+        """
+        posiciones = self.posiciones(termino)
+        f = len(posiciones)
+        resultado = {"frecuencia": f, "por_10k": round(f * 10_000 / self.total, 2) if self.total else 0.0,
+                     "fragmentos": len(self.longitudes), "rango": 0, "dp": None}
+        if f and len(self.longitudes):
+            por_fragmento = np.bincount(self.fragmento_de(posiciones), minlength=len(self.longitudes))
+            tamanos = self.longitudes / max(1, self.longitudes.sum())
+            resultado["rango"] = int(np.count_nonzero(por_fragmento))
+            resultado["dp"] = round(float(0.5 * np.abs(por_fragmento / f - tamanos).sum()), 4)
+        return resultado
+
+    # --- COLOCACIONES ---
+
+    def colocaciones(self, termino, ventana=5, n=1, min_frecuencia=3, medida="ll", limite=30):
+        """Colocados de `termino` (n-gramas de caracteres a ±`ventana` caracteres, sin solaparse con él)."""
+        posiciones = self.posiciones(termino)
+        if not len(posiciones):
+            return []
+        k = len(self.codificar_termino(termino))
+        gramas, validos, claves, cuentas = self.ngramas(n)
+
+        desplazamientos = np.concatenate((np.arange(-ventana, -n + 1), np.arange(k, k + ventana - n + 1)))
+        if not len(desplazamientos):
+            return []
+        indices = posiciones[:, None] + desplazamientos[None, :]
+        dentro = (indices >= 0) & (indices < len(gramas))
+        indices_seguros = np.where(dentro, indices, 0)
+        mismo_fragmento = self.fragmento_de(indices_seguros) == self.fragmento_de(posiciones)[:, None]
+        indices = indices_seguros[dentro & mismo_fragmento & validos[indices_seguros]]
+        if not len(indices):
+            return []
+
+        colocados, o11 = np.unique(gramas[indices], return_counts=True)
+        filtro = o11 >= min_frecuencia
+        colocados, o11 = colocados[filtro], o11[filtro].astype(np.float64)
+        if not len(colocados):
+            return []
+
+        # Tabla de contingencia 2x2 por colocado (vectorizada sobre todos a la vez)
+        total = float(validos.sum())
+        r1 = float(len(posiciones) * len(desplazamientos))
+        c1 = cuentas[np.searchsorted(claves, colocados)].astype(np.float64)
+        observadas = np.stack([o11, r1 - o11, c1 - o11, total - r1 - c1 + o11]).clip(min=0)
+        esperadas = np.stack([r1 * c1, r1 * (total - c1), (total - r1) * c1, (total - r1) * (total - c1)]) / total
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mi = np.log2(o11 / esperadas[0])
+            terminos = np.where(observadas > 0, observadas * np.log(observadas / esperadas), 0.0)
+        # G² con signo: negativo si el colocado aparece menos de lo esperado (repulsión)
+        ll = 2 * np.nan_to_num(terminos).sum(axis=0) * np.sign(o11 - esperadas[0])
+
+        orden_por = {"ll": ll, "mi": mi, "frecuencia": o11}[medida]
+        orden = np.argsort(-orden_por, kind="stable")[:limite]
+        textos = self.decodificar(colocados[orden], n)
+        return [{"colocado": t, "frecuencia_conjunta": int(o11[i]), "frecuencia_colocado": int(c1[i]),
+                 "mi": round(float(mi[i]), 3), "ll": round(float(ll[i]), 2)}
+                for t, i in zip(textos, orden.tolist())]
+
+
+# --- CARGA CON CACHÉ (MEMORIA + DISCO) ---
+
+def _en_memoria(obra):
+    with _lock:
+        _obras[obra.clave] = obra
+        while len(_obras) > MAX_OBRAS_EN_MEMORIA:
+            _obras.popitem(last=False)
+    return obra
+
+def obra_cacheada(clave):
+    """TablaObra de `clave` (ver TablaObra.clave) desde memoria o disco, o None si ya no está.
+    Permite guardar solo la clave entre peticiones en lugar de los textos de la obra."""
+    with _lock:
+        if clave in _obras:
+            _obras.move_to_end(clave)
+            return _obras[clave]
+    datos = _leer(_ruta(clave))
+    return _en_memoria(TablaObra(clave, **datos)) if datos is not None else None
+
+def cargar_obra(nombre, fragmentos):
+    """Devuelve la TablaObra de unos fragmentos, codificándola solo si no está cacheada."""
+    clave = hash_obra(fragmentos)
+    with _lock:
+        if clave in _obras:
+            _obras.move_to_end(clave)
+            return _obras[clave]
+
+    with span(f"stats.{nombre}", "stats", fragmentos=len(fragmentos)) as s:
+        datos = _leer(_ruta(clave))
+        if datos is not None:
+            obra = TablaObra(clave, **datos)
+            s.anotar(cache="disco")
+        else:
+            obra = TablaObra.codificar(clave, fragmentos)
+            obra._guardar()
+            s.anotar(cache="no")
+    return _en_memoria(obra)
+
+def unir_obras(obras_por_nombre):
+    """TablaObra de la unión de `obras_por_nombre` ({nombre: TablaObra}, en orden de nombre),
+    cacheada como una obra más bajo una clave derivada de las de sus partes."""
+    nombres = sorted(obras_por_nombre)
+    if len(nombres) == 1:
+        return obras_por_nombre[nombres[0]]
+    clave = hash_obra(["+"] + [obras_por_nombre[n].clave for n in nombres])
+    obra = obra_cacheada(clave)
+    if obra is None:
+        with span(f"stats.{'+'.join(nombres)}", "stats", obras=len(nombres)):
+            obra = TablaObra.unir(clave, [obras_por_nombre[n] for n in nombres])
+            obra._guardar()
+        _en_memoria(obra)
+    return obra
+
+def frecuencias_de_obras(obras_por_nombre, termino):
+    """Frecuencia y dispersión de `termino` en cada obra. `obras_por_nombre`: {nombre: TablaObra}."""
+    return [{"obra": nombre, **obra.frecuencia(termino)} for nombre, obra in obras_por_nombre.items()]
+
+def colocaciones_de_obras(obras_por_nombre, termino, **opciones):
+    """Colocaciones sobre la unión de las obras seleccionadas."""
+    if not obras_por_nombre:
+        return []
+    return unir_obras(obras_por_nombre).colocaciones(termino, **opciones)
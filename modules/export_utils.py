@@ -1,30 +1,360 @@
-import io
-from docx import Document
-from docx.shared import Pt
-from docx.enum.text import WD_ALIGN_PARAGRAPH
+import hashlib
+import html
+import json
+import tempfile
+import threading
+import uuid
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from modules.documento import construir_documento
+from modules.tracing import span
+
+# Por encima de este tamaño la exportación se vuelca a disco en lugar de quedarse en memoria
+UMBRAL_SPOOL_BYTES = 8 * 1024 * 1024
+MAX_EXPORTACIONES_CACHEADAS = 12
+
+_cache_exportaciones = OrderedDict()  # {(formato, hash_contenido): SpooledTemporaryFile}
+_cache_lock = threading.Lock()
+
+# --- REGISTRO DE EXPORTADORES ---
+# Cada exportador recibe el árbol intermedio (modules/documento.py) y un fichero binario de salida.
+EXPORTADORES = {}
+
+def registrar_exportador(formato, etiqueta, extension, mime):
+    def decorador(funcion):
+        EXPORTADORES[formato] = {"etiqueta": etiqueta, "extension": extension, "mime": mime, "render": funcion}
+        return funcion
+    return decorador
+
+def _agrupar_listas(bloques):
+    """Agrupa viñetas y numeradas consecutivas para los formatos que necesitan un contenedor de lista."""
+    grupo = []
+    for b in bloques:
+        if grupo and b["tipo"] != grupo[0]["tipo"]:
+            yield grupo[0]["tipo"], grupo
+            grupo = []
+        if b["tipo"] in ("vineta", "numerada"):
+            grupo.append(b)
+        else:
+            yield b["tipo"], [b]
+    if grupo:
+        yield grupo[0]["tipo"], grupo
+
+# --- WORD (.docx) ---
+
+def _docx_runs(parrafo, inlines):
+    for estilo, texto in inlines:
+        run = parrafo.add_run(texto)
+        if estilo == "negrita": run.bold = True
+        elif estilo == "cursiva": run.italic = True
+        elif estilo == "nota": run.font.superscript = True
+
+def _docx_bloques(doc, bloques, alineacion):
+    estilos = {"vineta": "List Bullet", "numerada": "List Number", "cita": "Quote"}
+    for b in bloques:
+        if b["tipo"] == "titulo":
+            _docx_runs(doc.add_heading("", level=min(1 + b["nivel"], 9)), b["inlines"])
+        elif b["tipo"] in estilos:
+            _docx_runs(doc.add_paragraph(style=estilos[b["tipo"]]), b["inlines"])
+        else:
+            parrafo = doc.add_paragraph()
+            parrafo.alignment = alineacion
+            _docx_runs(parrafo, b["inlines"])
+
+@registrar_exportador("docx", "Word (.docx)", "docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+def exportar_docx(documento, salida):
+    # python-docx (y lxml) solo se cargan cuando alguien exporta a Word
+    from docx import Document
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    from docx.shared import Pt
 
-def generar_documento_word(titulo_tesis, contenido_redactado, bibliografia=""):
     doc = Document()
-    
+
     # Título principal
-    titulo = doc.add_heading(titulo_tesis, 0)
+    titulo = doc.add_heading(documento["titulo"], 0)
     titulo.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    
+
     # Añadir los capítulos ordenados
-    for n in sorted(contenido_redactado.keys(), key=lambda x: int(x)):
-        doc.add_heading(f"Capítulo {n}", level=1)
-        parrafo = doc.add_paragraph(contenido_redactado[n])
-        parrafo.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
-        
+    for cap in documento["capitulos"]:
+        doc.add_heading(cap["titulo"], level=1)
+        _docx_bloques(doc, cap["bloques"], WD_ALIGN_PARAGRAPH.JUSTIFY)
+        # python-docx no expone notas al pie nativas: las numeramos en el texto y las listamos al final del capítulo
+        if cap["notas"]:
+            doc.add_heading("Notas", level=2)
+            for numero, inlines in cap["notas"]:
+                parrafo = doc.add_paragraph()
+                parrafo.add_run(f"{numero}. ").bold = True
+                _docx_runs(parrafo, inlines)
+                for run in parrafo.runs:
+                    run.font.size = Pt(9)
+
     # Añadir Bibliografía si existe
-    if bibliografia:
+    if documento["bibliografia"]:
         doc.add_page_break()
         doc.add_heading("Bibliografía", level=1)
-        parrafo_bib = doc.add_paragraph(bibliografia)
-        parrafo_bib.alignment = WD_ALIGN_PARAGRAPH.LEFT
-        
-    # Guardar en memoria para descarga en Streamlit
-    buffer = io.BytesIO()
-    doc.save(buffer)
-    buffer.seek(0)
-    return buffer
+        _docx_bloques(doc, documento["bibliografia"], WD_ALIGN_PARAGRAPH.LEFT)
+
+    doc.save(salida)
+
+# --- MARKDOWN ---
+
+def _md_inlines(inlines):
+    marcas = {"negrita": "**{}**", "cursiva": "*{}*", "nota": "[^{}]", "texto": "{}"}
+    return "".join(marcas[estilo].format(texto) for estilo, texto in inlines)
+
+def _md_bloques(bloques, escribir):
+    for tipo, grupo in _agrupar_listas(bloques):
+        if tipo in ("vineta", "numerada"):
+            marca = "-" if tipo == "vineta" else "1."
+            escribir("".join(f"{marca} {_md_inlines(b['inlines'])}\n" for b in grupo) + "\n")
+            continue
+        b = grupo[0]
+        contenido = _md_inlines(b["inlines"])
+        if tipo == "titulo": escribir(f"{'#' * min(2 + b['nivel'], 6)} {contenido}\n\n")
+        elif tipo == "cita": escribir(f"> {contenido}\n\n")
+        else: escribir(f"{contenido}\n\n")
+
+@registrar_exportador("md", "Markdown (.md)", "md", "text/markdown")
+def exportar_markdown(documento, salida):
+    escribir = lambda texto: salida.write(texto.encode("utf-8"))
+    escribir(f"# {documento['titulo']}\n\n")
+    for cap in documento["capitulos"]:
+        # Las notas se renumeran por capítulo, así que las prefijamos para que no colisionen
+        escribir(f"## {cap['titulo']}\n\n")
+        bloques = [{**b, "inlines": [(e, f"{cap['nro']}-{t}" if e == "nota" else t) for e, t in b["inlines"]]} for b in cap["bloques"]]
+        _md_bloques(bloques, escribir)
+        for numero, inlines in cap["notas"]:
+            escribir(f"[^{cap['nro']}-{numero}]: {_md_inlines(inlines)}\n")
+        escribir("\n")
+    if documento["bibliografia"]:
+        escribir("## Bibliografía\n\n")
+        _md_bloques(documento["bibliografia"], escribir)
+
+# --- LaTeX ---
+_ESCAPES_LATEX = {"\\": r"\textbackslash{}", "&": r"\&", "%": r"\%", "$": r"\$", "#": r"\#", "_": r"\_",
+                  "{": r"\{", "}": r"\}", "~": r"\textasciitilde{}", "^": r"\textasciicircum{}"}
+
+def _tex(texto):
+    return "".join(_ESCAPES_LATEX.get(c, c) for c in texto)
+
+def _tex_inlines(inlines, notas):
+    partes = []
+    for estilo, texto in inlines:
+        if estilo == "negrita": partes.append(rf"\textbf{{{_tex(texto)}}}")
+        elif estilo == "cursiva": partes.append(rf"\emph{{{_tex(texto)}}}")
+        elif estilo == "nota": partes.append(rf"\footnote{{{_tex_inlines(notas.get(texto, []), {})}}}")
+        else: partes.append(_tex(texto))
+    return "".join(partes)
+
+def _tex_bloques(bloques, notas, escribir):
+    secciones = {1: "section", 2: "subsection", 3: "subsubsection"}
+    for tipo, grupo in _agrupar_listas(bloques):
+        if tipo in ("vineta", "numerada"):
+            entorno = "itemize" if tipo == "vineta" else "enumerate"
+            escribir(f"\\begin{{{entorno}}}\n")
+            for b in grupo: escribir(f"  \\item {_tex_inlines(b['inlines'], notas)}\n")
+            escribir(f"\\end{{{entorno}}}\n\n")
+            continue
+        b = grupo[0]
+        contenido = _tex_inlines(b["inlines"], notas)
+        if tipo == "titulo": escribir(f"\\{secciones.get(b['nivel'], 'paragraph')}*{{{contenido}}}\n\n")
+        elif tipo == "cita": escribir(f"\\begin{{quote}}\n{contenido}\n\\end{{quote}}\n\n")
+        else: escribir(f"{contenido}\n\n")
+
+@registrar_exportador("tex", "LaTeX (.tex)", "tex", "application/x-tex")
+def exportar_latex(documento, salida):
+    escribir = lambda texto: salida.write(texto.encode("utf-8"))
+    escribir("% Compilar con XeLaTeX (necesario para el chino clásico)\n")
+    escribir("\\documentclass[12pt,a4paper]{report}\n\\usepackage{fontspec}\n\\usepackage{xeCJK}\n\\usepackage[spanish]{babel}\n")
+    escribir(f"\\title{{{_tex(documento['titulo'])}}}\n\\date{{}}\n\\begin{{document}}\n\\maketitle\n\\tableofcontents\n\n")
+    for cap in documento["capitulos"]:
+        # En LaTeX las notas sí son nativas: las insertamos como \footnote en el punto de llamada
+        notas = {str(numero): inlines for numero, inlines in cap["notas"]}
+        escribir(f"\\chapter{{{_tex(cap['titulo'])}}}\n\n")
+        _tex_bloques(cap["bloques"], notas, escribir)
+    if documento["bibliografia"]:
+        escribir("\\chapter*{Bibliografía}\n\\addcontentsline{toc}{chapter}{Bibliografía}\n\n")
+        _tex_bloques(documento["bibliografia"], {}, escribir)
+    escribir("\\end{document}\n")
+
+# --- HTML (IMPRIMIBLE) Y EPUB ---
+
+def _html_inlines(inlines, prefijo_nota):
+    partes = []
+    for estilo, texto in inlines:
+        t = html.escape(texto)
+        if estilo == "negrita": partes.append(f"<strong>{t}</strong>")
+        elif estilo == "cursiva": partes.append(f"<em>{t}</em>")
+        elif estilo == "nota": partes.append(f'<sup><a id="ref-{prefijo_nota}-{t}" href="#nota-{prefijo_nota}-{t}">{t}</a></sup>')
+        else: partes.append(t)
+    return "".join(partes)
+
+def _html_bloques(bloques, prefijo_nota, nivel_base=2):
+    partes = []
+    for tipo, grupo in _agrupar_listas(bloques):
+        if tipo in ("vineta", "numerada"):
+            etiqueta = "ul" if tipo == "vineta" else "ol"
+            items = "".join(f"<li>{_html_inlines(b['inlines'], prefijo_nota)}</li>" for b in grupo)
+            partes.append(f"<{etiqueta}>{items}</{etiqueta}>")
+            continue
+        b = grupo[0]
+        contenido = _html_inlines(b["inlines"], prefijo_nota)
+        if tipo == "titulo":
+            h = min(nivel_base + b["nivel"], 6)
+            partes.append(f"<h{h}>{contenido}</h{h}>")
+        elif tipo == "cita": partes.append(f"<blockquote>{contenido}</blockquote>")
+        else: partes.append(f"<p>{contenido}</p>")
+    return "\n".join(partes)
+
+def _html_capitulo(cap):
+    partes = [f'<section class="capitulo" id="cap-{cap["nro"]}">', f"<h2>{html.escape(cap['titulo'])}</h2>", _html_bloques(cap["bloques"], cap["nro"])]
+    if cap["notas"]:
+        partes.append('<aside class="notas"><h3>Notas</h3><ol>')
+        for numero, inlines in cap["notas"]:
+            partes.append(f'<li id="nota-{cap["nro"]}-{numero}" value="{numero}">{_html_inlines(inlines, cap["nro"])} '
+                          f'<a href="#ref-{cap["nro"]}-{numero}">↩</a></li>')
+        partes.append("</ol></aside>")
+    partes.append("</section>")
+    return "\n".join(partes)
+
+def _html_bibliografia(documento):
+    return f'<section class="bibliografia"><h2>Bibliografía</h2>{_html_bloques(documento["bibliografia"], "bib")}</section>'
+
+CSS_IMPRESION = """
+@page { size: A4; margin: 2.5cm; @bottom-center { content: counter(page); } }
+body { font-family: 'Times New Roman', 'Noto Serif CJK SC', serif; line-height: 1.8; text-align: justify; }
+h1 { text-align: center; page-break-after: always; }
+.capitulo, .bibliografia { page-break-before: always; }
+blockquote { margin: 1em 2em; font-style: italic; }
+.notas { font-size: 0.85em; border-top: 1px solid #999; margin-top: 2em; }
+.bibliografia p { text-align: left; padding-left: 2em; text-indent: -2em; }
+"""
+
+@registrar_exportador("html", "HTML imprimible (.html)", "html", "text/html")
+def exportar_html(documento, salida):
+    escribir = lambda texto: salida.write(texto.encode("utf-8"))
+    titulo = html.escape(documento["titulo"])
+    escribir(f'<!DOCTYPE html>\n<html lang="es">\n<head>\n<meta charset="utf-8">\n<title>{titulo}</title>\n<style>{CSS_IMPRESION}</style>\n</head>\n<body>\n<h1>{titulo}</h1>\n')
+    for cap in documento["capitulos"]:
+        escribir(_html_capitulo(cap) + "\n")
+    if documento["bibliografia"]:
+        escribir(_html_bibliografia(documento) + "\n")
+    escribir("</body>\n</html>\n")
+
+def _xhtml(titulo, cuerpo):
+    return (f'<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" lang="es">\n'
+            f'<head><meta charset="utf-8"/><title>{html.escape(titulo)}</title></head>\n<body>\n{cuerpo}\n</body>\n</html>\n')
+
+@registrar_exportador("epub", "EPUB (.epub)", "epub", "application/epub+zip")
+def exportar_epub(documento, salida):
+    titulo = documento["titulo"]
+    identificador = f"urn:uuid:{uuid.uuid5(uuid.NAMESPACE_URL, titulo)}"
+    modificado = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    paginas = [(f"cap_{cap['nro']}.xhtml", cap["titulo"], _html_capitulo(cap)) for cap in documento["capitulos"]]
+    if documento["bibliografia"]:
+        paginas.append(("bibliografia.xhtml", "Bibliografía", _html_bibliografia(documento)))
+
+    with zipfile.ZipFile(salida, "w", zipfile.ZIP_DEFLATED) as epub:
+        # El 'mimetype' debe ir primero y sin comprimir
+        epub.writestr(zipfile.ZipInfo("mimetype"), "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        epub.writestr("META-INF/container.xml",
+                      '<?xml version="1.0"?>\n<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+                      '<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles></container>')
+        for nombre, titulo_pagina, cuerpo in paginas:
+            epub.writestr(f"OEBPS/{nombre}", _xhtml(titulo_pagina, cuerpo))
+
+        enlaces = "".join(f'<li><a href="{nombre}">{html.escape(t)}</a></li>' for nombre, t, _ in paginas)
+        epub.writestr("OEBPS/nav.xhtml", _xhtml(titulo, f'<nav epub:type="toc"><h1>{html.escape(titulo)}</h1><ol>{enlaces}</ol></nav>'))
+
+        manifiesto = "".join(f'<item id="p{i}" href="{nombre}" media-type="application/xhtml+xml"/>' for i, (nombre, _, _) in enumerate(paginas))
+        espina = "".join(f'<itemref idref="p{i}"/>' for i in range(len(paginas)))
+        epub.writestr("OEBPS/content.opf",
+                      f'<?xml version="1.0" encoding="utf-8"?>\n<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="uid">'
+                      f'<metadata xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:identifier id="uid">{identificador}</dc:identifier>'
+                      f'<dc:title>{html.escape(titulo)}</dc:title><dc:language>es</dc:language>'
+                      f'<meta property="dcterms:modified">{modificado}</meta></metadata>'
+                      f'<manifest><item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>{manifiesto}</manifest>'
+                      f'<spine>{espina}</spine></package>')
+
+# --- EXPORTACIÓN PEREZOSA Y CACHEADA ---
+
+def hash_exportacion(titulo_tesis, contenido_redactado, bibliografia=""):
+    """Huella del contenido exportable; si no cambia, la exportación cacheada sigue siendo válida."""
+    carga = json.dumps([titulo_tesis, contenido_redactado, bibliografia], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(carga.encode("utf-8")).hexdigest()
+
+def _leer(archivo):
+    archivo.seek(0)
+    return archivo.read()
+
+def _cachear(clave, archivo):
+    """Guarda el fichero en la caché LRU, cerrando los que salen."""
+    with _cache_lock:
+        _cache_exportaciones[clave] = archivo
+        _cache_exportaciones.move_to_end(clave)
+        while len(_cache_exportaciones) > MAX_EXPORTACIONES_CACHEADAS:
+            _, antiguo = _cache_exportaciones.popitem(last=False)
+            antiguo.close()
+
+def leer_exportacion(clave_cache):
+    """Bytes de una exportación cacheada, o None si ya salió de la caché. `clave_cache` es
+    (formato, hash_exportacion(...)) o clave_paquete(...)."""
+    with _cache_lock:
+        archivo = _cache_exportaciones.get(clave_cache)
+        if archivo is None:
+            return None
+        _cache_exportaciones.move_to_end(clave_cache)
+        return _leer(archivo)
+
+def clave_paquete(nombre_base, clave):
+    return (f"zip:{nombre_base}", clave)
+
+def _exportar_desde_arbol(formato, documento, clave):
+    datos = leer_exportacion((formato, clave))
+    if datos is not None:
+        return datos
+
+    # Volcamos a un fichero temporal que pasa a disco si supera el umbral
+    archivo = tempfile.SpooledTemporaryFile(max_size=UMBRAL_SPOOL_BYTES)
+    with span(f"export.{formato}", "export", formato=formato) as s:
+        EXPORTADORES[formato]["render"](documento, archivo)
+        s.anotar(bytes=archivo.tell())
+    datos = _leer(archivo)
+    _cachear((formato, clave), archivo)
+    return datos
+
+def exportar(formato, titulo_tesis, contenido_redactado, bibliografia=""):
+    """Devuelve los bytes de la exportación en `formato`, reutilizando la caché si el contenido no cambió."""
+    clave = hash_exportacion(titulo_tesis, contenido_redactado, bibliografia)
+    datos = leer_exportacion((formato, clave))
+    if datos is not None:
+        return datos
+    with span("export.parseo", "export", capitulos=len(contenido_redactado)):
+        documento = construir_documento(titulo_tesis, contenido_redactado, bibliografia)
+    return _exportar_desde_arbol(formato, documento, clave)
+
+def exportar_todos(titulo_tesis, contenido_redactado, bibliografia="", formatos=None):
+    """Parsea el borrador una vez y renderiza todos los formatos en paralelo. Devuelve {formato: bytes}."""
+    formatos = formatos or list(EXPORTADORES)
+    clave = hash_exportacion(titulo_tesis, contenido_redactado, bibliografia)
+    with span("export.parseo", "export", capitulos=len(contenido_redactado)):
+        documento = construir_documento(titulo_tesis, contenido_redactado, bibliografia)
+    with ThreadPoolExecutor(max_workers=len(formatos)) as pool:
+        futuros = {f: pool.submit(_exportar_desde_arbol, f, documento, clave) for f in formatos}
+        return {f: futuro.result() for f, futuro in futuros.items()}
+
+def empaquetar_exportaciones(nombre_base, clave, archivos):
+    """Publica una versión: los formatos ya exportados (`archivos`, {formato: bytes} de exportar_todos)
+    en un único .zip, cacheado bajo clave_paquete(nombre_base, clave) sin volver a parsear el borrador."""
+    salida = tempfile.SpooledTemporaryFile(max_size=UMBRAL_SPOOL_BYTES)
+    with zipfile.ZipFile(salida, "w", zipfile.ZIP_DEFLATED) as paquete:
+        for formato, datos in archivos.items():
+            paquete.writestr(f"{nombre_base}.{EXPORTADORES[formato]['extension']}", datos)
+    _cachear(clave_paquete(nombre_base, clave), salida)
+
+def generar_documento_word(titulo_tesis, contenido_redactado, bibliografia=""):
+    return exportar("docx", titulo_tesis, contenido_redactado, bibliografia)
@@ -0,0 +1,301 @@
+"""Lenguaje de consulta del buscador de concordancias.
+
+Sintaxis (los operadores van en mayúsculas):
+    情                      literal (subcadena, insensible a variantes y mayúsculas)
+    "sheng ren"             frase literal, admite espacios y palabras reservadas
+    /仁.{0,3}義/            expresión regular
+    仁 AND 義   ·   仁 義   conjunción (AND es implícito)
+    仁 OR 義                disyunción
+    情 NOT 性               negación (equivale a 情 AND NOT 性)
+    仁 NEAR/5 義            a cinco caracteres o menos, en cualquier orden (NEAR sin número = NEAR/10)
+    (仁 OR 義) NEAR/3 禮    paréntesis para agrupar
+
+`compilar_consulta()` devuelve una `Consulta` con el árbol ya compilado y la lista de literales
+que toda coincidencia debe contener, que la capa de datos empuja a la base de datos.
+"""
+import re
+
+from modules.normalizacion import normalizar
+
+DISTANCIA_NEAR_POR_DEFECTO = 10
+
+_PATRON_TOKEN = re.compile(r'''
+    \s*(?:
+        (?P<abre>\() | (?P<cierra>\)) |
+        "(?P<frase>[^"]*)" |
+        /(?P<regex>(?:\\.|[^/\\])+)/ |
+        (?P<near>NEAR(?:/(?P<distancia>\d+))?)(?=[\s()"]|$) |
+        (?P<op>AND|OR|NOT)(?=[\s()"]|$) |
+        (?P<termino>[^\s()"]+)
+    )''', re.VERBOSE)
+
+
+class ConsultaInvalidaError(ValueError):
+    """La consulta no respeta la sintaxis del buscador."""
+
+
+# --- ÁRBOL ---
+# Todos los nodos trabajan sobre el texto ya normalizado (el plegado es 1:1, las posiciones
+# coinciden con las del texto original).
+
+class _Patron:
+    def __init__(self, regex, literal=None):
+        self.regex = regex
+        self.literal = literal
+
+    def evaluar(self, texto):
+        return self.regex.search(texto) is not None
+
+    def tramos(self, texto):
+        return [m.span() for m in self.regex.finditer(texto) if m.end() > m.start()]
+
+    def hojas(self):
+        return [self]
+
+    def literales(self):
+        return [self.literal] if self.literal else []
+
+
+class _Y:
+    def __init__(self, hijos):
+        self.hijos = hijos
+
+    def evaluar(self, texto):
+        return all(h.evaluar(texto) for h in self.hijos)
+
+    def tramos(self, texto):
+        if not self.evaluar(texto):
+            return []
+        return sorted(t for h in self.hijos for t in h.tramos(texto))
+
+    def hojas(self):
+        return [hoja for h in self.hijos for hoja in h.hojas()]
+
+    def literales(self):
+        return [l for h in self.hijos for l in h.literales()]
+
+
+class _O:
+    def __init__(self, hijos):
+        self.hijos = hijos
+
+    def evaluar(self, texto):
+        return any(h.evaluar(texto) for h in self.hijos)
+
+    def tramos(self, texto):
+        return sorted(t for h in self.hijos for t in h.tramos(texto))
+
+    def hojas(self):
+        return [hoja for h in self.hijos for hoja in h.hojas()]
+
+    def literales(self):
+        # Ningún literal es obligatorio en una disyunción
+        return []
+
+
+class _No:
+    def __init__(self, hijo):
+        self.hijo = hijo
+
+    def evaluar(self, texto):
+        return not self.hijo.evaluar(texto)
+
+    def tramos(self, texto):
+        return []
+
+    def hojas(self):
+        return []
+
+    def literales(self):
+        return []
+
+
+class _Cerca:
+    def __init__(self, izquierda, derecha, distancia):
+        self.izquierda = izquierda
+        self.derecha = derecha
+        self.distancia = distancia
+
+    def _pares(self, texto):
+        derechos = self.derecha.tramos(texto)
+        if not derechos:
+            return []
+        pares = []
+        for a_ini, a_fin in self.izquierda.tramos(texto):
+            for b_ini, b_fin in derechos:
+                if max(a_ini, b_ini) - min(a_fin, b_fin) <= self.distancia:
+                    pares.append((min(a_ini, b_ini), max(a_fin, b_fin)))
+        return pares
+
+    def evaluar(self, texto):
+        return bool(self._pares(texto))
+
+    def tramos(self, texto):
+        return sorted(self._pares(texto))
+
+    def hojas(self):
+        return self.izquierda.hojas() + self.derecha.hojas()
+
+    def literales(self):
+        return self.izquierda.literales() + self.derecha.literales()
+
+
+# --- ANÁLISIS SINTÁCTICO ---
+
+def _tokenizar(texto):
+    tokens, pos = [], 0
+    texto = texto.strip()
+    while pos < len(texto):
+        m = _PATRON_TOKEN.match(texto, pos)
+        if not m or m.end() == pos:
+            raise ConsultaInvalidaError(f"Carácter inesperado en la posición {pos}: {texto[pos]!r}")
+        tipo = m.lastgroup if m.lastgroup != "distancia" else "near"
+        tokens.append((tipo, m.group(tipo), m.group("distancia")))
+        pos = m.end()
+    return tokens
+
+def _literal(texto):
+    normalizado = normalizar(texto)
+    return _Patron(re.compile(re.escape(normalizado), re.IGNORECASE), normalizado)
+
+
+class _Parser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def _ver(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None, None)
+
+    def _avanzar(self):
+        token = self._ver()
+        self.pos += 1
+        return token
+
+    def parsear(self):
+        if not self.tokens:
+            raise ConsultaInvalidaError("La consulta está vacía.")
+        arbol = self._disyuncion()
+        if self.pos < len(self.tokens):
+            raise ConsultaInvalidaError(f"Sobra '{self._ver()[1]}' al final de la consulta.")
+        return arbol
+
+    def _disyuncion(self):
+        hijos = [self._conjuncion()]
+        while self._ver()[:2] == ("op", "OR"):
+            self._avanzar()
+            hijos.append(self._conjuncion())
+        return hijos[0] if len(hijos) == 1 else _O(hijos)
+
+    def _conjuncion(self):
+        hijos = [self._negacion()]
+        while True:
+            tipo, valor, _ = self._ver()
+            if tipo is None or tipo == "cierra" or (tipo, valor) == ("op", "OR"):
+                break
+            if (tipo, valor) == ("op", "AND"):
+                self._avanzar()
+            hijos.append(self._negacion())
+        return hijos[0] if len(hijos) == 1 else _Y(hijos)
+
+    def _negacion(self):
+        if self._ver()[:2] == ("op", "NOT"):
+            self._avanzar()
+            return _No(self._negacion())
+        return self._proximidad()
+
+    def _proximidad(self):
+        izquierda = self._primario()
+        while self._ver()[0] == "near":
+            _, _, distancia = self._avanzar()
+            derecha = self._primario()
+            if isinstance(izquierda, _No) or isinstance(derecha, _No):
+                raise ConsultaInvalidaError("NEAR no admite operandos negados.")
+            izquierda = _Cerca(izquierda, derecha, int(distancia) if distancia else DISTANCIA_NEAR_POR_DEFECTO)
+        return izquierda
+
+    def _primario(self):
+        tipo, valor, _ = self._avanzar()
+        if tipo == "abre":
+            nodo = self._disyuncion()
+            if self._avanzar()[0] != "cierra":
+                raise ConsultaInvalidaError("Falta un paréntesis de cierre.")
+            return nodo
+        if tipo == "frase":
+            if not valor.strip():
+                raise ConsultaInvalidaError("Frase vacía.")
+            return _literal(valor)
+        if tipo == "termino":
+            return _literal(valor)
+        if tipo == "regex":
+            try:
+                return _Patron(re.compile(normalizar(valor), re.IGNORECASE))
+            except re.error as e:
+                raise ConsultaInvalidaError(f"Expresión regular inválida /{valor}/: {e}") from e
+        if tipo is None:
+            raise ConsultaInvalidaError("La consulta termina de forma inesperada.")
+        raise ConsultaInvalidaError(f"Se esperaba un término y se encontró '{valor}'.")
+
+
+# --- CONSULTA COMPILADA ---
+
+class Consulta:
+    def __init__(self, texto):
+        self.texto = texto
+        self.arbol = _Parser(_tokenizar(texto)).parsear()
+        # Literales obligatorios, del más selectivo (más largo) al menos
+        self.literales = sorted(set(self.arbol.literales()), key=len, reverse=True)
+
+    @property
+    def es_literal(self):
+        """True si la consulta es un único literal: el filtro de la base de datos ya es exacto."""
+        return isinstance(self.arbol, _Patron) and self.arbol.literal is not None
+
+    def coincide(self, texto):
+        return self.arbol.evaluar(normalizar(texto or ""))
+
+    def primera_posicion(self, texto):
+        """Inicio de la primera coincidencia en el texto original, o -1."""
+        tramos = self.arbol.tramos(normalizar(texto or ""))
+        return tramos[0][0] if tramos else -1
+
+    @property
+    def tiene_terminos_positivos(self):
+        """False si la consulta solo niega (p. ej. `NOT 仁`): no hay nada que localizar en el texto."""
+        return bool(self.arbol.hojas())
+
+    def coincidencias(self, texto):
+        """Tramos (inicio, fin) de cada aparición de un término positivo dentro de las zonas que
+        cumplen la consulta, sin solapes: `仁 NEAR/3 義` da un tramo por cada 仁 y cada 義 cercanos,
+        no la ventana que los une."""
+        normalizado = normalizar(texto or "")
+        zonas = self.arbol.tramos(normalizado)
+        if not zonas:
+            return []
+        # Ante apariciones solapadas (`仁 OR 仁義`) gana la que empieza antes y, a igualdad, la más larga
+        apariciones = sorted({t for hoja in self.arbol.hojas() for t in hoja.tramos(normalizado)},
+                             key=lambda t: (t[0], -t[1]))
+        resultado, fin_previo = [], 0
+        for ini, fin in apariciones:
+            if ini < fin_previo or not any(z_ini <= ini and fin <= z_fin for z_ini, z_fin in zonas):
+                continue
+            resultado.append((ini, fin))
+            fin_previo = fin
+        return resultado
+
+    def resaltar(self, texto, apertura, cierre):
+        """Envuelve cada aparición de los términos positivos de la consulta con `apertura`/`cierre`."""
+        normalizado = normalizar(texto)
+        tramos = sorted(t for hoja in self.arbol.hojas() for t in hoja.tramos(normalizado))
+        partes, fin_previo = [], 0
+        for ini, fin in tramos:
+            ini = max(ini, fin_previo)
+            if fin <= ini:
+                continue
+            partes.append(texto[fin_previo:ini] + apertura + texto[ini:fin] + cierre)
+            fin_previo = fin
+        partes.append(texto[fin_previo:])
+        return "".join(partes)
+
+def compilar_consulta(texto):
+    return Consulta(texto)
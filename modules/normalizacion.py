@@ -0,0 +1,125 @@
+"""Plegado de variantes CJK (tradicional/simplificado y formas variantes) para las búsquedas.
+
+La tabla es 1 carácter -> 1 carácter, así que el texto normalizado conserva las posiciones
+del original (los snippets y el resaltado siguen funcionando sobre el texto real).
+
+La misma tabla genera la columna sombra en Postgres, con `translate()`:
+    python -m modules.normalizacion Xunzi Texto
+imprime el `ALTER TABLE ... GENERATED ALWAYS AS (translate(...)) STORED` que hay que ejecutar
+una vez en Supabase. Con la columna `<col>_norm` presente, la búsqueda no tiene coste extra.
+"""
+import itertools
+import re
+import sys
+
+# Pares (variante, forma canónica). La forma canónica es la simplificada.
+_PARES_TRADICIONAL_SIMPLIFICADO = (
+    "說说為为國国學学禮礼義义樂乐聖圣賢贤陳陈東东長长無无與与萬万這这個个們们來来時时問问見见聞闻間间"
+    "開开關关門门書书將将傳传從从眾众處处專专業业當当會会對对導导歲岁歸归復复後后發发變变讓让論论"
+    "語语識识詩诗請请謂谓謀谋議议誠诚讀读誰谁諸诸調调諫谏訓训記记許许計计設设詞词試试話话該该詳详"
+    "誤误談谈謝谢證证譽誉讒谗貴贵賤贱財财貨货貧贫資资賞赏賜赐賦赋質质費费買买賣卖車车軍军輕轻載载"
+    "輔辅農农邊边達达遠远運运過过選选還还邇迩鄭郑鄰邻醫医釋释錢钱鐵铁陰阴陽阳隊队階阶際际難难雖虽"
+    "雙双雞鸡電电靈灵頭头顏颜願愿風风飛飞飲饮養养餘余馬马驗验體体魚鱼鳥鸟鳴鸣麥麦黃黄齊齐齒齿龍龙"
+    "龜龟亂乱偽伪備备傷伤億亿優优兒儿內内兩两則则創创劍剑劉刘勞劳勝胜勢势勸劝區区協协厭厌參参號号"
+    "嘆叹嚴严圍围園园圖图團团執执堅坚報报場场壞坏壽寿夢梦奪夺奮奋婦妇孫孙實实寧宁審审寫写寶宝屬属"
+    "島岛師师帶带幣币幾几廣广廟庙張张強强彈弹徑径憂忧態态應应戰战戲戏擇择擊击數数斷断於于晉晋條条"
+    "棄弃楊杨標标權权機机歡欢歷历殺杀氣气決决沒没淚泪淺浅漢汉滅灭營营爭争爾尔牽牵狀状獨独獲获獻献"
+    "現现產产畫画異异療疗盡尽監监盤盘確确禍祸禦御離离種种穩稳窮穷競竞筆笔節节範范築筑簡简糧粮紀纪"
+    "約约紅红純纯紙纸級级細细終终組组結结絕绝給给統统絲丝經经綱纲網网緣缘練练縣县總总績绩織织繼继"
+    "續续罰罚羅罗聯联聲声聽听肅肃脅胁腦脑臨临興兴舉举舊旧莊庄華华葉叶蓋盖蘇苏蟲虫術术衛卫衝冲補补"
+    "裝装製制複复覺觉親亲觀观訂订認认評评詐诈誘诱誨诲課课講讲謹谨護护豈岂豐丰貞贞負负貢贡貪贪責责"
+    "販贩貫贯貳贰賊贼賓宾趙赵趨趋跡迹踐践軌轨較较輪轮辭辞辯辩遲迟遷迁適适遺遗鄉乡醜丑針针鈍钝銀银"
+    "銘铭鋒锋錯错鍾钟鐘钟閒闲閔闵闕阙陸陆隨随險险隱隐雜杂雲云靜静韓韩頁页順顺須须頌颂領领題题類类"
+    "顧顾顯显飢饥飯饭館馆驕骄驚惊鬥斗魯鲁鮮鲜鳳凤麗丽黨党點点齋斋龐庞獸兽憲宪懼惧懷怀戀恋攝摄擾扰"
+    "敗败敵敌斬斩晝昼暫暂曆历曉晓槍枪樓楼橋桥檢检歐欧殘残殼壳毀毁湯汤溝沟滿满漸渐潔洁濟济濁浊災灾"
+    "燈灯燒烧犧牺猶犹獄狱環环瓊琼甕瓮畢毕畝亩疊叠癢痒盜盗矯矫碼码祿禄禪禅稱称稅税穀谷積积竊窃筍笋"
+    "篤笃糾纠紛纷納纳紐纽紡纺絹绢綠绿維维緒绪編编緩缓縱纵繩绳繪绘罷罢羨羡習习翹翘聰聪職职膽胆臉脸"
+    "艦舰藝艺藥药蝦虾蠶蚕襲袭規规視视覽览觸触訊讯託托訪访詠咏詢询誇夸誕诞誼谊諒谅諧谐謊谎謠谣譯译"
+    "譴谴豬猪賀贺賴赖贈赠贊赞趕赶躍跃輝辉輩辈轉转辦办遊游違违遙遥鄧邓醬酱釀酿鈴铃鉛铅鋼钢錄录鍛锻"
+    "鎮镇鏡镜鑄铸鑒鉴閃闪閉闭閣阁闊阔隻只雛雏霧雾響响頂顶頃顷項项預预頓顿頗颇頻频額额顛颠飄飘飽饱"
+    "飾饰騎骑騙骗驅驱驛驿髮发鬆松鬧闹鴻鸿鵝鹅鶴鹤鷹鹰鹽盐麼么齡龄龔龚嶽岳嶺岭巖岩崗岗幫帮廢废廳厅"
+    "彌弥徵征恆恒惡恶惱恼愛爱慚惭慘惨慣惯慮虑慶庆憐怜憤愤懇恳懲惩懶懒戶户撫抚擁拥擔担據据擬拟擴扩"
+    "攜携敘叙斂敛暈晕曬晒樸朴樹树橫横櫃柜歎叹毆殴氈毡沖冲況况淒凄渾浑溫温滄沧滯滞漁渔潛潜澤泽濃浓"
+    "濤涛灑洒灣湾煙烟煩烦熱热燦灿燭烛爐炉牆墙狹狭獵猎瑣琐璽玺瘋疯癡痴盧卢礎础禱祷稟禀窩窝竄窜篩筛"
+    "簽签籃篮籌筹紋纹紳绅絆绊綁绑綢绸綿绵緊紧線线締缔縛缚縫缝繞绕羈羁聳耸脈脉腎肾膚肤臟脏艱艰芻刍"
+    "荊荆莖茎葦苇蒼苍蓮莲薦荐薩萨藍蓝蘭兰虛虚蛻蜕蝕蚀螢萤蟬蝉蠟蜡裏里裡里褲裤襪袜覓觅訴诉詛诅詭诡"
+    "誅诛誣诬諛谀諭谕諱讳謁谒謙谦謬谬譏讥譜谱讚赞豎竖貓猫賄贿賬账購购贏赢蹤踪軟软軸轴輯辑輸输轟轰"
+    "辮辫遜逊遞递邁迈郵邮鄒邹醞酝釣钓鈔钞鉤钩銅铜銳锐鋪铺錦锦鍋锅鎖锁鑰钥閥阀閱阅陣阵陝陕隕陨霽霁"
+    "韁缰韻韵頸颈頹颓顆颗餓饿餅饼駐驻駕驾駛驶騰腾驟骤鬍胡鮑鲍鯨鲸鳩鸠鴉鸦鴨鸭鵬鹏鶯莺鸞鸾麵面闔阖"
+    "箝钳嘗尝獎奖傑杰"
+)
+
+# Formas variantes (異體字) que también pliegan a la forma canónica
+_PARES_VARIANTES = (
+    "説说爲为敎教眞真歴历兌兑靑青淸清麽么竝并並并峯峰羣群衆众彊强卽即旣既囘回迴回廻回吿告甯宁冩写"
+    "乗乘呉吴吳吴戸户鬭斗鬪斗甞尝奬奖汙污衞卫僞伪淨净爭争敍叙剣剑劒剑"
+)
+
+def _construir_tabla():
+    tabla = {}
+    for pares in (_PARES_TRADICIONAL_SIMPLIFICADO, _PARES_VARIANTES):
+        for variante, canonica in zip(pares[::2], pares[1::2]):
+            if variante != canonica:
+                tabla[variante] = canonica
+    return tabla
+
+PLEGADO = _construir_tabla()
+_TABLA_TRANSLATE = str.maketrans(PLEGADO)
+
+# Índice inverso precalculado: forma canónica -> todas sus grafías (incluida ella misma)
+VARIANTES = {}
+for _variante, _canonica in PLEGADO.items():
+    VARIANTES.setdefault(_canonica, _canonica)
+    VARIANTES[_canonica] += _variante
+
+SUFIJO_COLUMNA_NORMALIZADA = "_norm"
+MAX_VARIANTES_CONSULTA = 8
+
+
+def normalizar(texto):
+    """Pliega variantes y tradicional -> simplificado. Conserva la longitud del texto."""
+    return texto.translate(_TABLA_TRANSLATE) if texto else texto
+
+def variantes_de(termino, limite=MAX_VARIANTES_CONSULTA):
+    """Grafías alternativas de un término (para tablas sin columna sombra). La primera es la original."""
+    opciones = [VARIANTES.get(normalizar(c), c) for c in termino]
+    formas = [termino]
+    for combinacion in itertools.product(*opciones):
+        forma = "".join(combinacion)
+        if forma not in formas:
+            formas.append(forma)
+        if len(formas) >= limite:
+            break
+    return formas
+
+def buscar_posicion(texto, termino):
+    """Como str.find pero insensible a variantes y a mayúsculas; devuelve la posición en el texto original."""
+    return normalizar(texto.lower()).find(normalizar(termino.lower()))
+
+def patron_variantes(termino):
+    """Regex que casa el término en cualquiera de sus grafías (para resaltar coincidencias)."""
+    clases = []
+    for c in termino:
+        grafias = VARIANTES.get(normalizar(c), c)
+        clases.append(f"[{re.escape(grafias)}]" if len(grafias) > 1 else re.escape(c))
+    return re.compile("".join(clases), re.IGNORECASE)
+
+def columna_normalizada(columna):
+    return f"{columna}{SUFIJO_COLUMNA_NORMALIZADA}"
+
+def sql_columna_normalizada(tabla, columna):
+    """DDL de la columna sombra generada con la misma tabla de plegado (vía translate de Postgres)."""
+    origen = "".join(PLEGADO.keys()).replace("'", "''")
+    destino = "".join(PLEGADO.values()).replace("'", "''")
+    nueva = columna_normalizada(columna)
+    return ("CREATE EXTENSION IF NOT EXISTS pg_trgm;\n"
+            f'ALTER TABLE "{tabla}" ADD COLUMN IF NOT EXISTS "{nueva}" text\n'
+            f"  GENERATED ALWAYS AS (translate(\"{columna}\", '{origen}', '{destino}')) STORED;\n"
+            f'CREATE INDEX IF NOT EXISTS "{tabla}_{nueva}_trgm" ON "{tabla}" USING gin ("{nueva}" gin_trgm_ops);')
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Uso: python -m modules.normalizacion <tabla> <columna>")
+        sys.exit(1)
+    print(sql_columna_normalizada(sys.argv[1], sys.argv[2]))
@@ -0,0 +1,265 @@
+"""Pipeline sin interfaz del flujo completo de la tesis sobre un proyecto guardado.
+
+Uso:
+    python -m modules.pipeline 42                                   # índice -> prompts -> redacción -> bibliografía -> exportación
+    python -m modules.pipeline 42 --fases fichas indice --estilo "Chicago (Notas y Bibliografía)"
+    python -m modules.pipeline 42 --fases redaccion exportacion --idioma Inglés --salida exportaciones/
+
+Necesita SUPABASE_URL, SUPABASE_KEY y GOOGLE_API_KEY en el entorno. Cada unidad terminada (un
+lote de fichas, un capítulo...) se guarda en Supabase y se apunta en un checkpoint local junto
+con la firma de sus entradas: si el proceso se interrumpe, la siguiente ejecución retoma donde
+quedó y no repite lo que ya está hecho con las mismas entradas (--desde-cero ignora el checkpoint).
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from modules import ai_engine
+from modules.bibliografia import generar_bibliografia_incremental
+from modules.database import get_project, update_project_data
+from modules.export_utils import EXPORTADORES, exportar_todos
+from modules.redaccion import redactar_capitulo
+from modules.tracing import span
+from modules.versiones_indice import agregar_version
+
+logger = logging.getLogger("probatio.pipeline")
+
+FASES = ("fichas", "indice", "prompts", "redaccion", "bibliografia", "exportacion")
+# "fichas" re-sintetiza todas las fichas con el estilo de citación: solo se ejecuta si se pide
+FASES_POR_DEFECTO = FASES[1:]
+MAX_CAPITULOS_PARALELOS = 4
+FICHAS_POR_TANDA = 40
+DIRECTORIO_CHECKPOINTS = ".pipeline"
+
+
+def firma(*partes):
+    carga = json.dumps(partes, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(carga.encode("utf-8")).hexdigest()[:16]
+
+
+class Checkpoint:
+    """Registro local {fase: {unidad: firma_de_entradas}} que se reescribe de forma atómica."""
+
+    def __init__(self, ruta, desde_cero=False):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self.datos = {}
+        if not desde_cero and os.path.exists(ruta):
+            with open(ruta, encoding="utf-8") as f:
+                self.datos = json.load(f)
+
+    def hecho(self, fase, unidad, firma_entradas):
+        return self.datos.get(fase, {}).get(str(unidad)) == firma_entradas
+
+    def marcar(self, fase, unidad, firma_entradas):
+        with self._lock:
+            self.datos.setdefault(fase, {})[str(unidad)] = firma_entradas
+            os.makedirs(os.path.dirname(self.ruta) or ".", exist_ok=True)
+            temporal = f"{self.ruta}.tmp"
+            with open(temporal, "w", encoding="utf-8") as f:
+                json.dump(self.datos, f, ensure_ascii=False, indent=2)
+            os.replace(temporal, self.ruta)
+
+
+class Pipeline:
+    def __init__(self, proyecto_id, idioma="Español", estilo_citacion="APA 7", estilo_libre="",
+                 formatos=None, salida=None, paralelo=MAX_CAPITULOS_PARALELOS, ruta_checkpoint=None, desde_cero=False):
+        self.proyecto_id = proyecto_id
+        self.idioma = idioma
+        self.estilo_citacion = estilo_citacion
+        self.estilo_libre = estilo_libre
+        self.formatos = formatos or list(EXPORTADORES)
+        self.salida = salida
+        self.paralelo = paralelo
+        self.checkpoint = Checkpoint(ruta_checkpoint or os.path.join(DIRECTORIO_CHECKPOINTS, f"{proyecto_id}.json"), desde_cero)
+        self.proyecto = None
+        self.errores = []  # [(fase, unidad, mensaje)]
+
+    # --- UTILIDADES ---
+
+    def _guardar(self, campos):
+        update_project_data(self.proyecto_id, campos)
+        self.proyecto.update(campos)
+
+    def _error(self, fase, unidad, e):
+        logger.error("[%s] %s: %s", fase, unidad, e)
+        self.errores.append((fase, str(unidad), str(e)))
+
+    def _capitulos(self):
+        indice = self.proyecto.get("estructura_activa") or {}
+        return indice.get("capitulos", [])
+
+    def _por_capitulo(self, fase, tareas, campo, desglosar=None):
+        """Ejecuta en paralelo {nro: (firma, funcion)} y guarda cada resultado en `campo` según termina.
+        Con `desglosar(resultado) -> {campo: valor}` un mismo resultado se reparte entre varios campos."""
+        desglosar = desglosar or (lambda resultado: {campo: resultado})
+        pendientes = {nro: t for nro, t in tareas.items() if not self.checkpoint.hecho(fase, nro, t[0])
+                      or nro not in (self.proyecto.get(campo) or {})}
+        logger.info("[%s] %d capítulos pendientes de %d", fase, len(pendientes), len(tareas))
+        if not pendientes:
+            return
+        with ThreadPoolExecutor(max_workers=self.paralelo) as pool:
+            futuros = {pool.submit(funcion): (nro, firma_entradas) for nro, (firma_entradas, funcion) in pendientes.items()}
+            for futuro in as_completed(futuros):
+                nro, firma_entradas = futuros[futuro]
+                # Cualquier fallo (presupuesto, esquema, red, cuota...) se apunta y se sigue con los
+                # demás capítulos: el siguiente arranque retoma solo los que no llegaron al checkpoint
+                try:
+                    resultado = futuro.result()
+                    # Guardado desde el hilo principal: nunca dos escrituras concurrentes del mismo campo
+                    cambios = {}
+                    for nombre, valor in desglosar(resultado).items():
+                        cambios[nombre] = dict(self.proyecto.get(nombre) or {})
+                        cambios[nombre][nro] = valor
+                    self._guardar(cambios)
+                except Exception as e:
+                    self._error(fase, f"capítulo {nro}", e)
+                    continue
+                self.checkpoint.marcar(fase, nro, firma_entradas)
+                logger.info("[%s] capítulo %s listo", fase, nro)
+
+    # --- FASES ---
+
+    def fase_fichas(self):
+        fichas = self.proyecto.get("fichas") or []
+        pendientes = [f for f in fichas if not self.checkpoint.hecho("fichas", f["id"], firma(f, self.estilo_citacion))]
+        logger.info("[fichas] %d fichas pendientes de %d", len(pendientes), len(fichas))
+        for i in range(0, len(pendientes), FICHAS_POR_TANDA):
+            tanda = pendientes[i:i + FICHAS_POR_TANDA]
+            resultados, errores = ai_engine.extraer_fichas_en_lote(tanda, self.estilo_citacion)
+            for f in tanda:
+                if f["id"] in resultados:
+                    f.update(resultados[f["id"]])
+            try:
+                self._guardar({"fichas": fichas})
+            except Exception as e:
+                self._error("fichas", f"tanda {i // FICHAS_POR_TANDA + 1}", e)
+                continue
+            for f in tanda:
+                if f["id"] in resultados:
+                    # La firma se toma de la ficha ya actualizada: la próxima vez no se repite
+                    self.checkpoint.marcar("fichas", f["id"], firma(f, self.estilo_citacion))
+            for fid, motivo in errores.items():
+                self._error("fichas", fid, motivo)
+
+    def fase_indice(self):
+        fichas = self.proyecto.get("fichas") or []
+        firma_entradas = firma(fichas)
+        if self.checkpoint.hecho("indice", "activo", firma_entradas) and self.proyecto.get("estructura_activa"):
+            logger.info("[indice] sin cambios en las fichas, se conserva el índice activo")
+            return
+        try:
+            nuevo_indice = ai_engine.generar_indice_desde_fichas(fichas)
+        except Exception as e:
+            self._error("indice", "activo", e)
+            return
+        repositorio, nuevo_indice = agregar_version(self.proyecto.get("repositorio_indices"), nuevo_indice,
+                                                    self.proyecto["nombre"])
+        self._guardar({"repositorio_indices": repositorio, "estructura_activa": nuevo_indice})
+        self.checkpoint.marcar("indice", "activo", firma_entradas)
+
+    def fase_prompts(self):
+        fichas = self.proyecto.get("fichas") or []
+        tareas = {}
+        for cap in self._capitulos():
+            notas = ai_engine.notas_para_prompt(cap, fichas)
+            tareas[str(cap["nro"])] = (firma(cap, notas),
+                                       lambda cap=cap, notas=notas: ai_engine.evaluar_y_crear_prompt_inteligente(cap, notas))
+        self._por_capitulo("prompts", tareas, "prompts_inteligentes")
+
+    def fase_redaccion(self):
+        fichas = self.proyecto.get("fichas") or []
+        prompts = self.proyecto.get("prompts_inteligentes") or {}
+        secciones = self.proyecto.get("secciones_redactadas") or {}
+        tareas = {}
+        for cap in self._capitulos():
+            nro = str(cap["nro"])
+            if not prompts.get(nro):
+                self._error("redaccion", f"capítulo {nro}", "falta el prompt maestro (fase prompts)")
+                continue
+            notas = ai_engine.notas_para_redaccion(cap, fichas)
+            parametros = (cap, fichas, prompts[nro], self.idioma, self.estilo_libre, self.estilo_citacion, secciones.get(nro))
+            tareas[nro] = (firma(prompts[nro], notas, self.idioma, self.estilo_libre, self.estilo_citacion),
+                           lambda p=parametros: redactar_capitulo(*p))
+        # Sin la columna secciones_redactadas (ver database.MIGRACIONES_PROYECTOS) solo se guarda el texto
+        con_secciones = "secciones_redactadas" in self.proyecto
+        self._por_capitulo("redaccion", tareas, "contenido_redactado",
+                           lambda r: {"contenido_redactado": r["texto"], **({"secciones_redactadas": r["estado"]} if con_secciones else {})})
+
+    def fase_bibliografia(self):
+        indice = self.proyecto.get("estructura_activa") or {}
+        contenido = self.proyecto.get("contenido_redactado") or {}
+        if not contenido:
+            logger.info("[bibliografia] no hay capítulos redactados")
+            return
+        firma_entradas = firma(indice, contenido, self.estilo_citacion)
+        if self.checkpoint.hecho("bibliografia", "global", firma_entradas):
+            logger.info("[bibliografia] sin cambios")
+            return
+        try:
+            biblio = generar_bibliografia_incremental(indice, contenido, self.proyecto.get("fichas") or [], self.estilo_citacion)
+        except Exception as e:
+            self._error("bibliografia", "global", e)
+            return
+        self._guardar({"bibliografia": biblio})
+        self.checkpoint.marcar("bibliografia", "global", firma_entradas)
+
+    def fase_exportacion(self):
+        contenido = self.proyecto.get("contenido_redactado") or {}
+        if not contenido:
+            logger.info("[exportacion] no hay capítulos redactados")
+            return
+        if not self.salida:
+            logger.info("[exportacion] sin --salida, no se escriben ficheros")
+            return
+        titulo = (self.proyecto.get("estructura_activa") or {}).get("titulo_tesis", "Monografía")
+        os.makedirs(self.salida, exist_ok=True)
+        archivos = exportar_todos(titulo, contenido, self.proyecto.get("bibliografia") or "", self.formatos)
+        for formato, datos in archivos.items():
+            ruta = os.path.join(self.salida, f"{self.proyecto['nombre']}.{EXPORTADORES[formato]['extension']}")
+            with open(ruta, "wb") as f:
+                f.write(datos)
+            logger.info("[exportacion] %s", ruta)
+
+    def ejecutar(self, fases=FASES_POR_DEFECTO):
+        self.proyecto = get_project(self.proyecto_id)
+        if not self.proyecto:
+            raise ValueError(f"No existe el proyecto {self.proyecto_id}")
+        for fase in FASES:
+            if fase in fases:
+                with span(f"pipeline.{fase}", "pipeline", proyecto=self.proyecto_id):
+                    getattr(self, f"fase_{fase}")()
+        return self.errores
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("proyecto_id")
+    parser.add_argument("--fases", nargs="+", choices=FASES, default=list(FASES_POR_DEFECTO))
+    parser.add_argument("--idioma", default="Español")
+    parser.add_argument("--estilo", default="APA 7", help="estilo de citación")
+    parser.add_argument("--estilo-libre", default="", help="comentarios de estilo para la redacción")
+    parser.add_argument("--formatos", nargs="+", choices=list(EXPORTADORES), help="por defecto, todos")
+    parser.add_argument("--salida", help="directorio donde escribir las exportaciones")
+    parser.add_argument("--paralelo", type=int, default=MAX_CAPITULOS_PARALELOS, help="capítulos simultáneos")
+    parser.add_argument("--checkpoint", help=f"fichero de checkpoint (por defecto {DIRECTORIO_CHECKPOINTS}/<proyecto>.json)")
+    parser.add_argument("--desde-cero", action="store_true", help="ignora el checkpoint y rehace todas las fases pedidas")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    proyecto_id = int(args.proyecto_id) if args.proyecto_id.isdigit() else args.proyecto_id
+    pipeline = Pipeline(proyecto_id, idioma=args.idioma, estilo_citacion=args.estilo, estilo_libre=args.estilo_libre,
+                        formatos=args.formatos, salida=args.salida, paralelo=args.paralelo,
+                        ruta_checkpoint=args.checkpoint, desde_cero=args.desde_cero)
+    errores = pipeline.ejecutar(args.fases)
+    for fase, unidad, mensaje in errores:
+        print(f"ERROR [{fase}] {unidad}: {mensaje}", file=sys.stderr)
+    return 1 if errores else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
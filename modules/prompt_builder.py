@@ -0,0 +1,92 @@
+import re
+
+# --- CONSTRUCTOR DE PROMPTS CON PRESUPUESTO DE TOKENS ---
+# Cada prompt se arma por secciones (instrucciones, texto fuente, notas, RAG, historial...).
+# Antes de enviar estimamos los tokens de cada sección, recortamos las recortables por orden
+# de prioridad si el total supera el presupuesto y, si aun así no cabe, fallamos sin llamar a la API.
+
+# Presupuestos por llamada (tokens de entrada). Muy por debajo del límite del modelo a propósito:
+# prompts más cortos responden antes y cuestan menos.
+PRESUPUESTOS_TOKENS = {
+    "chat_with_primary_source": 120_000,
+    "chat_with_ideas": 120_000,
+    "generar_indice_desde_fichas": 200_000,
+    "execute_final_writing": 150_000,
+}
+PRESUPUESTO_POR_DEFECTO = 100_000
+
+# Prioridades de recorte: se recorta antes la sección de número MÁS BAJO
+PRIORIDAD_RAG = 1
+PRIORIDAD_HISTORIAL = 2
+PRIORIDAD_NOTAS = 3
+PRIORIDAD_FUENTE = 4
+
+MARCA_RECORTE = "\n[... recortado por presupuesto de tokens ...]\n"
+PATRON_CJK = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\U00020000-\U0002ffff]')
+
+
+class PresupuestoExcedidoError(ValueError):
+    """El prompt no cabe en el presupuesto ni tras recortar todas las secciones recortables."""
+
+    def __init__(self, estimacion):
+        self.estimacion = estimacion
+        super().__init__(f"El prompt necesita ~{estimacion['total']} tokens y el presupuesto es {estimacion['presupuesto']}.")
+
+
+def estimar_tokens(texto):
+    """Estimación local y barata: ~1 token por carácter CJK y ~1 token por cada 4 caracteres del resto."""
+    if not texto:
+        return 0
+    cjk = len(PATRON_CJK.findall(texto))
+    return cjk + (len(texto) - cjk + 3) // 4
+
+
+class ConstructorPrompt:
+    def __init__(self, operacion, presupuesto=None):
+        self.operacion = operacion
+        self.presupuesto = presupuesto or PRESUPUESTOS_TOKENS.get(operacion, PRESUPUESTO_POR_DEFECTO)
+        self.secciones = []
+
+    def seccion(self, nombre, texto, prioridad=None, recortar_desde="final", minimo_tokens=0):
+        """Añade una sección. Sin `prioridad` la sección es fija y nunca se recorta."""
+        self.secciones.append({
+            "nombre": nombre, "texto": texto or "", "prioridad": prioridad,
+            "recortar_desde": recortar_desde, "minimo_tokens": minimo_tokens,
+        })
+        return self
+
+    def estimacion(self):
+        por_seccion = {}
+        for s in self.secciones:
+            por_seccion[s["nombre"]] = por_seccion.get(s["nombre"], 0) + estimar_tokens(s["texto"])
+        total = sum(por_seccion.values())
+        return {"operacion": self.operacion, "secciones": por_seccion, "total": total,
+                "presupuesto": self.presupuesto, "cabe": total <= self.presupuesto}
+
+    def _recortar(self, s, tokens_objetivo):
+        texto = s["texto"]
+        tokens = estimar_tokens(texto)
+        if tokens <= tokens_objetivo:
+            return
+        caracteres = max(0, int(len(texto) * tokens_objetivo / tokens) - len(MARCA_RECORTE))
+        if s["recortar_desde"] == "inicio":
+            s["texto"] = MARCA_RECORTE + texto[len(texto) - caracteres:] if caracteres else MARCA_RECORTE
+        else:
+            s["texto"] = texto[:caracteres] + MARCA_RECORTE
+
+    def construir(self):
+        """Devuelve el prompt final, recortando por prioridad si hace falta; lanza PresupuestoExcedidoError si no cabe."""
+        exceso = self.estimacion()["total"] - self.presupuesto
+        recortables = sorted([s for s in self.secciones if s["prioridad"] is not None], key=lambda s: s["prioridad"])
+        for s in recortables:
+            if exceso <= 0:
+                break
+            tokens = estimar_tokens(s["texto"])
+            objetivo = max(s["minimo_tokens"], tokens - exceso)
+            self._recortar(s, objetivo)
+            exceso -= tokens - estimar_tokens(s["texto"])
+
+        estimacion = self.estimacion()
+        if not estimacion["cabe"]:
+            raise PresupuestoExcedidoError(estimacion)
+        return "".join(s["texto"] for s in self.secciones)
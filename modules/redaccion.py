@@ -0,0 +1,147 @@
+import hashlib
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from modules import ai_engine
+
+# --- MOTOR INCREMENTAL DE REDACCIÓN ---
+# Cada capítulo se guarda como secciones etiquetadas con las fichas de las que beben y la firma
+# del material de cada ficha (`secciones_redactadas[nro]`). Al volver a redactar solo se reescriben
+# las secciones cuyas fichas cambiaron o salieron del capítulo; las demás se reutilizan tal cual, y
+# las fichas nuevas del capítulo forman una sección nueva al final. Si cambian los parámetros
+# globales (prompt maestro, idioma, estilo o citación) se redacta el capítulo entero.
+#
+# estado = {"firma": firma_parametros, "siguiente": int,
+#           "secciones": [{"id": "s1", "titulo": str, "fichas": {id_ficha: firma_nota}, "texto": str}]}
+
+MAX_SECCIONES_PARALELAS = 4
+# Final de la sección anterior que se pasa como contexto al reescribir una sección
+MAX_CONTEXTO_CARACTERES = 600
+
+PATRON_NOTA = re.compile(r'\[\^([^\]]+)\]')
+
+
+def _firma(*partes):
+    return hashlib.sha256("\x1f".join(str(p) for p in partes).encode("utf-8")).hexdigest()[:16]
+
+def firma_parametros(prompt_maestro, idioma, estilo, estilo_citacion):
+    return _firma(prompt_maestro, idioma, estilo, estilo_citacion)
+
+def _etiquetar_notas(texto, id_seccion):
+    """Prefija las etiquetas de nota con el id de la sección: las secciones se redactan por separado
+    y dos de ellas podrían usar la misma [^1]."""
+    return PATRON_NOTA.sub(lambda m: f"[^{id_seccion}-{m.group(1)}]", texto or "")
+
+def ensamblar(secciones):
+    """Markdown del capítulo a partir de sus secciones."""
+    partes = []
+    for s in secciones:
+        cuerpo = s["texto"].strip()
+        partes.append(f"## {s['titulo']}\n\n{cuerpo}" if s.get("titulo") else cuerpo)
+    return "\n\n".join(partes)
+
+
+# --- PLAN ---
+
+def planificar(estado, notas_por_id, firma_global):
+    """Decide qué secciones se reutilizan, cuáles se reescriben y qué fichas necesitan sección nueva."""
+    secciones = (estado or {}).get("secciones") or []
+    if not secciones or estado.get("firma") != firma_global:
+        return {"completa": True, "reutilizar": [], "redactar": [], "eliminar": [], "nuevas": list(notas_por_id)}
+    firmas = {fid: _firma(nota) for fid, nota in notas_por_id.items()}
+    plan = {"completa": False, "reutilizar": [], "redactar": [], "eliminar": [], "nuevas": []}
+    cubiertas = set()
+    for s in secciones:
+        vigentes = [fid for fid in s["fichas"] if fid in firmas]
+        cubiertas.update(vigentes)
+        if s["fichas"] and not vigentes:
+            plan["eliminar"].append(s["id"])
+        elif any(firmas.get(fid) != f for fid, f in s["fichas"].items()):
+            plan["redactar"].append(s["id"])
+        else:
+            plan["reutilizar"].append(s["id"])
+    plan["nuevas"] = [fid for fid in notas_por_id if fid not in cubiertas]
+    return plan
+
+def _contexto(secciones, indice_objetivo):
+    """Títulos del capítulo con la posición de la sección a escribir y el final de la anterior."""
+    lineas = []
+    for i, s in enumerate(secciones):
+        lineas.append(f"{'→ ' if i == indice_objetivo else '  '}{s.get('titulo') or '(sin título)'}")
+    if indice_objetivo >= len(secciones):
+        lineas.append("→ (sección nueva al final del capítulo)")
+    if 0 < indice_objetivo <= len(secciones):
+        anterior = secciones[indice_objetivo - 1]["texto"].strip()
+        lineas.append(f"\nFINAL DE LA SECCIÓN ANTERIOR:\n...{anterior[-MAX_CONTEXTO_CARACTERES:]}")
+    return "\n".join(lineas)
+
+
+# --- REDACCIÓN ---
+
+def _encargos(estado, notas_por_id, plan):
+    """(clave, titulo, notas, contexto, fichas) de cada llamada de sección que exige el plan."""
+    secciones = [s for s in estado["secciones"] if s["id"] not in plan["eliminar"]]
+    encargos = []
+    for i, s in enumerate(secciones):
+        if s["id"] in plan["redactar"]:
+            vigentes = [fid for fid in s["fichas"] if fid in notas_por_id]
+            encargos.append((s["id"], s.get("titulo", ""), "\n".join(notas_por_id[fid] for fid in vigentes),
+                             _contexto(secciones, i), vigentes))
+    if plan["nuevas"]:
+        encargos.append((None, "", "\n".join(notas_por_id[fid] for fid in plan["nuevas"]),
+                         _contexto(secciones, len(secciones)), plan["nuevas"]))
+    return secciones, encargos
+
+def estimar_redaccion(capitulo, fichas, prompt_maestro, idioma, estilo, estilo_citacion, estado=None):
+    """(plan, [estimación por llamada]) sin llamar a la IA."""
+    notas_por_id = ai_engine.notas_por_ficha(capitulo, fichas)
+    plan = planificar(estado, notas_por_id, firma_parametros(prompt_maestro, idioma, estilo, estilo_citacion))
+    if plan["completa"]:
+        return plan, [ai_engine.estimar_redactar_capitulo_por_secciones(prompt_maestro, notas_por_id, idioma, estilo, estilo_citacion)]
+    _, encargos = _encargos(estado, notas_por_id, plan)
+    return plan, [ai_engine.estimar_redactar_seccion(prompt_maestro, titulo, notas, contexto, idioma, estilo, estilo_citacion)
+                  for _, titulo, notas, contexto, _ in encargos]
+
+def redactar_capitulo(capitulo, fichas, prompt_maestro, idioma, estilo, estilo_citacion, estado=None):
+    """Redacta el capítulo reutilizando las secciones vigentes de `estado`.
+    Devuelve {"texto": markdown, "estado": estado_nuevo, "resumen": {...}}."""
+    notas_por_id = ai_engine.notas_por_ficha(capitulo, fichas)
+    firma_global = firma_parametros(prompt_maestro, idioma, estilo, estilo_citacion)
+    firmas = {fid: _firma(nota) for fid, nota in notas_por_id.items()}
+    plan = planificar(estado, notas_por_id, firma_global)
+
+    if plan["completa"]:
+        generadas = ai_engine.redactar_capitulo_por_secciones(prompt_maestro, notas_por_id, idioma, estilo, estilo_citacion)
+        secciones = []
+        for i, g in enumerate(generadas, start=1):
+            sid = f"s{i}"
+            secciones.append({"id": sid, "titulo": g["titulo"], "texto": _etiquetar_notas(g["texto"], sid),
+                              "fichas": {fid: firmas[fid] for fid in g["fichas"] if fid in firmas}})
+        # Las fichas que la IA no atribuyó a ninguna sección cuentan como material de la última
+        sin_seccion = set(firmas) - {fid for s in secciones for fid in s["fichas"]}
+        if secciones and sin_seccion:
+            secciones[-1]["fichas"].update({fid: firmas[fid] for fid in sin_seccion})
+        nuevo = {"firma": firma_global, "siguiente": len(secciones) + 1, "secciones": secciones}
+        return {"texto": ensamblar(secciones), "estado": nuevo,
+                "resumen": {"reutilizadas": 0, "redactadas": len(secciones), "completa": True}}
+
+    secciones, encargos = _encargos(estado, notas_por_id, plan)
+    with ThreadPoolExecutor(max_workers=MAX_SECCIONES_PARALELAS) as pool:
+        futuros = [pool.submit(ai_engine.redactar_seccion, prompt_maestro, titulo, notas, contexto, idioma, estilo, estilo_citacion)
+                   for _, titulo, notas, contexto, _ in encargos]
+        resultados = [f.result() for f in futuros]
+
+    siguiente = estado.get("siguiente", len(estado["secciones"]) + 1)
+    reescritas = {}
+    for (sid, titulo, _, _, usadas), r in zip(encargos, resultados):
+        if sid is None:
+            sid = f"s{siguiente}"
+            siguiente += 1
+        # La dependencia es el material enviado, no lo que la IA diga haber usado
+        reescritas[sid] = {"id": sid, "titulo": r["titulo"] or titulo, "texto": _etiquetar_notas(r["texto"], sid),
+                           "fichas": {fid: firmas[fid] for fid in usadas}}
+    nuevas = [reescritas.pop(sid) for sid in list(reescritas) if sid not in {s["id"] for s in secciones}]
+    secciones = [reescritas.get(s["id"], s) for s in secciones] + nuevas
+    nuevo = {"firma": firma_global, "siguiente": siguiente, "secciones": secciones}
+    return {"texto": ensamblar(secciones), "estado": nuevo,
+            "resumen": {"reutilizadas": len(plan["reutilizar"]), "redactadas": len(encargos), "completa": False}}
@@ -0,0 +1,194 @@
+import json
+from typing import List, TypedDict
+
+from modules.prompt_builder import PresupuestoExcedidoError
+
+# --- CAPA DE SALIDA ESTRUCTURADA (ESQUEMA + VALIDACIÓN + UNA REPARACIÓN) ---
+# Gemini recibe el esquema vía `response_schema`, validamos la respuesta contra el
+# mismo esquema y, si falla, hacemos UNA única llamada barata de reparación que solo
+# reenvía la salida defectuosa (no el prompt original con todo su contexto).
+
+class Ficha(TypedDict):
+    texto: str
+    cita_pie: str
+    referencia_bib: str
+
+class Capitulo(TypedDict):
+    nro: int
+    titulo: str
+    objetivo: str
+    fichas_asociadas: List[str]
+
+class Indice(TypedDict):
+    titulo_tesis: str
+    capitulos: List[Capitulo]
+
+class Seccion(TypedDict):
+    titulo: str
+    fichas: List[str]
+    texto: str
+
+ESQUEMA_FICHA = {
+    "type": "OBJECT",
+    "properties": {
+        "texto": {"type": "STRING"},
+        "cita_pie": {"type": "STRING"},
+        "referencia_bib": {"type": "STRING"},
+    },
+    "required": ["texto", "cita_pie", "referencia_bib"],
+}
+
+ESQUEMA_FICHA_LOTE = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {"id": {"type": "STRING"}, **ESQUEMA_FICHA["properties"]},
+        "required": ["id", *ESQUEMA_FICHA["required"]],
+    },
+}
+
+ESQUEMA_REFERENCIAS = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {"clave": {"type": "STRING"}, "entrada": {"type": "STRING"}},
+        "required": ["clave", "entrada"],
+    },
+}
+
+ESQUEMA_CAPITULO = {
+    "type": "OBJECT",
+    "properties": {
+        "nro": {"type": "INTEGER"},
+        "titulo": {"type": "STRING"},
+        "objetivo": {"type": "STRING"},
+        "fichas_asociadas": {"type": "ARRAY", "items": {"type": "STRING"}},
+    },
+    "required": ["nro", "titulo", "objetivo", "fichas_asociadas"],
+}
+
+ESQUEMA_INDICE = {
+    "type": "OBJECT",
+    "properties": {
+        "titulo_tesis": {"type": "STRING"},
+        "capitulos": {"type": "ARRAY", "items": ESQUEMA_CAPITULO},
+    },
+    "required": ["titulo_tesis", "capitulos"],
+}
+
+ESQUEMA_SECCION = {
+    "type": "OBJECT",
+    "properties": {
+        "titulo": {"type": "STRING"},
+        "fichas": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "texto": {"type": "STRING"},
+    },
+    "required": ["titulo", "fichas", "texto"],
+}
+
+ESQUEMA_SECCIONES = {"type": "ARRAY", "items": ESQUEMA_SECCION}
+
+
+class SalidaEstructuradaError(ValueError):
+    """La respuesta del modelo no cumple el esquema ni tras la pasada de reparación."""
+
+
+class LlamadaModeloError(RuntimeError):
+    """La llamada al modelo falló (red, cuota, credenciales) o la respuesta llegó bloqueada o vacía."""
+
+
+# Lo que la interfaz debe capturar alrededor de una llamada estructurada (el prompt que no cabe en su
+# presupuesto falla antes de llamar al modelo)
+ERRORES_IA = (SalidaEstructuradaError, LlamadaModeloError, PresupuestoExcedidoError)
+
+
+# --- VALIDACIÓN ---
+
+def _desenvolver(datos, esquema):
+    """Normaliza los envoltorios habituales del modelo: listas de un elemento y claves tipo {"ficha": {...}}."""
+    if esquema["type"] == "OBJECT":
+        if isinstance(datos, list) and len(datos) == 1:
+            datos = datos[0]
+        if isinstance(datos, dict):
+            datos = {str(k).lower(): v for k, v in datos.items()}
+            propiedades = esquema.get("properties", {})
+            if len(datos) == 1 and not set(datos) & set(propiedades):
+                interno = next(iter(datos.values()))
+                if isinstance(interno, (dict, list)):
+                    return _desenvolver(interno, esquema)
+    elif esquema["type"] == "ARRAY":
+        if isinstance(datos, dict) and len(datos) == 1 and isinstance(next(iter(datos.values())), list):
+            datos = next(iter(datos.values()))
+    return datos
+
+def validar(datos, esquema, ruta="$"):
+    """Valida `datos` contra el subconjunto de OpenAPI que usa Gemini y devuelve la versión normalizada."""
+    datos = _desenvolver(datos, esquema)
+    tipo = esquema["type"]
+
+    if tipo == "OBJECT":
+        if not isinstance(datos, dict):
+            raise SalidaEstructuradaError(f"{ruta}: se esperaba un objeto")
+        propiedades = esquema.get("properties", {})
+        faltan = [k for k in esquema.get("required", []) if k not in datos]
+        if faltan:
+            raise SalidaEstructuradaError(f"{ruta}: faltan las claves {faltan}")
+        return {k: validar(datos[k], sub, f"{ruta}.{k}") for k, sub in propiedades.items() if k in datos}
+
+    if tipo == "ARRAY":
+        if not isinstance(datos, list):
+            raise SalidaEstructuradaError(f"{ruta}: se esperaba una lista")
+        return [validar(item, esquema["items"], f"{ruta}[{i}]") for i, item in enumerate(datos)]
+
+    if tipo == "STRING":
+        if isinstance(datos, (int, float)) and not isinstance(datos, bool):
+            return str(datos)
+        if not isinstance(datos, str):
+            raise SalidaEstructuradaError(f"{ruta}: se esperaba texto")
+        return datos
+
+    if tipo == "INTEGER":
+        try:
+            return int(datos)
+        except (TypeError, ValueError):
+            raise SalidaEstructuradaError(f"{ruta}: se esperaba un entero")
+
+    return datos
+
+def _parsear(texto, esquema):
+    try:
+        datos = json.loads(texto)
+    except (json.JSONDecodeError, TypeError) as e:
+        raise SalidaEstructuradaError(f"JSON inválido: {e}")
+    return validar(datos, esquema)
+
+
+# --- GENERACIÓN CON UNA ÚNICA PASADA DE REPARACIÓN ---
+
+def _config(esquema):
+    return {"response_mime_type": "application/json", "response_schema": esquema}
+
+def _texto_de(model, prompt, esquema):
+    """Texto de la respuesta; los fallos de la API y las respuestas bloqueadas (`.text` lanza
+    ValueError) se convierten en LlamadaModeloError."""
+    try:
+        return model.generate_content(prompt, generation_config=_config(esquema)).text
+    except Exception as e:
+        raise LlamadaModeloError(f"{type(e).__name__}: {e}") from e
+
+def generar_estructurado(model, prompt, esquema):
+    """Llama al modelo con `response_schema`; si la salida no valida, hace como máximo una reparación."""
+    texto = _texto_de(model, prompt, esquema)
+    try:
+        return _parsear(texto, esquema)
+    except SalidaEstructuradaError as error:
+        prompt_reparacion = f"""
+    La siguiente salida JSON no cumple el esquema requerido.
+    ERROR: {error}
+    ESQUEMA: {json.dumps(esquema, ensure_ascii=False)}
+    SALIDA DEFECTUOSA:
+    {texto}
+
+    Devuelve EXCLUSIVAMENTE el JSON corregido, conservando su contenido.
+    """
+        return _parsear(_texto_de(model, prompt_reparacion, esquema), esquema)
@@ -0,0 +1,303 @@
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from modules import ai_engine
+from modules.bibliografia import generar_bibliografia_incremental
+from modules.redaccion import redactar_capitulo
+from modules.tracing import span
+
+# --- COLA DE TRABAJOS EN SEGUNDO PLANO ---
+# Las operaciones largas con la IA (índice, prompts, redacción, bibliografía, lotes de fichas) se
+# encolan en SQLite y las ejecuta un pool de hilos del proceso. El estado sobrevive a los reruns y
+# a recargar la pestaña; la interfaz consulta la cola y aplica los resultados al proyecto.
+# Dos encargos idénticos (mismo proyecto, tipo, parámetros y destino) comparten trabajo.
+#
+# Varios procesos pueden compartir el fichero: cada uno marca los trabajos que ejecuta con su id y
+# renueva un latido; solo se recuperan los trabajos 'ejecutando' cuyo latido ha caducado (su proceso
+# murió). Los trabajos ya cerrados se borran pasados DIAS_RETENCION días.
+
+logger = logging.getLogger("probatio.trabajos")
+
+RUTA_DB = os.environ.get("TRABAJOS_DB", os.path.join(os.path.expanduser("~"), ".cache", "probatio", "trabajos.sqlite3"))
+MAX_TRABAJADORES = 4
+INTERVALO_SONDEO_S = 1.0
+INTERVALO_LATIDO_S = 30.0
+# Sin latido durante este tiempo, un trabajo 'ejecutando' se da por huérfano y vuelve a la cola
+CADUCIDAD_LATIDO_S = 5 * INTERVALO_LATIDO_S
+DIAS_RETENCION = int(os.environ.get("TRABAJOS_DIAS_RETENCION", "7"))
+INTERVALO_PURGA_S = 3600.0
+
+ID_PROCESO = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+PENDIENTE, EJECUTANDO, HECHO, ERROR, CANCELADO = "pendiente", "ejecutando", "hecho", "error", "cancelado"
+ACTIVOS = (PENDIENTE, EJECUTANDO)
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS trabajos (
+    id TEXT PRIMARY KEY,
+    tipo TEXT NOT NULL,
+    clave TEXT NOT NULL,
+    proyecto_id TEXT,
+    etiqueta TEXT,
+    parametros TEXT NOT NULL,
+    meta TEXT,
+    estado TEXT NOT NULL,
+    resultado TEXT,
+    error TEXT,
+    cancelar INTEGER NOT NULL DEFAULT 0,
+    aplicado INTEGER NOT NULL DEFAULT 0,
+    creado REAL NOT NULL,
+    iniciado REAL,
+    terminado REAL,
+    trabajador TEXT,
+    latido REAL
+);
+CREATE INDEX IF NOT EXISTS trabajos_clave ON trabajos (clave, estado);
+CREATE INDEX IF NOT EXISTS trabajos_estado ON trabajos (estado, creado);
+CREATE INDEX IF NOT EXISTS trabajos_proyecto ON trabajos (proyecto_id, creado);
+"""
+# Columnas añadidas después de la primera versión del esquema (las bases ya creadas no las tienen)
+_COLUMNAS_NUEVAS = {"trabajador": "TEXT", "latido": "REAL"}
+
+
+# --- REGISTRO DE TIPOS ---
+# Cada tipo recibe sus parámetros (JSON) y devuelve un resultado serializable a JSON.
+TIPOS = {}
+
+def registrar_tipo(nombre):
+    def decorador(funcion):
+        TIPOS[nombre] = funcion
+        return funcion
+    return decorador
+
+@registrar_tipo("indice")
+def _trabajo_indice(p):
+    return ai_engine.generar_indice_desde_fichas(p["fichas"])
+
+@registrar_tipo("prompt_capitulo")
+def _trabajo_prompt(p):
+    return ai_engine.evaluar_y_crear_prompt_inteligente(p["capitulo"], p["notas"])
+
+@registrar_tipo("redaccion_capitulo")
+def _trabajo_redaccion(p):
+    if "notas" in p:
+        # Trabajo encolado antes de la redacción por secciones
+        return ai_engine.execute_final_writing(p["prompt"], p["notas"], p["idioma"], p["estilo"], p["estilo_citacion"])
+    return redactar_capitulo(p["capitulo"], p["fichas"], p["prompt"], p["idioma"], p["estilo"], p["estilo_citacion"], p.get("estado"))
+
+@registrar_tipo("bibliografia")
+def _trabajo_bibliografia(p):
+    return generar_bibliografia_incremental(p["indice"], p["contenido"], p["fichas"], p["estilo_citacion"])
+
+@registrar_tipo("fichas_lote")
+def _trabajo_fichas_lote(p):
+    if p.get("instruccion"):
+        resultados, errores = ai_engine.refinar_fichas_en_lote(p["fichas"], p["instruccion"], p["estilo_citacion"])
+    else:
+        resultados, errores = ai_engine.extraer_fichas_en_lote(p["fichas"], p["estilo_citacion"])
+    return {"resultados": resultados, "errores": errores}
+
+
+# --- ALMACÉN SQLITE ---
+
+_inicializada = set()
+_lock_esquema = threading.Lock()
+
+@contextmanager
+def _conexion(ruta=None):
+    """Una conexión por operación: sqlite3 no comparte conexiones entre hilos."""
+    ruta = ruta or RUTA_DB
+    with _lock_esquema:
+        if ruta not in _inicializada:
+            os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+            con = sqlite3.connect(ruta)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(_ESQUEMA)
+            existentes = {fila[1] for fila in con.execute("PRAGMA table_info(trabajos)")}
+            for columna, tipo in _COLUMNAS_NUEVAS.items():
+                if columna not in existentes:
+                    con.execute(f"ALTER TABLE trabajos ADD COLUMN {columna} {tipo}")
+            con.close()
+            _inicializada.add(ruta)
+    con = sqlite3.connect(ruta, timeout=30, isolation_level=None)
+    con.row_factory = sqlite3.Row
+    try:
+        yield con
+    finally:
+        con.close()
+
+def _fila_a_dict(fila):
+    if fila is None:
+        return None
+    trabajo = dict(fila)
+    for campo in ("parametros", "meta", "resultado"):
+        if trabajo.get(campo) is not None:
+            trabajo[campo] = json.loads(trabajo[campo])
+    return trabajo
+
+def clave_trabajo(tipo, parametros, meta=None, proyecto_id=None):
+    proyecto = None if proyecto_id is None else str(proyecto_id)
+    carga = json.dumps([tipo, parametros, meta, proyecto], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(carga.encode("utf-8")).hexdigest()
+
+def encolar(tipo, parametros, proyecto_id=None, etiqueta="", meta=None):
+    """Encola un trabajo y devuelve su id. Si ya hay uno idéntico en curso o con el resultado
+    aún sin aplicar, devuelve ese en lugar de repetir la llamada a la IA."""
+    if tipo not in TIPOS:
+        raise ValueError(f"Tipo de trabajo desconocido: {tipo}")
+    clave = clave_trabajo(tipo, parametros, meta, proyecto_id)
+    with _conexion() as con:
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            existente = con.execute(
+                "SELECT id FROM trabajos WHERE clave = ? AND (estado IN (?, ?) OR (estado = ? AND aplicado = 0)) "
+                "ORDER BY creado DESC LIMIT 1", (clave, PENDIENTE, EJECUTANDO, HECHO)).fetchone()
+            if existente:
+                con.execute("COMMIT")
+                return existente["id"]
+            id_trabajo = uuid.uuid4().hex[:12]
+            con.execute(
+                "INSERT INTO trabajos (id, tipo, clave, proyecto_id, etiqueta, parametros, meta, estado, creado) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (id_trabajo, tipo, clave, None if proyecto_id is None else str(proyecto_id), etiqueta,
+                 json.dumps(parametros, ensure_ascii=False, default=str),
+                 json.dumps(meta, ensure_ascii=False, default=str), PENDIENTE, time.time()))
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+    _despertar.set()
+    return id_trabajo
+
+def obtener(id_trabajo):
+    with _conexion() as con:
+        return _fila_a_dict(con.execute("SELECT * FROM trabajos WHERE id = ?", (id_trabajo,)).fetchone())
+
+def trabajos_de(proyecto_id, limite=50):
+    """Trabajos recientes de un proyecto (sin los parámetros, que pueden ser grandes)."""
+    with _conexion() as con:
+        filas = con.execute(
+            "SELECT id, tipo, etiqueta, meta, estado, error, aplicado, creado, iniciado, terminado FROM trabajos "
+            "WHERE proyecto_id = ? ORDER BY creado DESC LIMIT ?", (str(proyecto_id), limite)).fetchall()
+    return [_fila_a_dict(f) for f in filas]
+
+def terminados_sin_aplicar(proyecto_id):
+    with _conexion() as con:
+        filas = con.execute(
+            "SELECT * FROM trabajos WHERE proyecto_id = ? AND estado = ? AND aplicado = 0 ORDER BY terminado",
+            (str(proyecto_id), HECHO)).fetchall()
+    return [_fila_a_dict(f) for f in filas]
+
+def marcar_aplicado(id_trabajo):
+    """Reclama el resultado para aplicarlo. Devuelve False si otra sesión ya lo aplicó."""
+    with _conexion() as con:
+        cursor = con.execute("UPDATE trabajos SET aplicado = 1 WHERE id = ? AND aplicado = 0", (id_trabajo,))
+        return cursor.rowcount == 1
+
+def cancelar(id_trabajo):
+    """Un trabajo pendiente se cancela al momento; uno en ejecución descarta su resultado al terminar
+    (una llamada a la IA ya enviada no se puede interrumpir)."""
+    with _conexion() as con:
+        con.execute("UPDATE trabajos SET estado = ?, terminado = ? WHERE id = ? AND estado = ?",
+                    (CANCELADO, time.time(), id_trabajo, PENDIENTE))
+        con.execute("UPDATE trabajos SET cancelar = 1 WHERE id = ? AND estado = ?", (id_trabajo, EJECUTANDO))
+
+def _recuperar_huerfanos(con):
+    """Devuelve a la cola los trabajos cuyo proceso dejó de dar latido (cayó a mitad de ejecución)."""
+    con.execute("UPDATE trabajos SET estado = ?, iniciado = NULL, trabajador = NULL, latido = NULL "
+                "WHERE estado = ? AND (latido IS NULL OR latido < ?)",
+                (PENDIENTE, EJECUTANDO, time.time() - CADUCIDAD_LATIDO_S))
+
+def _reclamar_siguiente():
+    with _conexion() as con:
+        con.execute("BEGIN IMMEDIATE")
+        _recuperar_huerfanos(con)
+        fila = con.execute("SELECT * FROM trabajos WHERE estado = ? ORDER BY creado LIMIT 1", (PENDIENTE,)).fetchone()
+        if fila:
+            ahora = time.time()
+            con.execute("UPDATE trabajos SET estado = ?, iniciado = ?, trabajador = ?, latido = ? WHERE id = ?",
+                        (EJECUTANDO, ahora, ID_PROCESO, ahora, fila["id"]))
+        con.execute("COMMIT")
+    return _fila_a_dict(fila)
+
+def _latir():
+    with _conexion() as con:
+        con.execute("UPDATE trabajos SET latido = ? WHERE trabajador = ? AND estado = ?",
+                    (time.time(), ID_PROCESO, EJECUTANDO))
+
+def purgar(dias=DIAS_RETENCION):
+    """Borra los trabajos cerrados (aplicados, cancelados o con error) de hace más de `dias` días:
+    sus parámetros llevan todas las fichas del proyecto. Devuelve cuántos borró."""
+    with _conexion() as con:
+        cursor = con.execute(
+            "DELETE FROM trabajos WHERE terminado < ? AND (estado IN (?, ?) OR (estado = ? AND aplicado = 1))",
+            (time.time() - dias * 86400, CANCELADO, ERROR, HECHO))
+        return cursor.rowcount
+
+def _terminar(id_trabajo, resultado=None, error=None):
+    with _conexion() as con:
+        con.execute(
+            "UPDATE trabajos SET estado = CASE WHEN cancelar = 1 THEN ? WHEN ? IS NOT NULL THEN ? ELSE ? END, "
+            "resultado = CASE WHEN cancelar = 1 THEN NULL ELSE ? END, error = ?, terminado = ? WHERE id = ?",
+            (CANCELADO, error, ERROR, HECHO, json.dumps(resultado, ensure_ascii=False, default=str), error, time.time(), id_trabajo))
+
+
+# --- POOL DE TRABAJADORES ---
+
+_despertar = threading.Event()
+_pool = {"hilos": [], "lock": threading.Lock()}
+
+def _bucle_trabajador():
+    while True:
+        try:
+            trabajo = _reclamar_siguiente()
+        except sqlite3.Error:
+            logger.exception("No se pudo leer la cola de trabajos")
+            trabajo = None
+        if trabajo is None:
+            _despertar.wait(INTERVALO_SONDEO_S)
+            _despertar.clear()
+            continue
+        with span(f"job.{trabajo['tipo']}", "job", trabajo=trabajo["id"]):
+            try:
+                resultado = TIPOS[trabajo["tipo"]](trabajo["parametros"])
+            except Exception as e:
+                logger.exception("Trabajo %s (%s) fallido", trabajo["id"], trabajo["tipo"])
+                _terminar(trabajo["id"], error=f"{type(e).__name__}: {e}")
+            else:
+                _terminar(trabajo["id"], resultado=resultado)
+
+def _bucle_mantenimiento():
+    """Renueva el latido de los trabajos de este proceso y purga la cola de vez en cuando."""
+    ultima_purga = 0.0
+    while True:
+        try:
+            _latir()
+            if time.time() - ultima_purga >= INTERVALO_PURGA_S:
+                purgar()
+                ultima_purga = time.time()
+        except sqlite3.Error:
+            logger.exception("No se pudo mantener la cola de trabajos")
+        time.sleep(INTERVALO_LATIDO_S)
+
+def iniciar_trabajadores(n=MAX_TRABAJADORES):
+    """Arranca el pool una sola vez por proceso. Los trabajos que quedaron 'ejecutando' por la
+    caída de un proceso vuelven a la cola cuando caduca su latido (ver _recuperar_huerfanos)."""
+    with _pool["lock"]:
+        if _pool["hilos"]:
+            return
+        hilo = threading.Thread(target=_bucle_mantenimiento, name="trabajos-mantenimiento", daemon=True)
+        hilo.start()
+        _pool["hilos"].append(hilo)
+        for i in range(n):
+            hilo = threading.Thread(target=_bucle_trabajador, name=f"trabajador-{i}", daemon=True)
+            hilo.start()
+            _pool["hilos"].append(hilo)
@@ -0,0 +1,211 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+# --- TRAZAS DE LATENCIA Y TOKENS POR FASE ---
+# Spans alrededor de cada consulta a Supabase, llamada a Gemini y exportación, con sinks
+# intercambiables (log estructurado, JSON lines o memoria para el panel de depuración).
+# Desactivado, `span()` devuelve un objeto nulo compartido: coste de una comprobación.
+
+logger = logging.getLogger("probatio.trazas")
+
+_pestana_actual = contextvars.ContextVar("pestana_actual", default=None)
+_render_abierto = contextvars.ContextVar("render_abierto", default=None)
+
+
+class _Estado:
+    habilitado = False
+    sinks = []
+
+
+# --- SINKS ---
+
+class SinkLog:
+    def emitir(self, registro):
+        logger.info(json.dumps(registro, ensure_ascii=False))
+
+
+class SinkJSONL:
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+
+    def emitir(self, registro):
+        with self._lock, open(self.ruta, "a", encoding="utf-8") as f:
+            f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+
+
+class SinkMemoria:
+    """Guarda los últimos spans para el panel de depuración de la app."""
+
+    def __init__(self, capacidad=500):
+        self.registros = deque(maxlen=capacidad)
+
+    def emitir(self, registro):
+        self.registros.append(registro)
+
+    def mas_lentas(self, pestana=None, n=10):
+        candidatos = [r for r in list(self.registros) if pestana is None or r.get("pestana") == pestana]
+        return sorted(candidatos, key=lambda r: r["duracion_ms"], reverse=True)[:n]
+
+    def pestanas(self):
+        return sorted({r["pestana"] for r in list(self.registros) if r.get("pestana")})
+
+
+# --- CONFIGURACIÓN ---
+
+def configurar(habilitado, sinks=None):
+    _Estado.sinks = list(sinks or [])
+    _Estado.habilitado = bool(habilitado and _Estado.sinks)
+
+def configurar_desde_cadena(cadena):
+    """Acepta p. ej. "memoria,log,jsonl:/tmp/trazas.jsonl". Cadena vacía desactiva las trazas."""
+    sinks = []
+    for parte in [p.strip() for p in (cadena or "").split(",") if p.strip()]:
+        if parte == "log":
+            sinks.append(SinkLog())
+        elif parte == "memoria":
+            sinks.append(SinkMemoria())
+        elif parte.startswith("jsonl:"):
+            sinks.append(SinkJSONL(parte.split(":", 1)[1]))
+    configurar(bool(sinks), sinks)
+
+def habilitado():
+    return _Estado.habilitado
+
+def sink_memoria():
+    return next((s for s in _Estado.sinks if isinstance(s, SinkMemoria)), None)
+
+def iniciar_ejecucion():
+    """Al comenzar cada rerun descarta un span de render que quedara abierto (p. ej. por st.rerun())."""
+    _render_abierto.set(None)
+    _pestana_actual.set(None)
+
+def marcar_pestana(nombre):
+    """Etiqueta los spans siguientes con la pestaña que los origina y mide su tiempo total de render.
+
+    El span "render" de una pestaña se cierra al marcar la siguiente (o al pasar None al final
+    del script); restando los spans db/llm/export de esa pestaña queda el coste propio de Streamlit.
+    """
+    abierto = _render_abierto.get()
+    if abierto is not None:
+        abierto.__exit__(None, None, None)
+        _render_abierto.set(None)
+    _pestana_actual.set(nombre)
+    if nombre is not None and _Estado.habilitado:
+        render = Span(f"render.{nombre}", "render", {})
+        _render_abierto.set(render.__enter__())
+
+
+# --- SPANS ---
+
+class _SpanNulo:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def anotar(self, **atributos):
+        pass
+
+_SPAN_NULO = _SpanNulo()
+
+
+class Span:
+    def __init__(self, nombre, categoria, atributos):
+        self.registro = {"nombre": nombre, "categoria": categoria, "pestana": _pestana_actual.get(), **atributos}
+
+    def anotar(self, **atributos):
+        self.registro.update(atributos)
+
+    def __enter__(self):
+        # Hora de pared para el registro; el reloj monótono, para la duración
+        self.registro["inicio"] = time.time()
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo_exc, exc, tb):
+        self.registro["duracion_ms"] = round((time.perf_counter() - self._inicio) * 1000, 2)
+        if exc is not None:
+            self.registro["error"] = f"{tipo_exc.__name__}: {exc}"
+        for sink in _Estado.sinks:
+            try:
+                sink.emitir(self.registro)
+            except Exception:
+                logger.exception("Fallo al emitir la traza")
+        return False
+
+def span(nombre, categoria, **atributos):
+    if not _Estado.habilitado:
+        return _SPAN_NULO
+    return Span(nombre, categoria, atributos)
+
+
+# --- ENVOLTORIOS DE CLIENTES ---
+
+class _ConsultaTrazada:
+    """Proxy del constructor de consultas de Supabase: registra un span en cada `execute()`."""
+
+    def __init__(self, consulta, tabla, operaciones):
+        self._consulta = consulta
+        self._tabla = tabla
+        self._operaciones = operaciones
+
+    def __getattr__(self, nombre):
+        atributo = getattr(self._consulta, nombre)
+        if nombre == "execute":
+            def execute(*args, **kwargs):
+                with span(f"db.{self._tabla}", "db", tabla=self._tabla, operaciones=".".join(self._operaciones)) as s:
+                    respuesta = atributo(*args, **kwargs)
+                    datos = getattr(respuesta, "data", None)
+                    s.anotar(filas=len(datos) if isinstance(datos, list) else int(datos is not None))
+                    return respuesta
+            return execute
+        if callable(atributo):
+            return lambda *args, **kwargs: _ConsultaTrazada(atributo(*args, **kwargs), self._tabla, self._operaciones + [nombre])
+        return atributo
+
+
+class ClienteTrazado:
+    def __init__(self, cliente):
+        self._cliente = cliente
+
+    def table(self, nombre):
+        return _ConsultaTrazada(self._cliente.table(nombre), nombre, [])
+
+    def __getattr__(self, nombre):
+        return getattr(self._cliente, nombre)
+
+
+class ModeloTrazado:
+    """Proxy de GenerativeModel: registra latencia y tokens de prompt/respuesta de cada llamada."""
+
+    def __init__(self, modelo, operacion=None):
+        self._modelo = modelo
+        self._operacion = operacion
+
+    def generate_content(self, prompt, *args, **kwargs):
+        with span(f"llm.{self._operacion or 'generate_content'}", "llm", caracteres_prompt=len(str(prompt))) as s:
+            respuesta = self._modelo.generate_content(prompt, *args, **kwargs)
+            uso = getattr(respuesta, "usage_metadata", None)
+            if uso is not None:
+                s.anotar(tokens_prompt=getattr(uso, "prompt_token_count", None),
+                         tokens_respuesta=getattr(uso, "candidates_token_count", None))
+            return respuesta
+
+    def __getattr__(self, nombre):
+        return getattr(self._modelo, nombre)
+
+def envolver_cliente(cliente):
+    return ClienteTrazado(cliente) if _Estado.habilitado else cliente
+
+def envolver_modelo(modelo, operacion=None):
+    return ModeloTrazado(modelo, operacion) if _Estado.habilitado else modelo
+
+
+configurar_desde_cadena(os.environ.get("TRAZAS", ""))
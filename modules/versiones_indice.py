@@ -0,0 +1,184 @@
+import copy
+import json
+from datetime import datetime, timezone
+
+# --- REPOSITORIO DE VERSIONES DEL ÍNDICE CON DELTAS ---
+# `repositorio_indices` guarda cada versión como diferencia estructural respecto a la anterior,
+# con una instantánea completa cada SNAPSHOT_CADA versiones (o cuando el delta no ahorra nada).
+# Reconstruir cualquier versión aplica como mucho SNAPSHOT_CADA - 1 deltas. Cada entrada lleva
+# sus metadatos para listar versiones sin reconstruir ninguna.
+#
+# Entrada: {"nro", "version", "creado", "meta", "snapshot": indice}
+#       o  {"nro", "version", "creado", "meta", "base": nro_anterior, "delta": diferencia}
+# (más "origen" opcional: el trabajo que la creó, para no aplicarlo dos veces)
+# Las entradas antiguas (índices completos sin "nro") se leen como instantáneas y se compactan
+# la próxima vez que se añade una versión.
+
+SNAPSHOT_CADA = 10
+# Si el delta ocupa más que esta fracción de la instantánea, se guarda la instantánea
+MAX_FRACCION_DELTA = 0.6
+
+
+# --- DIFERENCIAS ESTRUCTURALES ---
+# {"~": "valor", "v": nuevo} sustituye; {"~": "dict", ...} recorre claves; {"~": "capitulos", ...}
+# compara listas de objetos con "nro" (los capítulos) por número, no por posición.
+
+def _es_lista_por_nro(valor):
+    return (isinstance(valor, list) and all(isinstance(x, dict) and "nro" in x for x in valor)
+            and len({str(x["nro"]) for x in valor}) == len(valor))
+
+def diferencia(a, b):
+    """Diferencia estructural de `a` a `b`, o None si son iguales."""
+    if a == b:
+        return None
+    if isinstance(a, dict) and isinstance(b, dict):
+        fijar = {k: v for k, v in b.items() if k not in a}
+        sub = {}
+        for k, v in b.items():
+            if k in a:
+                d = diferencia(a[k], v)
+                if d is not None:
+                    sub[k] = d
+        return {"~": "dict", "fijar": fijar, "sub": sub, "borrar": [k for k in a if k not in b]}
+    if _es_lista_por_nro(a) and _es_lista_por_nro(b):
+        previos = {str(x["nro"]): x for x in a}
+        sub, nuevos = {}, {}
+        for x in b:
+            clave = str(x["nro"])
+            if clave not in previos:
+                nuevos[clave] = x
+            else:
+                d = diferencia(previos[clave], x)
+                if d is not None:
+                    sub[clave] = d
+        return {"~": "capitulos", "orden": [x["nro"] for x in b], "sub": sub, "nuevos": nuevos}
+    return {"~": "valor", "v": b}
+
+def aplicar(a, d):
+    if d is None:
+        return copy.deepcopy(a)
+    tipo = d["~"]
+    if tipo == "valor":
+        return copy.deepcopy(d["v"])
+    if tipo == "dict":
+        resultado = {k: copy.deepcopy(v) for k, v in a.items() if k not in d["borrar"] and k not in d["sub"]}
+        resultado.update(copy.deepcopy(d["fijar"]))
+        for k, sub in d["sub"].items():
+            resultado[k] = aplicar(a[k], sub)
+        return resultado
+    if tipo == "capitulos":
+        previos = {str(x["nro"]): x for x in a}
+        resultado = []
+        for nro in d["orden"]:
+            clave = str(nro)
+            if clave in d["nuevos"]:
+                resultado.append(copy.deepcopy(d["nuevos"][clave]))
+            else:
+                resultado.append(aplicar(previos[clave], d["sub"].get(clave)))
+        return resultado
+    raise ValueError(f"Tipo de diferencia desconocido: {tipo}")
+
+
+# --- REPOSITORIO ---
+
+def _metadatos(indice):
+    return {"titulo_tesis": indice.get("titulo_tesis", ""), "capitulos": len(indice.get("capitulos", []))}
+
+def _normalizar_entradas(repositorio):
+    """Lee el repositorio en cualquier formato; las entradas antiguas pasan a ser instantáneas."""
+    entradas = []
+    for i, entrada in enumerate(repositorio or []):
+        if "nro" in entrada and ("snapshot" in entrada or "delta" in entrada):
+            entradas.append(entrada)
+        else:
+            indice = {k: v for k, v in entrada.items() if k != "version"}
+            entradas.append({"nro": i + 1, "version": entrada.get("version", f"V{i + 1}"), "creado": None,
+                             "meta": _metadatos(indice), "snapshot": indice, "legado": True})
+    return entradas
+
+def listar_versiones(repositorio):
+    """Metadatos de todas las versiones, sin reconstruir ninguna."""
+    return [{"nro": e["nro"], "version": e["version"], "creado": e.get("creado"), **e["meta"]}
+            for e in _normalizar_entradas(repositorio)]
+
+def reconstruir(repositorio, nro):
+    """Índice completo de la versión `nro` (con su clave "version", como antes)."""
+    por_nro = {e["nro"]: e for e in _normalizar_entradas(repositorio)}
+    cadena = []
+    entrada = por_nro[nro]
+    while "delta" in entrada:
+        cadena.append(entrada["delta"])
+        entrada = por_nro[entrada["base"]]
+    indice = copy.deepcopy(entrada["snapshot"])
+    for delta in reversed(cadena):
+        indice = aplicar(indice, delta)
+    indice["version"] = por_nro[nro]["version"]
+    return indice
+
+def _compactar(entradas):
+    """Convierte un repositorio del formato antiguo (todo índices completos) en instantáneas y deltas."""
+    compactadas, anterior, desde_snapshot = [], None, 0
+    for e in entradas:
+        indice = e["snapshot"]
+        entrada, es_snapshot = _entrada(e["nro"], e["version"], e["creado"], indice, anterior,
+                                        compactadas[-1]["nro"] if compactadas else None, desde_snapshot)
+        compactadas.append(entrada)
+        desde_snapshot = 0 if es_snapshot else desde_snapshot + 1
+        anterior = indice
+    return compactadas
+
+def _entrada(nro, version, creado, indice, anterior, nro_anterior, desde_snapshot):
+    base = {"nro": nro, "version": version, "creado": creado, "meta": _metadatos(indice)}
+    if anterior is not None and desde_snapshot < SNAPSHOT_CADA - 1:
+        delta = diferencia(anterior, indice)
+        tam_delta = len(json.dumps(delta, ensure_ascii=False))
+        if tam_delta <= MAX_FRACCION_DELTA * len(json.dumps(indice, ensure_ascii=False)):
+            return {**base, "base": nro_anterior, "delta": delta}, False
+    return {**base, "snapshot": indice}, True
+
+def tiene_origen(repositorio, origen):
+    """True si alguna versión se creó desde `origen` (p. ej. el id del trabajo que generó el índice)."""
+    return any(e.get("origen") == origen for e in repositorio or [])
+
+def agregar_version(repositorio, indice, nombre_proyecto, origen=None):
+    """Añade `indice` como nueva versión. Devuelve (repositorio_nuevo, indice_con_version)."""
+    entradas = _normalizar_entradas(repositorio)
+    if any(e.get("legado") for e in entradas):
+        # Proyecto con versiones en el formato antiguo: se compactan aprovechando la escritura
+        entradas = _compactar(entradas)
+
+    indice = {k: v for k, v in indice.items() if k != "version"}
+    nro = (entradas[-1]["nro"] + 1) if entradas else 1
+    version = f"V{nro} - {nombre_proyecto}"
+    anterior, desde_snapshot = None, 0
+    if entradas:
+        ultima = entradas[-1]
+        anterior = {k: v for k, v in reconstruir(entradas, ultima["nro"]).items() if k != "version"}
+        for e in reversed(entradas):
+            if "snapshot" in e:
+                break
+            desde_snapshot += 1
+    creado = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    entrada, _ = _entrada(nro, version, creado, indice, anterior, entradas[-1]["nro"] if entradas else None, desde_snapshot)
+    if origen is not None:
+        entrada["origen"] = origen
+    return entradas + [entrada], {**indice, "version": version}
+
+def comparar(repositorio, nro_a, nro_b):
+    """Resumen de cambios entre dos versiones: capítulos añadidos, eliminados y modificados."""
+    a, b = reconstruir(repositorio, nro_a), reconstruir(repositorio, nro_b)
+    caps_a = {str(c.get("nro")): c for c in a.get("capitulos", [])}
+    caps_b = {str(c.get("nro")): c for c in b.get("capitulos", [])}
+    modificados = []
+    for nro in caps_b:
+        if nro not in caps_a:
+            continue
+        campos = sorted(k for k in caps_a[nro].keys() | caps_b[nro].keys() if caps_a[nro].get(k) != caps_b[nro].get(k))
+        if campos:
+            modificados.append({"nro": caps_b[nro].get("nro"), "titulo": caps_b[nro].get("titulo", ""), "campos": campos})
+    return {
+        "titulo": (a.get("titulo_tesis"), b.get("titulo_tesis")) if a.get("titulo_tesis") != b.get("titulo_tesis") else None,
+        "añadidos": [caps_b[n] for n in caps_b if n not in caps_a],
+        "eliminados": [caps_a[n] for n in caps_a if n not in caps_b],
+        "modificados": modificados,
+    }
@@ -0,0 +1,81 @@
+import csv
+import io
+import json
+import os
+import time
+import zipfile
+from xml.etree import ElementTree
+
+import pytest
+
+from modules import concordancias
+from modules.lenguaje_consulta import ConsultaInvalidaError, compilar_consulta
+
+
+FILAS = [
+    ("Mencio", "Texto", {"id": 1, "Texto": "仁者愛人\n義也仁"}),
+    ("Xunzi", "Texto", {"id": 7, "Texto": "禮義之始"}),
+]
+
+
+@pytest.fixture(autouse=True)
+def corpus_falso(monkeypatch):
+    def iterar(tablas, consulta, errores=None):
+        for tabla, columna, fila in FILAS:
+            if tabla in tablas and consulta.coincide(fila[columna]):
+                yield tabla, columna, fila
+    monkeypatch.setattr(concordancias, "iterar_concordancias", iterar)
+
+
+def test_lineas_kwic_una_por_aparicion():
+    lineas = list(concordancias.lineas_kwic(["Mencio", "Xunzi"], compilar_consulta("仁"), contexto=2))
+    assert [(l["tabla"], l["desplazamiento"], l["nodo"]) for l in lineas] == [("Mencio", 0, "仁"), ("Mencio", 7, "仁")]
+    assert lineas[1]["izquierda"] == "義也"
+    assert lineas[0]["derecha"] == "者愛"
+
+def test_lineas_kwic_normaliza_espacios_del_contexto():
+    linea = next(concordancias.lineas_kwic(["Mencio"], compilar_consulta("義"), contexto=2))
+    assert linea["izquierda"] == "人 "
+
+def test_exportar_csv_con_bom():
+    salida = io.BytesIO()
+    assert concordancias.exportar_concordancias(["Mencio", "Xunzi"], "義", "csv", salida) == 2
+    contenido = salida.getvalue()
+    assert contenido.startswith(b"\xef\xbb\xbf")
+    filas = list(csv.DictReader(io.StringIO(contenido.decode("utf-8-sig"))))
+    assert [f["tabla"] for f in filas] == ["Mencio", "Xunzi"]
+    assert list(filas[0]) == list(concordancias.COLUMNAS)
+
+def test_exportar_jsonl():
+    salida = io.BytesIO()
+    concordancias.exportar_concordancias(["Xunzi"], "義", "jsonl", salida)
+    lineas = [json.loads(l) for l in salida.getvalue().decode("utf-8").splitlines()]
+    assert lineas == [{"tabla": "Xunzi", "id": 7, "desplazamiento": 1, "izquierda": "禮", "nodo": "義", "derecha": "之始"}]
+
+def test_exportar_xlsx_es_un_libro_valido():
+    salida = io.BytesIO()
+    assert concordancias.exportar_concordancias(["Mencio", "Xunzi"], "義", "xlsx", salida) == 2
+    with zipfile.ZipFile(io.BytesIO(salida.getvalue())) as libro:
+        assert {"[Content_Types].xml", "xl/workbook.xml", "xl/worksheets/sheet1.xml"} <= set(libro.namelist())
+        hoja = ElementTree.fromstring(libro.read("xl/worksheets/sheet1.xml"))
+    ns = {"s": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
+    filas = hoja.findall(".//s:row", ns)
+    assert len(filas) == 3
+    assert [t.text for t in filas[0].iter(f"{{{ns['s']}}}t")] == list(concordancias.COLUMNAS)
+
+def test_celda_xlsx_elimina_caracteres_de_control():
+    assert "\x01" not in concordancias._celda_xlsx("a\x01b")
+
+def test_consulta_solo_negativa_se_rechaza():
+    with pytest.raises(ConsultaInvalidaError):
+        concordancias.exportar_concordancias(["Mencio"], "NOT 仁", "csv", io.BytesIO())
+
+def test_limpiar_exportaciones_por_antiguedad(tmp_path, monkeypatch):
+    monkeypatch.setattr(concordancias, "DIRECTORIO_EXPORTACIONES", str(tmp_path))
+    viejo, nuevo = tmp_path / "viejo.csv", tmp_path / "nuevo.csv"
+    viejo.write_bytes(b"x")
+    nuevo.write_bytes(b"x")
+    antes = time.time() - concordancias.MAX_EDAD_EXPORTACION - 10
+    os.utime(viejo, (antes, antes))
+    concordancias.limpiar_exportaciones()
+    assert not viejo.exists() and nuevo.exists()
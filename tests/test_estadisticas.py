@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+import pytest
+
+from modules import estadisticas
+
+
+@pytest.fixture(autouse=True)
+def cache_temporal(tmp_path, monkeypatch):
+    monkeypatch.setattr(estadisticas, "DIRECTORIO_CACHE", str(tmp_path))
+    estadisticas._obras.clear()
+    yield
+    estadisticas._obras.clear()
+
+
+FRAGMENTOS = ["仁者愛人，義者宜也。", "仁義禮智，仁也。", "學而時習之"]
+
+
+def test_frecuencia_y_dispersion():
+    obra = estadisticas.cargar_obra("prueba", FRAGMENTOS)
+    resultado = obra.frecuencia("仁")
+    assert resultado["frecuencia"] == 3
+    assert resultado["rango"] == 2
+    assert resultado["fragmentos"] == 3
+    assert 0 < resultado["dp"] < 1
+    assert obra.frecuencia("鬼")["frecuencia"] == 0
+
+def test_frecuencia_insensible_a_variantes():
+    obra = estadisticas.cargar_obra("prueba", ["説文", "说话"])
+    assert obra.frecuencia("說")["frecuencia"] == 2
+
+def test_posiciones_no_cruzan_fragmentos():
+    obra = estadisticas.cargar_obra("prueba", ["甲仁", "義乙"])
+    assert len(obra.posiciones("仁義")) == 0
+
+def test_colocaciones_detecta_el_vecino_frecuente():
+    obra = estadisticas.cargar_obra("prueba", ["仁義" * 5 + "天地人"])
+    colocados = obra.colocaciones("仁", ventana=1, min_frecuencia=2)
+    assert colocados[0]["colocado"] == "义"
+    assert colocados[0]["frecuencia_conjunta"] >= 5
+    assert colocados[0]["ll"] > 0
+
+def test_cache_en_disco_reutiliza_la_codificacion():
+    obra = estadisticas.cargar_obra("prueba", FRAGMENTOS)
+    estadisticas._obras.clear()
+    recuperada = estadisticas.obra_cacheada(obra.clave)
+    assert recuperada is not None
+    assert np.array_equal(recuperada.ids, obra.ids)
+    assert estadisticas.obra_cacheada("inexistente") is None
+
+def test_unir_obras_equivale_a_codificar_la_union():
+    a, b = FRAGMENTOS[:2], FRAGMENTOS[2:]
+    unida = estadisticas.unir_obras({"b": estadisticas.cargar_obra("b", b), "a": estadisticas.cargar_obra("a", a)})
+    referencia = estadisticas.TablaObra.codificar("ref", a + b)
+    assert np.array_equal(unida.vocab, referencia.vocab)
+    assert np.array_equal(unida.ids, referencia.ids)
+    assert np.array_equal(unida.inicios, referencia.inicios)
+    assert unida.frecuencia("仁") == referencia.frecuencia("仁")
+
+def test_podar_disco_respeta_el_limite(monkeypatch):
+    estadisticas.cargar_obra("a", FRAGMENTOS)
+    monkeypatch.setattr(estadisticas, "MAX_MB_CACHE", 0)
+    estadisticas._podar_disco()
+    assert not [f for f in os.listdir(estadisticas.DIRECTORIO_CACHE) if f.endswith(".npz")]
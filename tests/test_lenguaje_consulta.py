@@ -0,0 +1,56 @@
+import pytest
+
+from modules.lenguaje_consulta import ConsultaInvalidaError, compilar_consulta
+
+
+@pytest.mark.parametrize("consulta, texto, esperado", [
+    ("仁", "仁者愛人", True),
+    ("仁", "義者宜也", False),
+    ("仁 義", "仁者愛人，義者宜也", True),
+    ("仁 AND 義", "仁者愛人", False),
+    ("仁 OR 義", "義者宜也", True),
+    ("情 NOT 性", "情者性之質也", False),
+    ("情 NOT 性", "情之應也", True),
+    ("仁 NEAR/3 義", "仁者愛人義也", True),
+    ("仁 NEAR/2 義", "仁者愛人義也", False),
+    ('"sheng ren"', "the Sheng Ren said", True),
+    ("/仁.義/", "仁之義", True),
+    ("(仁 OR 禮) NEAR/1 義", "禮義", True),
+])
+def test_coincide(consulta, texto, esperado):
+    assert compilar_consulta(consulta).coincide(texto) is esperado
+
+def test_coincide_con_variantes():
+    assert compilar_consulta("説").coincide("子说")
+
+@pytest.mark.parametrize("consulta", ["", "(仁", "仁 OR", '""', "/[/", "仁 NEAR NOT 義"])
+def test_consultas_invalidas(consulta):
+    with pytest.raises(ConsultaInvalidaError):
+        compilar_consulta(consulta)
+
+def test_literales_obligatorios():
+    assert compilar_consulta("仁義 禮").literales == ["仁义", "礼"]
+    assert compilar_consulta("仁 OR 義").literales == []
+    assert compilar_consulta("情 NOT 性").literales == ["情"]
+
+def test_es_literal():
+    assert compilar_consulta("仁").es_literal
+    assert not compilar_consulta("仁 義").es_literal
+
+def test_coincidencias_near_sin_solapes():
+    consulta = compilar_consulta("仁 NEAR/3 義")
+    assert consulta.coincidencias("仁者愛人義也仁") == [(0, 1), (4, 5), (6, 7)]
+
+def test_coincidencias_solapadas_gana_la_mas_larga():
+    assert compilar_consulta("仁 OR 仁義").coincidencias("仁義禮") == [(0, 2)]
+
+def test_coincidencias_solo_dentro_de_zonas_que_cumplen():
+    assert compilar_consulta("情 NOT 性").coincidencias("情性") == []
+    assert compilar_consulta("仁 NEAR/1 義").coincidencias("仁義……仁") == [(0, 1), (1, 2)]
+
+def test_terminos_positivos():
+    assert compilar_consulta("仁").tiene_terminos_positivos
+    assert not compilar_consulta("NOT 仁").tiene_terminos_positivos
+
+def test_resaltar():
+    assert compilar_consulta("仁 OR 義").resaltar("仁者義也", "<", ">") == "<仁>者<義>也"
@@ -0,0 +1,37 @@
+from modules.normalizacion import (
+    PLEGADO, buscar_posicion, normalizar, patron_variantes, sql_columna_normalizada, variantes_de
+)
+
+
+def test_plegado_uno_a_uno_conserva_longitud():
+    texto = "學而時習之，不亦說乎？孫子曰"
+    assert len(normalizar(texto)) == len(texto)
+    assert all(len(k) == 1 and len(v) == 1 for k, v in PLEGADO.items())
+
+def test_tradicional_y_variantes_pliegan_a_la_misma_forma():
+    assert normalizar("說") == normalizar("説") == normalizar("说")
+    assert normalizar("孫") == "孙"
+    assert normalizar("仁") == "仁"
+
+def test_normalizar_es_idempotente():
+    texto = "爲學日益，爲道日損"
+    assert normalizar(normalizar(texto)) == normalizar(texto)
+
+def test_variantes_incluye_la_original_primero():
+    formas = variantes_de("說")
+    assert formas[0] == "說"
+    assert {"说", "説"} <= set(formas)
+    assert variantes_de("仁") == ["仁"]
+
+def test_buscar_posicion_en_el_texto_original():
+    assert buscar_posicion("子曰：學而時習之", "学") == 3
+    assert buscar_posicion("Sheng Ren", "ren") == 6
+    assert buscar_posicion("子曰", "義") == -1
+
+def test_patron_variantes_casa_todas_las_grafias():
+    patron = patron_variantes("說")
+    assert all(patron.search(c) for c in "說説说")
+
+def test_sql_columna_normalizada():
+    sql = sql_columna_normalizada("Xunzi", "Texto")
+    assert '"Texto_norm"' in sql and "translate(" in sql and "gin_trgm_ops" in sql
@@ -0,0 +1,37 @@
+import pytest
+
+from modules.prompt_builder import (
+    MARCA_RECORTE, PRIORIDAD_HISTORIAL, PRIORIDAD_RAG, ConstructorPrompt, PresupuestoExcedidoError, estimar_tokens
+)
+
+
+def test_estimar_tokens_cjk_y_latino():
+    assert estimar_tokens("") == 0
+    assert estimar_tokens("仁義禮智") == 4
+    assert estimar_tokens("abcdefgh") == 2
+
+def test_construir_sin_recorte_si_cabe():
+    prompt = ConstructorPrompt("prueba", presupuesto=100).seccion("instrucciones", "a" * 40).seccion("rag", "b" * 40, PRIORIDAD_RAG)
+    assert prompt.estimacion()["cabe"]
+    assert prompt.construir() == "a" * 40 + "b" * 40
+
+def test_recorta_primero_la_prioridad_mas_baja():
+    prompt = (ConstructorPrompt("prueba", presupuesto=60)
+              .seccion("instrucciones", "i" * 40)
+              .seccion("rag", "r" * 200, PRIORIDAD_RAG)
+              .seccion("historial", "h" * 80, PRIORIDAD_HISTORIAL, recortar_desde="inicio"))
+    texto = prompt.construir()
+    assert "h" * 80 in texto
+    assert MARCA_RECORTE in texto
+    assert estimar_tokens(texto) <= 60
+
+def test_historial_se_recorta_desde_el_inicio():
+    prompt = (ConstructorPrompt("prueba", presupuesto=30)
+              .seccion("historial", "antiguo " * 20 + "RECIENTE", PRIORIDAD_HISTORIAL, recortar_desde="inicio"))
+    texto = prompt.construir()
+    assert texto.startswith(MARCA_RECORTE) and texto.endswith("RECIENTE")
+
+def test_falla_si_las_secciones_fijas_no_caben():
+    prompt = ConstructorPrompt("prueba", presupuesto=10).seccion("instrucciones", "x" * 400)
+    with pytest.raises(PresupuestoExcedidoError):
+        prompt.construir()
@@ -0,0 +1,42 @@
+from modules.redaccion import _etiquetar_notas, _firma, ensamblar, firma_parametros, planificar
+
+
+NOTAS = {"a": "nota a", "b": "nota b", "c": "nota c"}
+FIRMA = firma_parametros("prompt", "Español", "", "APA 7")
+
+
+def _estado(notas=NOTAS, firma=FIRMA):
+    """Estado como el que deja una redacción completa: s1 con las fichas a y b, s2 con c."""
+    return {"firma": firma, "siguiente": 3, "secciones": [
+        {"id": "s1", "titulo": "Uno", "fichas": {"a": _firma(notas["a"]), "b": _firma(notas["b"])}, "texto": "uno"},
+        {"id": "s2", "titulo": "Dos", "fichas": {"c": _firma(notas["c"])}, "texto": "dos"},
+    ]}
+
+
+def test_sin_estado_o_con_otros_parametros_se_redacta_entero():
+    assert planificar(None, NOTAS, FIRMA)["completa"]
+    otra_firma = firma_parametros("otro prompt", "Español", "", "APA 7")
+    assert planificar(_estado(), NOTAS, otra_firma)["completa"]
+
+def test_sin_cambios_se_reutiliza_todo():
+    plan = planificar(_estado(), NOTAS, FIRMA)
+    assert plan == {"completa": False, "reutilizar": ["s1", "s2"], "redactar": [], "eliminar": [], "nuevas": []}
+
+def test_ficha_cambiada_reescribe_solo_su_seccion():
+    plan = planificar(_estado(), {**NOTAS, "c": "nota c revisada"}, FIRMA)
+    assert plan["reutilizar"] == ["s1"] and plan["redactar"] == ["s2"]
+
+def test_ficha_retirada_y_ficha_nueva():
+    notas = {"a": NOTAS["a"], "b": NOTAS["b"], "d": "nota d"}
+    plan = planificar(_estado(), notas, FIRMA)
+    assert plan["eliminar"] == ["s2"]
+    assert plan["reutilizar"] == ["s1"]
+    assert plan["nuevas"] == ["d"]
+
+def test_ficha_retirada_de_una_seccion_compartida_la_reescribe():
+    plan = planificar(_estado(), {"a": NOTAS["a"], "c": NOTAS["c"]}, FIRMA)
+    assert plan["redactar"] == ["s1"]
+
+def test_ensamblar_y_etiquetar_notas():
+    assert ensamblar([{"titulo": "Uno", "texto": " a "}, {"titulo": "", "texto": "b"}]) == "## Uno\n\na\n\nb"
+    assert _etiquetar_notas("x[^1] y[^nota]", "s2") == "x[^s2-1] y[^s2-nota]"
@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+from modules.structured_output import (
+    ESQUEMA_FICHA, ESQUEMA_FICHA_LOTE, ESQUEMA_INDICE, LlamadaModeloError, SalidaEstructuradaError,
+    generar_estructurado, validar
+)
+
+
+class _Respuesta:
+    def __init__(self, texto):
+        self.text = texto
+
+
+class _ModeloFalso:
+    """Devuelve las respuestas en orden y guarda los prompts recibidos."""
+
+    def __init__(self, *respuestas):
+        self.respuestas = list(respuestas)
+        self.prompts = []
+
+    def generate_content(self, prompt, generation_config=None):
+        self.prompts.append(prompt)
+        respuesta = self.respuestas.pop(0)
+        if isinstance(respuesta, Exception):
+            raise respuesta
+        return _Respuesta(respuesta)
+
+
+FICHA = {"texto": "t", "cita_pie": "c", "referencia_bib": "r"}
+
+
+def test_validar_acepta_ficha_completa():
+    assert validar(FICHA, ESQUEMA_FICHA) == FICHA
+
+def test_validar_desenvuelve_lista_y_clave_envoltorio():
+    assert validar([FICHA], ESQUEMA_FICHA) == FICHA
+    assert validar({"Ficha": FICHA}, ESQUEMA_FICHA) == FICHA
+    assert validar({"fichas": [{"id": "a", **FICHA}]}, ESQUEMA_FICHA_LOTE) == [{"id": "a", **FICHA}]
+
+def test_validar_convierte_tipos_y_descarta_claves_extra():
+    indice = {"titulo_tesis": "T", "extra": 1,
+              "capitulos": [{"nro": "2", "titulo": 3, "objetivo": "o", "fichas_asociadas": ["a"]}]}
+    assert validar(indice, ESQUEMA_INDICE) == {
+        "titulo_tesis": "T", "capitulos": [{"nro": 2, "titulo": "3", "objetivo": "o", "fichas_asociadas": ["a"]}]}
+
+@pytest.mark.parametrize("datos", [
+    {"texto": "t", "cita_pie": "c"},
+    {"texto": ["t"], "cita_pie": "c", "referencia_bib": "r"},
+    "texto suelto",
+])
+def test_validar_rechaza_salidas_invalidas(datos):
+    with pytest.raises(SalidaEstructuradaError):
+        validar(datos, ESQUEMA_FICHA)
+
+def test_generar_sin_reparacion_si_la_salida_es_valida():
+    modelo = _ModeloFalso(json.dumps(FICHA))
+    assert generar_estructurado(modelo, "prompt", ESQUEMA_FICHA) == FICHA
+    assert len(modelo.prompts) == 1
+
+def test_generar_repara_una_vez_solo_con_la_salida_defectuosa():
+    modelo = _ModeloFalso('{"texto": "t"', json.dumps(FICHA))
+    assert generar_estructurado(modelo, "PROMPT ORIGINAL", ESQUEMA_FICHA) == FICHA
+    assert len(modelo.prompts) == 2
+    assert "PROMPT ORIGINAL" not in modelo.prompts[1]
+    assert '{"texto": "t"' in modelo.prompts[1]
+
+def test_generar_falla_si_la_reparacion_tampoco_valida():
+    modelo = _ModeloFalso("no es json", "sigue sin serlo")
+    with pytest.raises(SalidaEstructuradaError):
+        generar_estructurado(modelo, "prompt", ESQUEMA_FICHA)
+    assert len(modelo.prompts) == 2
+
+def test_fallo_de_la_api_se_convierte_en_llamada_modelo_error():
+    modelo = _ModeloFalso(ValueError("respuesta bloqueada"))
+    with pytest.raises(LlamadaModeloError, match="respuesta bloqueada"):
+        generar_estructurado(modelo, "prompt", ESQUEMA_FICHA)
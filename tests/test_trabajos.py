@@ -0,0 +1,71 @@
+import time
+
+import pytest
+
+from modules import trabajos
+
+
+@pytest.fixture(autouse=True)
+def cola_temporal(tmp_path, monkeypatch):
+    monkeypatch.setattr(trabajos, "RUTA_DB", str(tmp_path / "trabajos.sqlite3"))
+
+
+PARAMETROS = {"fichas": [{"id": "a", "texto": "仁"}]}
+
+
+def test_encolar_deduplica_dentro_del_mismo_proyecto():
+    primero = trabajos.encolar("indice", PARAMETROS, "p1", "Índice")
+    assert trabajos.encolar("indice", PARAMETROS, "p1", "Índice") == primero
+    assert trabajos.encolar("indice", {"fichas": []}, "p1", "Índice") != primero
+
+def test_encolar_no_comparte_trabajo_entre_proyectos():
+    assert trabajos.encolar("indice", PARAMETROS, "p1") != trabajos.encolar("indice", PARAMETROS, "p2")
+
+def test_encolar_tipo_desconocido():
+    with pytest.raises(ValueError):
+        trabajos.encolar("inexistente", {}, "p1")
+
+def test_aplicado_se_reclama_una_sola_vez():
+    id_trabajo = trabajos.encolar("indice", PARAMETROS, "p1")
+    trabajos._reclamar_siguiente()
+    trabajos._terminar(id_trabajo, resultado={"ok": True})
+    assert [t["id"] for t in trabajos.terminados_sin_aplicar("p1")] == [id_trabajo]
+    assert trabajos.marcar_aplicado(id_trabajo)
+    assert not trabajos.marcar_aplicado(id_trabajo)
+    assert trabajos.terminados_sin_aplicar("p1") == []
+    # Aplicado el resultado, el mismo encargo vuelve a ejecutarse
+    assert trabajos.encolar("indice", PARAMETROS, "p1") != id_trabajo
+
+def test_cancelar_pendiente():
+    id_trabajo = trabajos.encolar("indice", PARAMETROS, "p1")
+    trabajos.cancelar(id_trabajo)
+    assert trabajos.obtener(id_trabajo)["estado"] == trabajos.CANCELADO
+    assert trabajos._reclamar_siguiente() is None
+
+def test_cancelar_en_ejecucion_descarta_el_resultado():
+    id_trabajo = trabajos.encolar("indice", PARAMETROS, "p1")
+    trabajos._reclamar_siguiente()
+    trabajos.cancelar(id_trabajo)
+    trabajos._terminar(id_trabajo, resultado={"ok": True})
+    trabajo = trabajos.obtener(id_trabajo)
+    assert trabajo["estado"] == trabajos.CANCELADO
+    assert trabajo["resultado"] is None
+
+def test_solo_se_recuperan_trabajos_sin_latido():
+    id_trabajo = trabajos.encolar("indice", PARAMETROS, "p1")
+    trabajos._reclamar_siguiente()
+    assert trabajos._reclamar_siguiente() is None
+    with trabajos._conexion() as con:
+        con.execute("UPDATE trabajos SET latido = ? WHERE id = ?",
+                    (time.time() - trabajos.CADUCIDAD_LATIDO_S - 1, id_trabajo))
+    assert trabajos._reclamar_siguiente()["id"] == id_trabajo
+
+def test_purgar_borra_solo_los_cerrados_antiguos():
+    cerrado = trabajos.encolar("indice", PARAMETROS, "p1")
+    trabajos.cancelar(cerrado)
+    pendiente = trabajos.encolar("indice", {"fichas": []}, "p1")
+    with trabajos._conexion() as con:
+        con.execute("UPDATE trabajos SET terminado = 0 WHERE id = ?", (cerrado,))
+    assert trabajos.purgar() == 1
+    assert trabajos.obtener(cerrado) is None
+    assert trabajos.obtener(pendiente)["estado"] == trabajos.PENDIENTE
@@ -0,0 +1,70 @@
+import copy
+
+from modules import versiones_indice as vi
+
+
+def _indice(n, titulo="Tesis"):
+    return {"titulo_tesis": titulo,
+            "capitulos": [{"nro": i, "titulo": f"Capítulo {i}", "objetivo": "o" * 200, "fichas_asociadas": [str(i)]}
+                          for i in range(1, n + 1)]}
+
+
+def test_diferencia_y_aplicar_ida_y_vuelta():
+    a = _indice(3)
+    b = copy.deepcopy(a)
+    b["capitulos"][1]["titulo"] = "Otro"
+    b["capitulos"].append({"nro": 9, "titulo": "Nuevo", "objetivo": "", "fichas_asociadas": []})
+    del b["capitulos"][0]
+    b["extra"] = True
+    assert vi.aplicar(a, vi.diferencia(a, b)) == b
+    assert vi.diferencia(a, a) is None
+
+def test_reconstruir_todas_las_versiones():
+    repositorio, indices = [], []
+    for n in range(1, vi.SNAPSHOT_CADA + 4):
+        indice = _indice(n, titulo=f"Tesis {n % 3}")
+        repositorio, con_version = vi.agregar_version(repositorio, indice, "proy")
+        indices.append(indice)
+        assert con_version["version"] == f"V{n} - proy"
+    for n, indice in enumerate(indices, start=1):
+        reconstruido = vi.reconstruir(repositorio, n)
+        assert reconstruido.pop("version") == f"V{n} - proy"
+        assert reconstruido == indice
+
+def test_instantanea_periodica_y_deltas_entre_medias():
+    repositorio, indice = [], _indice(8)
+    for n in range(1, vi.SNAPSHOT_CADA + 2):
+        indice = copy.deepcopy(indice)
+        indice["capitulos"][n % 8]["titulo"] = f"Revisión {n}"
+        repositorio, _ = vi.agregar_version(repositorio, indice, "proy")
+    con_snapshot = [e["nro"] for e in repositorio if "snapshot" in e]
+    assert con_snapshot == [1, vi.SNAPSHOT_CADA + 1]
+
+def test_delta_que_no_ahorra_se_guarda_como_instantanea():
+    repositorio, _ = vi.agregar_version([], _indice(1), "proy")
+    repositorio, _ = vi.agregar_version(repositorio, _indice(4), "proy")
+    assert "snapshot" in repositorio[1]
+
+def test_formato_antiguo_se_lee_y_se_compacta():
+    antiguo = [{**_indice(2), "version": "V1 - proy"}, {**_indice(3), "version": "V2 - proy"}]
+    assert [v["version"] for v in vi.listar_versiones(antiguo)] == ["V1 - proy", "V2 - proy"]
+    repositorio, _ = vi.agregar_version(antiguo, _indice(4), "proy")
+    assert "delta" in repositorio[1]
+    assert {k: v for k, v in vi.reconstruir(repositorio, 2).items() if k != "version"} == _indice(3)
+
+def test_origen_evita_aplicar_dos_veces():
+    repositorio, _ = vi.agregar_version([], _indice(1), "proy", origen="trabajo1")
+    assert vi.tiene_origen(repositorio, "trabajo1")
+    assert not vi.tiene_origen(repositorio, "trabajo2")
+
+def test_comparar():
+    repositorio, _ = vi.agregar_version([], _indice(2), "proy")
+    b = _indice(3)
+    b["capitulos"][0]["titulo"] = "Cambiado"
+    del b["capitulos"][1]
+    repositorio, _ = vi.agregar_version(repositorio, b, "proy")
+    cambios = vi.comparar(repositorio, 1, 2)
+    assert [c["nro"] for c in cambios["añadidos"]] == [3]
+    assert [c["nro"] for c in cambios["eliminados"]] == [2]
+    assert cambios["modificados"] == [{"nro": 1, "titulo": "Cambiado", "campos": ["titulo"]}]
+    assert cambios["titulo"] is None